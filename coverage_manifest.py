@@ -0,0 +1,126 @@
+# Coverage manifest of the ERA5 monthly SURF/PLEV archive.
+# A JSON file next to the climate inputs records, for every monthly file, its
+# mtime, size, checksum and the hourly timesteps it is missing. A file is only
+# opened again when its mtime or size changed (newly downloaded, appended or
+# repaired), closed months are answered from the manifest. The checksum is only
+# computed once a month is complete, the current month changes with every daily
+# append and hashing it each time would read the whole file.
+
+import os
+import json
+import hashlib
+import pandas as pd
+import xarray as xr
+from time_probe import covers_hourly, probe_time
+
+
+def load_manifest(manifest_file):
+    """
+    Load the coverage manifest.
+
+    Parameters:
+    - manifest_file (str): Path to the JSON manifest.
+
+    Returns:
+    - manifest (dict): Entries by file name, empty if the manifest does not exist yet.
+    """
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_file):
+    """
+    Write the coverage manifest atomically.
+
+    Parameters:
+    - manifest (dict): Entries by file name.
+    - manifest_file (str): Path to the JSON manifest.
+    """
+    tmp_file = manifest_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, manifest_file)
+
+
+def file_checksum(file_path, chunk_size=16 * 1024**2):
+    """
+    Compute the blake2b checksum of a file, reading it in chunks.
+
+    Parameters:
+    - file_path (str): Path to the file.
+    - chunk_size (int): Bytes read at a time.
+
+    Returns:
+    - checksum (str): Hex digest.
+    """
+    digest = hashlib.blake2b()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan_coverage(file_path, start_date, end_date):
+    """
+    Find the hourly timesteps from start_date to end_date missing in a file.
+
+    Parameters:
+    - file_path (str): Path to the NetCDF file.
+    - start_date (pd.Timestamp): First expected timestep.
+    - end_date (pd.Timestamp): Last expected timestep.
+
+    Returns:
+    - missing (pd.DatetimeIndex): Missing timesteps.
+    """
+    expected_time_steps = pd.date_range(start=start_date, end=end_date, freq='h')
+    if covers_hourly(file_path, start_date, end_date):
+        return expected_time_steps[:0]
+    with xr.open_dataset(file_path) as ds:
+        actual_time_steps = pd.to_datetime(ds.time.values)
+    return expected_time_steps[~expected_time_steps.isin(actual_time_steps)]
+
+
+def missing_timesteps(file_path, start_date, end_date, manifest):
+    """
+    Return the missing hourly timesteps of a file, from the manifest if the file is unchanged.
+
+    New or changed files are scanned and their manifest entry (mtime, size, checksum,
+    first/last timestep, missing timesteps) is rewritten. The checksum is None until
+    the file is complete. A missing file drops its entry and raises FileNotFoundError.
+
+    Parameters:
+    - file_path (str): Path to the NetCDF file.
+    - start_date (pd.Timestamp): First expected timestep.
+    - end_date (pd.Timestamp): Last expected timestep.
+    - manifest (dict): Coverage manifest, updated in place.
+
+    Returns:
+    - missing (pd.DatetimeIndex): Missing timesteps.
+    """
+    name = os.path.basename(file_path)
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        manifest.pop(name, None)
+        raise
+
+    entry = manifest.get(name)
+    if (entry is not None and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size
+            and entry['start'] == str(start_date) and entry['end'] == str(end_date)):
+        return pd.DatetimeIndex(entry['missing'])
+
+    missing = scan_coverage(file_path, start_date, end_date)
+    probe = probe_time(file_path)
+    manifest[name] = {
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'checksum': file_checksum(file_path) if len(missing) == 0 else None,
+        'start': str(start_date),
+        'end': str(end_date),
+        'first': str(probe['first']),
+        'last': str(probe['last']),
+        'missing': [str(time) for time in missing],
+    }
+    return missing
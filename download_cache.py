@@ -0,0 +1,119 @@
+# Local cache of downloaded climate inputs (IFS open-data GRIB, ERA5 daily NetCDF).
+# Files are stored under a hash of the request (source, cycle date, cycle time,
+# steps, params, levels) so rerunning a stage for the same cycle costs no network
+# traffic. The cache is bounded in size and the least recently used files are
+# evicted first (a cache hit refreshes the file's mtime).
+
+import os
+import json
+import shutil
+import hashlib
+
+
+DEFAULT_MAX_BYTES = 20 * 1024**3
+
+
+def cache_key(source, date, time, steps, params, levels=None):
+    """
+    Build the cache key of a request.
+
+    Parameters:
+    - source (str): Data source, eg 'ecmwf' or 'cds-era5'.
+    - date (str): Cycle date, absolute (YYYYMMDD or YYYY-MM-DD).
+    - time (int or str): Cycle time.
+    - steps (list): Forecast steps or hours.
+    - params (list or str): Parameters.
+    - levels (list): Pressure levels, None for surface requests.
+
+    Returns:
+    - key (str): Hex digest identifying the request.
+    """
+    request = [source, str(date), str(time), list(steps),
+               sorted(params) if isinstance(params, (list, tuple)) else params,
+               sorted(levels) if levels is not None else None]
+    return hashlib.sha256(json.dumps(request).encode()).hexdigest()
+
+
+def cache_get(cache_dir, key, target):
+    """
+    Copy a cached file to target if present.
+
+    Parameters:
+    - cache_dir (str): Cache directory.
+    - key (str): Cache key.
+    - target (str): Path to copy the cached file to.
+
+    Returns:
+    - hit (bool): True if the file was in the cache.
+    """
+    cached_file = os.path.join(cache_dir, key)
+    if not os.path.exists(cached_file):
+        return False
+    # copy rather than link, the target may be modified in place downstream
+    shutil.copyfile(cached_file, target)
+    os.utime(cached_file)  # mark as recently used
+    print(f"Cache hit for {target}")
+    return True
+
+
+def cache_put(cache_dir, key, path, max_bytes=DEFAULT_MAX_BYTES):
+    """
+    Store a downloaded file in the cache and evict the least recently used files.
+
+    Parameters:
+    - cache_dir (str): Cache directory, created if needed.
+    - key (str): Cache key.
+    - path (str): Downloaded file.
+    - max_bytes (int): Maximum total size of the cache.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = os.path.join(cache_dir, key + ".tmp")
+    shutil.copyfile(path, tmp_file)
+    os.replace(tmp_file, os.path.join(cache_dir, key))
+    evict(cache_dir, max_bytes)
+
+
+def evict(cache_dir, max_bytes):
+    """
+    Delete the least recently used cache files until the cache fits in max_bytes.
+
+    Parameters:
+    - cache_dir (str): Cache directory.
+    - max_bytes (int): Maximum total size of the cache.
+    """
+    entries = [entry for entry in os.scandir(cache_dir) if entry.is_file() and not entry.name.endswith(".tmp")]
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        total -= entry.stat().st_size
+        os.remove(entry.path)
+        print(f"Evicted {entry.name} from cache")
+
+
+def cached_download(cache_dir, key, target, download, max_bytes=DEFAULT_MAX_BYTES, keep=None):
+    """
+    Get target from the cache, or download it and add it to the cache.
+
+    Parameters:
+    - cache_dir (str): Cache directory, None to disable caching.
+    - key (str): Cache key.
+    - target (str): Path of the file to provide.
+    - download (callable): Called without arguments to download target on a cache miss.
+    - max_bytes (int): Maximum total size of the cache.
+    - keep (callable): Optional check called with target after a download, the file is
+      only cached if it returns True (eg not for a day the source has not completed yet).
+
+    Returns:
+    - hit (bool): True if target came from the cache.
+    """
+    if cache_dir is not None and cache_get(cache_dir, key, target):
+        return True
+    download()
+    if cache_dir is not None:
+        if keep is None or keep(target):
+            cache_put(cache_dir, key, target, max_bytes)
+        else:
+            print(f"Not caching {target}")
+    return False
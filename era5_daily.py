@@ -0,0 +1,103 @@
+# Daily ERA5 downloads shared by run_master.py (repair of monthly files) and
+# run_master2.py (daily run, backfill). get_era5_snowmapper always writes into the
+# forecast directory of the climate path; a download can be moved to a scratch
+# directory right away so it is post-processed there, away from the live files.
+# Recent days come from ERA5T and may still miss hours when downloaded, only days
+# holding all 24 hours are added to the download cache.
+
+import os
+import shutil
+from datetime import datetime, timedelta
+from download_cache import cache_key, cached_download
+from time_probe import probe_time
+
+
+def era5_daily_path(mp, surf_plev, day):
+    """
+    Return the path get_era5_snowmapper writes one day of ERA5 to.
+
+    Parameters:
+    - mp (Topoclass): Topoclass object with the loaded configuration.
+    - surf_plev (str): 'surf' or 'plev'.
+    - day (datetime): Day.
+
+    Returns:
+    - path (str): <climate path>/forecast/SURF_YYYYMMDD.nc or PLEV_YYYYMMDD.nc.
+    """
+    return mp.config.climate.path + "/forecast/%s_%04d%02d%02d.nc" % (surf_plev.upper(), day.year, day.month, day.day)
+
+
+def is_complete_day(path, day):
+    """
+    Check from the header whether a daily ERA5 file holds all 24 hours of its day.
+
+    Parameters:
+    - path (str): Path to the daily file.
+    - day (datetime): Day of the file.
+
+    Returns:
+    - complete (bool): True if the time axis runs from 00:00 to 23:00 of day with 24 timesteps.
+    """
+    first_hour = datetime(day.year, day.month, day.day)
+    # CDS files written since the 2024 migration name the time axis valid_time
+    for time_var in ('time', 'valid_time'):
+        try:
+            probe = probe_time(path, time_var)
+        except KeyError:
+            continue
+        return (probe['length'] == 24 and probe['first'] == first_hour and
+                probe['last'] == first_hour + timedelta(hours=23))
+    return False
+
+
+def get_era5_cached(mp, surf_plev, day, cache_dir, target_dir=None):
+    """
+    Download one day of ERA5 with get_era5_snowmapper unless it is in the download cache.
+
+    Parameters:
+    - mp (Topoclass): Topoclass object with the loaded configuration.
+    - surf_plev (str): 'surf' or 'plev'.
+    - day (datetime): Day to download.
+    - cache_dir (str): Download cache directory (see download_cache.py).
+    - target_dir (str): Directory to provide the file in, default the forecast directory.
+      The day must not be in the forecast directory already, it would be moved.
+
+    Returns:
+    - path (str): Path to the downloaded daily file.
+    """
+    live = era5_daily_path(mp, surf_plev, day)
+    target = live if target_dir is None else os.path.join(target_dir, os.path.basename(live))
+
+    def download():
+        mp.get_era5_snowmapper(surf_plev, day)
+        if target != live:
+            os.replace(live, target)
+
+    era5_config = mp.config.climate.era5 or {}
+    levels = era5_config.get('plevels') if surf_plev == 'plev' else None
+    key = cache_key('cds-era5', day.strftime('%Y-%m-%d'), 'daily', range(24), surf_plev, levels)
+    # an incomplete ERA5T day is downloaded again next time instead of served from the cache
+    cached_download(cache_dir, key, target, download, keep=lambda path: is_complete_day(path, day))
+    return target
+
+
+def post_process_era5_day(mp, path):
+    """
+    Post-process one downloaded ERA5 day like the daily run does for the forecast directory.
+
+    The file is processed alone in a staging directory, so files still being downloaded
+    next to it are not touched, and moved back when done.
+
+    Parameters:
+    - mp (Topoclass): Topoclass object with the loaded configuration.
+    - path (str): Path to the downloaded SURF_YYYYMMDD.nc or PLEV_YYYYMMDD.nc.
+    """
+    staging_dir = os.path.join(os.path.dirname(path), 'staging', os.path.basename(path).split('.')[0])
+    os.makedirs(staging_dir, exist_ok=True)
+    staged = os.path.join(staging_dir, os.path.basename(path))
+    os.replace(path, staged)
+    if os.path.basename(path).startswith('SURF'):
+        mp.process_SURF_file(staging_dir)
+    mp.remap_netcdf(staging_dir)
+    os.replace(staged, path)
+    shutil.rmtree(staging_dir)
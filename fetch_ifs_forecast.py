@@ -20,192 +20,151 @@
 # we comput z at surfeca from  msl and sp and t
 
 from ecmwf.opendata import Client
+from ifs_opendata import poll_and_retrieve, FC1_STEPS, FC2_STEPS, PLEV_LEVELS
+from hindcast_archive import append_to_archive, open_archive, seed_archive
+import asyncio
 import glob
+import concurrent.futures
 import pandas as pd
 import sys
 import os
-from datetime import datetime, timedelta
 import xarray as xr
 import numpy as np
-from matplotlib import pyplot
-import matplotlib
-#matplotlib.use('TkAgg')
+import dask.array
 
 #mydir = sys.argv[1] # /home/joel/sim/TPS_2024
 
 
-directory_path = './master/inputs/climate/forecast/'
-
-# Check if the directory exists, and create it if it doesn't
-if not os.path.exists(directory_path):
-    os.makedirs(directory_path)
-
-os.chdir(directory_path)
-# data must be available by UTC+6 10am (Bishkek) eg 4am UTC, therefore need to use previous major fc step which is 12 UTC
-fctime = 0
-
-# removed implementation as the day is handle automatically based on last available fctime
-# can be used to specify precise forecasts up to three day ago
-mydate= 0 #  0 = today (default) -1 = yesterday -2 = day before yesterdaz -3 = day before that. Valid values 0-3.
-
-
-#outdir = './inputs/forecast/'
-# Check if the directory exists, and create it if it doesn't
-#if not os.path.exists(outdir):
-#    os.makedirs(outdir)
-#os.chdir(outdir)
-
-
-tmp_path = "tmp"
-# Check if the directory exists, and create it if it doesn't
-if not os.path.exists(tmp_path):
-    os.makedirs(tmp_path)
-
-os.chdir(tmp_path)
-# clean up
-files2delete = glob.glob("*")
-for file in files2delete:
-    os.remove(file)
-
-
-
-# print latest forecast data
-client = Client(source="ecmwf")
-print("latest forecast data available at:")
-print(client.latest(
-    type="fc",
-    step=24,
-    param=["2t", "msl"],
-    target="data.grib2",
-))
-
-# wait until this is 00 UTC (c. 9h UTC)
-
-#NOTE: The data is available between 7 and 9 hours after the forecast starting date and time, depending on the forecasting system and the time step specified.
-# - do forecast 9am  UTC ?
-
-# download surface variables at fc steps 0-144 available at 3h setp
-print("Downloading surface variables forecast steps 0-144")
-client = Client()
- 
-client.retrieve(
-    time=fctime,
-    date = mydate,
-     step=[i for i in range(0, 147, 3)], #147
-     type="fc",
-     param=["2t", "sp", "2d", "ssrd", "strd", "tp", "msl"],
-     target="SURF_fc1.grib2",
- )
-
-# download pressure variables at fc steps 0-144 available at 3h setp
-client = Client()
-print("Downloading pressure level variables forecast steps 0-144") 
-client.retrieve(
-    time=fctime,
-    date = mydate,
-     step=[i for i in range(0, 147, 3)], #147
-     type="fc",
-     param=["gh", "u", "v", "r", "q", "t"],
-     levelist=[1000, 925, 850, 700,600, 500, 400, 300],
-     target="PLEV_fc1.grib2",
- )
-
-
-# from ecmwf.opendata import Client
-
-# client = Client(source="ecmwf")
-
-# result = client.retrieve(
-#     type="fc",
-#     step=24,
-#     param=["gh"],
-#     target="data.grib2",
-# )
-
-# print(result.datetime)
-
-# ssrd strd sp ,2d, sp
-# gh, u, v, r,q,t
-
-# download surface variables at steps 150-244 available at 6h setp
-
- 
-client = Client()
-print("Downloading surface variables forecast steps 150-244") 
-client.retrieve(
-    time= fctime,
-    date = mydate,
-     step=[i for i in range(150, 241, 6)], # 144 start?
-     type="fc",
-     param=["2t", "sp", "2d", "ssrd", "strd", "tp", "msl"],
-     target="SURF_fc2.grib2",
- )
-
-# download pressure level variables at steps 150-244 available at 6h setp
-
- 
-client = Client()
-print("Downloading pressure level variables forecast steps 150-244") 
-client.retrieve(
-    time= fctime,
-    date = mydate,
-     step=[i for i in range(150, 241, 6)],
-     type="fc",
-     param=["gh", "u", "v", "r", "q", "t"],
-     levelist=[1000, 925, 850, 700, 500, 300],
-     target="PLEV_fc2.grib2",
- )
-
-print("converting grib to nc")
-# convert all gribs to nc ( do this in pure python cdo )
-cmd = "cdo -f nc copy SURF_fc1.grib2 SURF_fc1.nc"
-os.system(cmd)
-cmd = "cdo -f nc copy PLEV_fc1.grib2 PLEV_fc1.nc"
-os.system(cmd)
-cmd = "cdo -f nc copy SURF_fc2.grib2 SURF_fc2.nc"
-os.system(cmd)
-cmd = "cdo -f nc copy PLEV_fc2.grib2 PLEV_fc2.nc"
-os.system(cmd)
-#!ncview subset_SURF_fc1.nc
-#!ncview PLEV_fc1.nc
-
-# clean up big grib files
-files2delete = glob.glob("*grib2")
-for file in files2delete:
-    os.remove(file)
-
-files2delete = glob.glob("*grib2")
-for file in files2delete:
-    os.remove(file)
-
-
-print("Spatial subsetting and deaccumulation of precip and rad params")
-
-
-
-# Function to perform spatial subset on NetCDF file
+# Default settings of the forecast ingest, override any of them in the config passed to fetch_forecast
+FORECAST_CONFIG = {
+    # forecast directory, GRIB files are downloaded to its tmp/ subdirectory
+    'directory': './master/inputs/climate/forecast/',
+    # data must be available by UTC+6 10am (Bishkek) eg 4am UTC, therefore need to use previous major fc step which is 12 UTC
+    'fctime': 0,
+    # 0 = today (default) -1 = yesterday -2 = day before yesterdaz -3 = day before that. Valid values 0-3.
+    'mydate': 0,
+    # open-data source name or base URL
+    'source': 'ecmwf',
+    # Define the geographical subset (bounding box)
+    'lat_range': (32, 45),
+    'lon_range': (59, 81),
+    # GRIB decoding engine: "cfgrib" decodes in this process, "cdo" is the old
+    # `cdo -f nc copy` route kept as a fallback
+    'grib_engine': 'cfgrib',
+    # download cache, defaults to <directory>/cache
+    'cache_dir': None,
+    # write SURF_FC.nc / PLEV_FC.nc for the scripts that read them from disk
+    'write_files': True,
+    # ensemble: number of members processed together per task and number of worker processes
+    'ens_members_per_task': 3,
+    'ens_workers': os.cpu_count(),
+}
+
+
+# Function to perform spatial subset on NetCDF file or decoded dataset
 def spatial_subset(nc_file, lat_range, lon_range):
     # Open the NetCDF file
-    ds = xr.open_dataset(nc_file)
+    ds = xr.open_dataset(nc_file) if isinstance(nc_file, str) else nc_file
 
     # Extract latitudes and longitudes
     lat = ds['lat'].values
     lon = ds['lon'].values
 
     # Find the indices corresponding to the specified latitude and longitude ranges
-    lat_indices = (lat >= lat_range[0]) & (lat <= lat_range[1])
-    lon_indices = (lon >= lon_range[0]) & (lon <= lon_range[1])
+    lat_indices = np.flatnonzero((lat >= lat_range[0]) & (lat <= lat_range[1]))
+    lon_indices = np.flatnonzero((lon >= lon_range[0]) & (lon <= lon_range[1]))
 
-    # Perform spatial subset
-    subset = ds.sel(lat=lat[lat_indices], lon=lon[lon_indices])
+    # Perform spatial subset. The box is contiguous on the regular grid so slices are
+    # used, which lets lazily opened files (cfgrib, netcdf) read only the box
+    subset = ds.isel(lat=slice(lat_indices[0], lat_indices[-1] + 1),
+                     lon=slice(lon_indices[0], lon_indices[-1] + 1))
 
     return subset
 
 
+def decode_grib(grib_file, lat_range=None, lon_range=None, engine="cfgrib", ensemble=False,
+                filter_by_keys=None, indexpath=""):
+    """
+    Decode a GRIB file into an xarray Dataset laid out as `cdo -f nc copy` writes it.
 
+    If a bounding box is given it is applied while decoding: cfgrib crops each
+    message as it is read and cdo only writes the box (sellonlatbox), so the
+    global field is never held in memory or written to disk.
 
+    Variables keep their GRIB short names (2t, 2d, tp, gh, ...), the time axis is
+    the valid time, 2m fields carry a 'height' dimension and pressure levels are
+    given as 'plev' in Pa, so the rest of this script works on either engine.
+    Ensemble files (control and perturbed members) get a 'member' dimension, which
+    needs the cfgrib engine.
 
-
+    Parameters:
+    - grib_file (str): Path to the GRIB file.
+    - lat_range (tuple): Optional (min, max) latitude of the box.
+    - lon_range (tuple): Optional (min, max) longitude of the box.
+    - engine (str): "cfgrib" (in process) or "cdo" (subprocess, writes *_cdo.nc next to the GRIB).
+    - ensemble (bool): Keep the ensemble member number as a 'member' dimension.
+    - filter_by_keys (dict): cfgrib message filter, eg {"number": 5} for one ensemble member.
+    - indexpath (str): cfgrib index file, "" to index in memory on every call.
+
+    Returns:
+    - ds (xarray.Dataset): Decoded dataset.
+    """
+    if engine == "cfgrib":
+        try:
+            import cfgrib
+        except ImportError:
+            print("cfgrib not available, falling back to cdo")
+            engine = "cdo"
+
+    if engine == "cdo" and ensemble:
+        raise ValueError("Decoding ensemble members requires cfgrib.")
+
+    if engine == "cdo":
+        nc_file = grib_file.replace(".grib2", "_cdo.nc")
+        if lat_range is None:
+            os.system(f"cdo -f nc copy {grib_file} {nc_file}")
+        else:
+            box = f"{lon_range[0]},{lon_range[1]},{lat_range[0]},{lat_range[1]}"
+            os.system(f"cdo -f nc sellonlatbox,{box} {grib_file} {nc_file}")
+        with xr.open_dataset(nc_file) as ds:
+            return ds.load()
+
+    # cfgrib returns one dataset per hypercube (surface, 2m, msl, pressure levels)
+    datasets = []
+    backend_kwargs = {"indexpath": indexpath, "filter_by_keys": filter_by_keys or {}}
+    for ds in cfgrib.open_datasets(grib_file, backend_kwargs=backend_kwargs):
+        ds = ds.rename({name: ds[name].attrs.get("GRIB_shortName", name) for name in ds.data_vars})
+
+        # valid time as the time axis
+        if "step" in ds.dims:
+            ds = ds.swap_dims({"step": "valid_time"})
+        else:
+            ds = ds.expand_dims("valid_time")
+        ds = ds.drop_vars(["time", "step"], errors="ignore").rename({"valid_time": "time"})
+
+        if "heightAboveGround" in ds.coords:
+            ds = ds.rename({"heightAboveGround": "height"})
+            if "height" not in ds.dims:
+                ds = ds.expand_dims("height")
+        if "isobaricInhPa" in ds.coords:
+            ds = ds.rename({"isobaricInhPa": "plev"})
+            ds = ds.assign_coords(plev=ds["plev"] * 100.)
+            ds = ds.sortby("plev", ascending=False)
+        ds = ds.drop_vars(["surface", "meanSea"], errors="ignore")
+        if ensemble:
+            # the control forecast has a scalar member number 0, perturbed members a dimension
+            if "number" not in ds.dims:
+                ds = ds.expand_dims("number")
+            ds = ds.rename({"number": "member"})
+        else:
+            ds = ds.drop_vars("number", errors="ignore")
+        ds = ds.rename({"latitude": "lat", "longitude": "lon"})
+        if lat_range is not None:
+            ds = spatial_subset(ds, lat_range, lon_range)
+        # decode now, message by message, keeping only the box
+        datasets.append(ds.load())
+
+    return xr.merge(datasets)
 
 
 # Function to calculate geopotential height
@@ -240,477 +199,301 @@ def calculate_geopotential(P, T, P0):
 # print("Geopotential height at surface:", Z_surface, "m")
 
 
-# Define the geographical subset (bounding box)
-lat_range = (32, 45)  # Example latitude range (20N to 30N)
-lon_range = (59, 81)  # Example longitude range (30E to 40E)
-
-
-# Perform spatial subset on each NetCDF file
-nc_files = ['SURF_fc1.nc', 'SURF_fc2.nc'] # List of NetCDF files
-for nc_file in nc_files:
-    subset = spatial_subset(nc_file, lat_range, lon_range)
-   
-
-    # procees TP which is accumulated m since start of forecast (SURF_fc1.nc). Three important points:
-    # 1. Deaccumulate (current step - last first_24_steps)
-    # 2. Remove last timestep from SURF_fc1.nc from SURF_fc2.nc. _fc2 is a continuoation of fc1 just at differnet timestep
-    # 3. Devide by timestep to get accumulated m per hour (input to TopoPyScale, same as era5)
-
-    # try / except needed to handle different versions of api deliver tp/param193.1.0
-    try:
-        accumulated_var = subset["tp"]
-
-        if nc_file == "SURF_fc1.nc":
-            lasttimestep_forecast1_tp = accumulated_var.isel(time=-1)
-        if nc_file == "SURF_fc2.nc":
-            accumulated_var = accumulated_var - lasttimestep_forecast1_tp
-
-        # Calculate the difference between consecutive forecast steps manually, step (n) - step (n-1) in shift first timestep is filled with 0.
-        deaccumulated_var = accumulated_var - accumulated_var.shift(time=1, fill_value=0)
 
 
+# Function to de-accumulate forecast fields
+def deaccumulate(ds, var_names, steps):
+    """
+    De-accumulate forecast fields and convert them to amounts per hour.
 
-            # divide by timesteop to get accumulation over 1h
-        if nc_file == "SURF_fc1.nc":
-            deaccumulated_var = deaccumulated_var/3
-        if nc_file == "SURF_fc2.nc":
-            deaccumulated_var = deaccumulated_var/6
-
-        # rename
-        # deaccumulated_rename = deaccumulated_var.rename('tp')
-        # # Update the Dataset with the calculated variable
-        # subset['tp'] = deaccumulated_rename
-        # # Drop the variable from the Dataset
-        # subset = subset.drop_vars('param193.1.0')
-        # Update the Dataset with the calculated variable
-        subset['tp'] = deaccumulated_var
-
-    except:
-        accumulated_var = subset["param193.1.0"]
-
-        if nc_file == "SURF_fc1.nc":
-            lasttimestep_forecast1_tp = accumulated_var.isel(time=-1)
-        if nc_file == "SURF_fc2.nc":
-            accumulated_var = accumulated_var - lasttimestep_forecast1_tp
-
-        # Calculate the difference between consecutive forecast steps manually, step (n) - step (n-1) in shift first timestep is filled with 0.
-        deaccumulated_var = accumulated_var - accumulated_var.shift(time=1, fill_value=0)
-
-
-
-            # divide by timesteop to get accumulation over 1h
-        if nc_file == "SURF_fc1.nc":
-            deaccumulated_var = deaccumulated_var/3
-        if nc_file == "SURF_fc2.nc":
-            deaccumulated_var = deaccumulated_var/6
-
-        # rename
-        deaccumulated_rename = deaccumulated_var.rename('tp')
-        # Update the Dataset with the calculated variable
-        subset['tp'] = deaccumulated_rename
-        # Drop the variable from the Dataset
-        subset = subset.drop_vars('param193.1.0')
-        # Update the Dataset with the calculated variable
-
-
+    tp (m), ssrd and strd (J/m2) are accumulated since the start of the forecast. On the
+    concatenated 3h + 6h time axis the amount per hour ending at step n is
+    (acc[n] - acc[n-1]) / (step[n] - step[n-1]), which also covers the fc1 -> fc2 hand-off.
+    The first step is differenced against 0 and divided by the first step interval.
 
-    # procees SSRD which is accumulated J/m2 since start of forecast (SURF_fc1.nc). Three important points:
-    # 1. Deaccumulate (current step - last first_24_steps)
-    # 2. Remove last timestep from SURF_fc1.nc from SURF_fc2.nc. _fc2 is a continuoation of fc1 just at differnet timestep
-    # 3. Devide by timestep to get accumulated J/m2 per hour (input to TopoPyScale, same as era5)
-    accumulated_var = subset["ssrd"]
+    Parameters:
+    - ds (xarray.Dataset): Dataset with the accumulated variables along 'time'.
+    - var_names (list): Names of the accumulated variables.
+    - steps (list): Forecast step (h) of each timestep in ds.
 
-    if nc_file == "SURF_fc1.nc":
-        lasttimestep_forecast1_ssrd = accumulated_var.isel(time=-1)
-    if nc_file == "SURF_fc2.nc":
-        accumulated_var = accumulated_var - lasttimestep_forecast1_ssrd
+    Returns:
+    - ds (xarray.Dataset): Dataset with the variables replaced by their hourly amounts.
+    """
+    steps = np.asarray(steps)
+    if len(steps) != ds.sizes['time']:
+        raise ValueError(f"Got {len(steps)} steps for {ds.sizes['time']} timesteps.")
+    dt = np.diff(steps, prepend=2 * steps[0] - steps[1])
 
-    # Calculate the difference between consecutive forecast steps manually, step (n) - step (n-1) in shift first timestep is filled with 0.
-    deaccumulated_var = accumulated_var - accumulated_var.shift(time=1, fill_value=0)
+    for name in var_names:
+        var = ds[name]
+        axis = var.get_axis_num('time')
+        shape = [1] * var.ndim
+        shape[axis] = -1
+        values = np.diff(var.values, axis=axis, prepend=0) / dt.reshape(shape).astype(var.dtype)
+        ds[name] = var.copy(data=values)
 
+    return ds
 
 
-    # divide by timesteop to get accumulation over 1h
-    if nc_file == "SURF_fc1.nc":
-        deaccumulated_var = deaccumulated_var/3
-    if nc_file == "SURF_fc2.nc":
-        deaccumulated_var = deaccumulated_var/6
+# Function to interpolate the 3h/6h forecast steps to 1h
+def interpolate_to_hourly(ds, steps, flux_vars=()):
+    """
+    Interpolate a dataset on forecast steps to an hourly time axis.
 
-    # Update the Dataset with the calculated variable
-    subset['ssrd'] = deaccumulated_var
+    Instantaneous variables are interpolated linearly in time, as the chain of
+    cdo inttime calls did. De-accumulated fluxes are amounts per hour over the interval
+    ending at each step, so every hour in (step[n-1], step[n]] takes the value of step n,
+    which conserves the accumulated total.
 
+    Parameters:
+    - ds (xarray.Dataset): Dataset on the forecast steps along 'time'.
+    - steps (list): Forecast step (h) of each timestep in ds.
+    - flux_vars (list): Names of the de-accumulated variables.
 
-    # procees STRD which is accumulated J/m2 since start of forecast (SURF_fc1.nc). Three important points:
-    # 1. Deaccumulate (current step - last first_24_steps)
-    # 2. Remove last timestep from SURF_fc1.nc from SURF_fc2.nc. _fc2 is a continuoation of fc1 just at differnet timestep
-    # 3. Devide by timestep to get accumulated J/m2 per hour (input to TopoPyScale, same as era5)
-    accumulated_var = subset["strd"]
+    Returns:
+    - ds_hourly (xarray.Dataset): Dataset on hourly timesteps from the first to the last step.
+    """
+    steps = np.asarray(steps)
+    hours = np.arange(steps[0], steps[-1] + 1)
+    time = ds['time'].values[0] + (hours - steps[0]).astype('timedelta64[h]')
+
+    # hour h lies in (steps[upper - 1], steps[upper]]
+    upper = np.searchsorted(steps, hours, side='left')
+    lower = np.clip(upper - 1, 0, None)
+    upper = lower + 1
+    weight = (hours - steps[lower]) / (steps[upper] - steps[lower])
+    interval = np.searchsorted(steps, hours, side='left')
+
+    data_vars = {}
+    for name, var in ds.data_vars.items():
+        if 'time' not in var.dims:
+            data_vars[name] = var
+            continue
+        axis = var.get_axis_num('time')
+        values = var.values
+        if name in flux_vars:
+            hourly = np.take(values, interval, axis=axis)
+        else:
+            shape = [1] * var.ndim
+            shape[axis] = -1
+            w = weight.reshape(shape).astype(values.dtype)
+            hourly = np.take(values, lower, axis=axis) * (1 - w) + np.take(values, upper, axis=axis) * w
+        data_vars[name] = (var.dims, hourly, var.attrs)
+
+    coords = {name: coord for name, coord in ds.coords.items() if 'time' not in coord.dims}
+    coords['time'] = time
+    return xr.Dataset(data_vars, coords=coords, attrs=ds.attrs)
+
+
+def process_surf(surf_fc1, surf_fc2):
+    """
+    Turn the decoded SURF segments into TopoPyScale surface variables on the forecast steps.
 
-    if nc_file == "SURF_fc1.nc":
-        lasttimestep_forecast1_strd = accumulated_var.isel(time=-1)
-    if nc_file == "SURF_fc2.nc":
-        accumulated_var = accumulated_var - lasttimestep_forecast1_strd
-    # Calculate the difference between consecutive forecast steps manually, step (n) - step (n-1) in shift first timestep is filled with 0.
-    deaccumulated_var = accumulated_var - accumulated_var.shift(time=1, fill_value=0)
+    Parameters:
+    - surf_fc1 (xarray.Dataset): Decoded SURF steps 0-144 (3h).
+    - surf_fc2 (xarray.Dataset): Decoded SURF steps 150-240 (6h).
 
-    # divide by timesteop to get accumulation over 1h
-    if nc_file == "SURF_fc1.nc":
-        deaccumulated_var = deaccumulated_var/3
-    if nc_file == "SURF_fc2.nc":
-        deaccumulated_var = deaccumulated_var/6
+    Returns:
+    - surf (xarray.Dataset): Surface variables on the concatenated forecast steps.
+    """
+    # fc2 is a continuation of fc1 at a different timestep, concatenate both so the
+    # accumulated params are processed in one pass over the real step vector
+    surf = xr.concat([surf_fc1, surf_fc2], dim='time')
 
-    # Update the Dataset with the calculated variable
-    subset['strd'] = deaccumulated_var
-    # subset.ssrd[:,1,1].plot()
+    # different versions of the api deliver tp/param193.1.0
+    if 'param193.1.0' in surf:
+        surf = surf.rename({'param193.1.0': 'tp'})
 
-    # units tp = total precip over 3h timestep (to get mm/h divide by forecast step in h (3)
-    # ssrd strd  total jm-2 over forecast step (to get W/m2 divide by forecast step in s (3600*3)
+    # units tp = total precip over forecast step, ssrd strd total jm-2 over forecast step
+    # -> accumulation over 1h (input to TopoPyScale, same as era5)
+    surf = deaccumulate(surf, ['tp', 'ssrd', 'strd'], FC1_STEPS + FC2_STEPS)
 
-    subset = subset.rename({'lon': 'longitude', 'lat': 'latitude'})
-    subset = subset.rename({'2t': 't2m'})
-    subset = subset.rename({'2d': 'd2m'})
+    surf = surf.rename({'lon': 'longitude', 'lat': 'latitude'})
+    surf = surf.rename({'2t': 't2m'})
+    surf = surf.rename({'2d': 'd2m'})
 
     # compute geopotential z
-    subset['z'] = calculate_geopotential(subset['sp'], subset['t2m'], subset['msl'])
+    surf['z'] = calculate_geopotential(surf['sp'], surf['t2m'], surf['msl'])
 
     # Drop uneeded variables from the Dataset
-    subset = subset.drop_vars('msl')
-    subset = subset.squeeze('height', drop=True)
-
-    subset.to_netcdf(f'subset_{nc_file}')
+    surf = surf.drop_vars('msl')
+    surf = surf.squeeze('height', drop=True)
 
     # check de accumulation
-    # subset["param193.1.0"][:,40,40].plot()
-    # accumulation[:,40,40].plot()  
-    # plt.show() 
-
- 
-
-nc_files = glob.glob("PLEV*.nc")   # List of NetCDF files
-for nc_file in nc_files:
-    subset = spatial_subset(nc_file, lat_range, lon_range)
-    subset= subset.rename({'lon': 'longitude', 'lat': 'latitude', 'plev': 'level'})
-    subset['z'] = subset['gh']*9.81
-    subset['level'] = subset['level']/100.  # pressure level pa to hpa
-    subset = subset.isel(level=slice(None, None, -1) ) # reverse order of levels
-    # Drop uneeded variables from the Dataset
-    subset = subset.drop_vars('gh')
-    subset.to_netcdf(f'subset_{nc_file}')
-
-os.remove("SURF_fc1.nc")
-os.rename("subset_SURF_fc1.nc", "SURF_fc1.nc")
-
-os.remove("SURF_fc2.nc")
-os.rename("subset_SURF_fc2.nc", "SURF_fc2.nc")
-
-os.remove("PLEV_fc1.nc")
-os.rename("subset_PLEV_fc1.nc", "PLEV_fc1.nc")
-
-os.remove("PLEV_fc2.nc")
-os.rename("subset_PLEV_fc2.nc", "PLEV_fc2.nc")
-
-
-
-
-
-# interpolat 6h - 3h
-ds = xr.open_dataset("SURF_fc2.nc")
-# Interpolate the data from 6h to 3h timestep
-year = str(ds['time.year'][0].values)  # Extract hour and zero-pad if necessary
-month = str(ds['time.month'][0].values).zfill(2)  # Extract minute and zero-pad if necessary
-day = str(ds['time.day'][0].values).zfill(2)  # Extract second and zero-pad if necessary
-date_string = f"{year}-{month}-{day}"  # Concatenate into a single string
-
-hour = str(ds['time.hour'][0].values).zfill(2)  # Extract hour and zero-pad if necessary
-minute = str(ds['time.minute'][0].values).zfill(2)  # Extract minute and zero-pad if necessary
-second = str(ds['time.second'][0].values).zfill(2)  # Extract second and zero-pad if necessary
-time_string = f"{hour}:{minute}:{second}"  # Concatenate into a single string
-
-cmd = "cdo inttime,"+date_string+","+time_string+",3hour SURF_fc2.nc SURF_fc2_3h.nc"
-os.system(cmd)
-
-# interpolat 6h - 3h
-ds = xr.open_dataset("PLEV_fc2.nc")
-# Interpolate the data from 6h to 3h timestep
-year = str(ds['time.year'][0].values)  # Extract hour and zero-pad if necessary
-month = str(ds['time.month'][0].values).zfill(2)  # Extract minute and zero-pad if necessary
-day = str(ds['time.day'][0].values).zfill(2)  # Extract second and zero-pad if necessary
-date_string = f"{year}-{month}-{day}"  # Concatenate into a single string
-
-hour = str(ds['time.hour'][0].values).zfill(2)  # Extract hour and zero-pad if necessary
-minute = str(ds['time.minute'][0].values).zfill(2)  # Extract minute and zero-pad if necessary
-second = str(ds['time.second'][0].values).zfill(2)  # Extract second and zero-pad if necessary
-time_string = f"{hour}:{minute}:{second}"  # Concatenate into a single string
-
-cmd = "cdo inttime,"+date_string+","+time_string+",3hour PLEV_fc2.nc PLEV_fc2_3h.nc"
-os.system(cmd)
-
-
-
-# Open the first NetCDF file
-ds1 = xr.open_dataset('SURF_fc1.nc')
-
-# Open the second NetCDF file
-ds2 = xr.open_dataset('SURF_fc2_3h.nc')
-
-# Extract the last timestep of all variables in the first file
-last_timestep_first_file = ds1.isel(time=-1)
-
-# Extract the first timestep of all variables in the second file
-first_timestep_second_file = ds2.isel(time=0)
-
-# Calculate the average of the data
-average_ds = (last_timestep_first_file + first_timestep_second_file) / 2
-
-# Calculate the average between the last and first timesteps
-t1 = pd.to_datetime((ds1['time']))[-1]
-t2 = pd.to_datetime((ds2['time']))[0 ]
-
-# Convert Timestamps to numerical representation (seconds since epoch)
-t1_numeric = (t1 - datetime(1970, 1, 1)) / timedelta(seconds=1)
-t2_numeric = (t2 - datetime(1970, 1, 1)) / timedelta(seconds=1)
-
-# Calculate the average timestamp (seconds since epoch)
-average_numeric = (t1_numeric + t2_numeric) / 2
-
-# Convert average timestamp back to a Timestamp object
-average_timestamp = datetime.utcfromtimestamp(average_numeric)
-
-# Assign the time coordinate from the first file to the averaged dataset
-average_ds['time'] = average_timestamp
-
-ds_mean = average_ds.assign_coords(time=average_timestamp)
-
-# Concatenate the averaged time coordinate with the existing data along the time dimension
-ds_concatenated = xr.concat([ds1,ds_mean, ds2], dim='time')
-
-# Write the averaged data to a new NetCDF file
-ds_concatenated.to_netcdf( 'SURF_cat.nc')
-
-# interpolat 3h - 1h
-ds = xr.open_dataset('SURF_cat.nc')
-# Interpolate the data from 6h to 3h timestep
-year = str(ds['time.year'][0].values)  # Extract hour and zero-pad if necessary
-month = str(ds['time.month'][0].values).zfill(2)  # Extract minute and zero-pad if necessary
-day = str(ds['time.day'][0].values).zfill(2)  # Extract second and zero-pad if necessary
-date_string = f"{year}-{month}-{day}"  # Concatenate into a single string
-
-hour = str(ds['time.hour'][0].values).zfill(2)  # Extract hour and zero-pad if necessary
-minute = str(ds['time.minute'][0].values).zfill(2)  # Extract minute and zero-pad if necessary
-second = str(ds['time.second'][0].values).zfill(2)  # Extract second and zero-pad if necessary
-time_string = f"{hour}:{minute}:{second}"  # Concatenate into a single string
-
-cmd = "cdo inttime,"+date_string+","+time_string+",1hour "+  "SURF_cat.nc "   +"SURF_cat_1h.nc"
-os.system(cmd)
-
-
-
-# Open the first NetCDF file
-ds1 = xr.open_dataset('PLEV_fc1.nc')
-
-# Open the second NetCDF file
-ds2 = xr.open_dataset('PLEV_fc2_3h.nc')
-
-# Extract the last timestep of all variables in the first file
-last_timestep_first_file = ds1.isel(time=-1)
-
-# Extract the first timestep of all variables in the second file
-first_timestep_second_file = ds2.isel(time=0)
-
-# Calculate the average of the data
-average_ds = (last_timestep_first_file + first_timestep_second_file) / 2
-
-# Calculate the average between the last and first timesteps
-t1 = pd.to_datetime((ds1['time']))[-1]
-t2 = pd.to_datetime((ds2['time']))[0 ]
-
-# Convert Timestamps to numerical representation (seconds since epoch)
-t1_numeric = (t1 - datetime(1970, 1, 1)) / timedelta(seconds=1)
-t2_numeric = (t2 - datetime(1970, 1, 1)) / timedelta(seconds=1)
-
-# Calculate the average timestamp (seconds since epoch)
-average_numeric = (t1_numeric + t2_numeric) / 2
-
-# Convert average timestamp back to a Timestamp object
-average_timestamp = datetime.utcfromtimestamp(average_numeric)
-
-# Assign the time coordinate from the first file to the averaged dataset
-average_ds['time'] = average_timestamp
-
-ds_mean = average_ds.assign_coords(time=average_timestamp)
-
-# Concatenate the averaged time coordinate with the existing data along the time dimension
-ds_concatenated = xr.concat([ds1,ds_mean, ds2], dim='time')
-
-# Write the averaged data to a new NetCDF file
-ds_concatenated.to_netcdf('PLEV_cat.nc')
-
-
-# interpolat 3h - 1h
-ds = xr.open_dataset('PLEV_cat.nc')
-year = str(ds['time.year'][0].values)  # Extract hour and zero-pad if necessary
-month = str(ds['time.month'][0].values).zfill(2)  # Extract minute and zero-pad if necessary
-day = str(ds['time.day'][0].values).zfill(2)  # Extract second and zero-pad if necessary
-date_string = f"{year}-{month}-{day}"  # Concatenate into a single string
-
-hour = str(ds['time.hour'][0].values).zfill(2)  # Extract hour and zero-pad if necessary
-minute = str(ds['time.minute'][0].values).zfill(2)  # Extract minute and zero-pad if necessary
-second = str(ds['time.second'][0].values).zfill(2)  # Extract second and zero-pad if necessary
-time_string = f"{hour}:{minute}:{second}"  # Concatenate into a single string
-
-cmd = "cdo inttime,"+date_string+","+time_string+",1hour " +"PLEV_cat.nc " +"PLEV_cat_1h.nc"
-os.system(cmd)
-
-# cleanup
-os.rename("SURF_cat_1h.nc",  "../SURF_FC.nc")
-os.rename( "PLEV_cat_1h.nc",  "../PLEV_FC.nc")
-
-# handle final compatability issues here
+    # surf["tp"][:,40,40].plot()
+    # plt.show()
+    return surf
 
-# creste hindcast product
-ds1 = xr.open_dataset("../PLEV_FC.nc")
-# first day of forecast
-thind = pd.to_datetime((ds1['time']))[0:24]
-day = str(thind[0])[0:10]  
-first_24_steps = ds1.isel(time=slice(0, 24))  
-first_24_steps.to_netcdf( '../PLEV_FC_'+day+'.nc', mode='w')
 
-ds1 = xr.open_dataset("../SURF_FC.nc")
-# first day of forecast
-thind = pd.to_datetime((ds1['time']))[0:24]
-day = str(thind[0])[0:10]  
-first_24_steps = ds1.isel(time=slice(0, 24))  
-
-# Check if file exists and delete it - was havingfile locked issues, mod='w' seems to work'
-# if os.path.exists(file_path):
-#     os.remove(file_path)
-#     print(f"Deleted existing file: {file_path}")
-# else:
-#     print(f"No existing file found at: {file_path}")
-
-first_24_steps.to_netcdf( '../SURF_FC_'+day+'.nc', mode='w')
-
-
-
-# cleanup
-
-## Define the pattern to match files (e.g., all .csv files in the current directory)
-#pattern = "*fc*"
-
-## Find all files matching the pattern
-#files_to_remove = glob.glob(pattern)
-
-## Loop through the list of files and remove each one
-#for file_path in files_to_remove:
-#    try:
-#        os.remove(file_path)
-#        print(f"Removed file: {file_path}")
-#    except OSError as e:
-#        print(f"Error removing file: {file_path}, {e}")
-
-
-# Concatenate PLEV
-
-
-# Check if file exists and delete it - was havingfile locked issues, mod='w' seems to work'
-file_path = "PLEV_merged.nc"
-if os.path.exists(file_path):
-    os.remove(file_path)
-    print(f"Deleted existing file: {file_path}")
-else:
-    print(f"No existing file found at: {file_path}")
-
-
-cmd = "cdo --sortname mergetime  ../PLEV_FC* PLEV_merged.nc" # this triggers warning
-os.system(cmd)
-
-# remove duplicate timestamp
-
-
-# Load the merged NetCDF file
-ds = xr.open_dataset('PLEV_merged.nc')
-
-# Convert the time coordinates to a pandas DateTimeIndex
-time_index = pd.to_datetime(ds['time'].values)
-
-# Identify duplicate timestamps
-duplicates = time_index[time_index.duplicated()]
-
-if len(duplicates) > 0:
-    print("Duplicate timestamps found:")
-    print(duplicates)
-else:
-    print("No duplicate timestamps found.")
-
-# Identify duplicate timestamps
-_, unique_indices = np.unique(time_index, return_index=True)
-
-# Select only the unique timestamps
-ds_unique = ds.isel(time=unique_indices)
-
-file_path = '../PLEV_FC.nc'
-if os.path.exists(file_path):
-    os.remove(file_path)
-    print(f"Deleted existing file: {file_path}")
-else:
-    print(f"No existing file found at: {file_path}")
-
-# Save the cleaned dataset to a new NetCDF file
-ds_unique.to_netcdf(file_path)
-
-print("Duplicate timestamps removed. Cleaned Hindcast and forecast dataset saved as ./master/inputs//climate/forecast/PLEV_FC.nc")
-
-
-# Check if file exists and delete it - was havingfile locked issues, mod='w' seems to work'
-file_path = "SURF_merged.nc"
-if os.path.exists(file_path):
-    os.remove(file_path)
-    print(f"Deleted existing file: {file_path}")
-else:
-    print(f"No existing file found at: {file_path}")
-
-# Concatenate SURF
-cmd = "cdo --sortname mergetime  ../SURF_FC* SURF_merged.nc"
-os.system(cmd)
-
-
-# remove duplicate timestamp
+def harmonise_levels(ds, levels):
+    """
+    Interpolate all pressure level variables onto a given set of levels, linearly in log-pressure.
 
+    The interpolation is one vectorized operation over all times, gridpoints and variables.
+    Levels already present are reproduced exactly, levels outside the range of ds are NaN.
 
+    Parameters:
+    - ds (xarray.Dataset): Dataset with a 'level' dimension in hPa.
+    - levels (list): Target pressure levels in hPa.
 
-# Load the merged NetCDF file
-ds = xr.open_dataset('SURF_merged.nc')
+    Returns:
+    - ds (xarray.Dataset): Dataset on levels, in ascending order like process_plev output.
+    """
+    ds = ds.sortby('level')
+    source = np.log(ds['level'].values)
+    target = np.log(np.sort(np.asarray(levels, dtype=float)))
+
+    # bracketing source levels and weight of the upper one for every target level
+    upper = np.clip(np.searchsorted(source, target), 1, len(source) - 1)
+    lower = upper - 1
+    weight = (target - source[lower]) / (source[upper] - source[lower])
+    weight[(target < source[0]) | (target > source[-1])] = np.nan
+
+    # indexers without a level coordinate, it would conflict with the source levels picked
+    lower = xr.DataArray(lower, dims='level')
+    upper = xr.DataArray(upper, dims='level')
+    weight = xr.DataArray(weight, dims='level')
+
+    level_vars = [name for name in ds.data_vars if 'level' in ds[name].dims]
+    below = ds[level_vars].isel(level=lower).drop_vars('level')
+    above = ds[level_vars].isel(level=upper).drop_vars('level')
+    harmonised = below + (above - below) * weight
+    harmonised = harmonised.assign_coords(level=np.round(np.exp(target), 6))
+    return xr.merge([harmonised, ds.drop_dims('level')])
+
+
+def process_plev(plev_fc1, plev_fc2, levels=PLEV_LEVELS):
+    """
+    Turn the decoded PLEV segments into TopoPyScale pressure level variables on the forecast steps.
 
-# Convert the time coordinates to a pandas DateTimeIndex
-time_index = pd.to_datetime(ds['time'].values)
+    Both segments are mapped onto the same levels before they are joined, steps 150-240
+    are published on fewer levels and concatenating as is would pad them with NaN.
 
-# Identify duplicate timestamps
-duplicates = time_index[time_index.duplicated()]
+    Parameters:
+    - plev_fc1 (xarray.Dataset): Decoded PLEV steps 0-144 (3h).
+    - plev_fc2 (xarray.Dataset): Decoded PLEV steps 150-240 (6h).
+    - levels (list): Pressure levels (hPa) of the output.
 
-if len(duplicates) > 0:
-    print("Duplicate timestamps found:")
-    print(duplicates)
-else:
-    print("No duplicate timestamps found.")
+    Returns:
+    - plev (xarray.Dataset): Pressure level variables on the concatenated forecast steps.
+    """
+    plev_segments = []
+    for subset in [plev_fc1, plev_fc2]:
+        subset= subset.rename({'lon': 'longitude', 'lat': 'latitude', 'plev': 'level'})
+        subset['z'] = subset['gh']*9.81
+        subset['level'] = subset['level']/100.  # pressure level pa to hpa
+        subset = subset.isel(level=slice(None, None, -1) ) # reverse order of levels
+        # Drop uneeded variables from the Dataset
+        subset = subset.drop_vars('gh')
+        plev_segments.append(harmonise_levels(subset, levels))
+    return xr.concat(plev_segments, dim='time')
+
+
+def hindcast_product(prefix, ds_fc, forecast_dir):
+    """
+    Archive the first forecast day and join the hindcast to the forecast.
 
-# Identify duplicate timestamps
-_, unique_indices = np.unique(time_index, return_index=True)
+    The first day of every forecast is kept as <prefix>_FC_<day>.nc and written to the
+    hindcast archive (hindcast_archive.py). The hindcast + forecast product is the
+    archive up to the start of this forecast followed by the forecast.
 
-# Select only the unique timestamps
-ds_unique = ds.isel(time=unique_indices)
+    Parameters:
+    - prefix (str): 'SURF' or 'PLEV'.
+    - ds_fc (xarray.Dataset): Hourly forecast.
+    - forecast_dir (str): Forecast directory.
 
-file_path = '../SURF_FC.nc'
-if os.path.exists(file_path):
-    os.remove(file_path)
-    print(f"Deleted existing file: {file_path}")
-else:
-    print(f"No existing file found at: {file_path}")
+    Returns:
+    - ds_merged (xarray.Dataset): Hindcast and forecast dataset.
+    """
+    store = os.path.join(forecast_dir, f"hindcast_{prefix}.zarr")
+    # one-off: build the archive from the daily files of earlier runs
+    seed_archive(store, os.path.join(forecast_dir, f"{prefix}_FC_*.nc"))
+
+    # first day of forecast
+    day = str(pd.to_datetime(ds_fc['time'].values[0]))[0:10]
+    first_24_steps = ds_fc.isel(time=slice(0, 24))
+    first_24_steps.to_netcdf(os.path.join(forecast_dir, f'{prefix}_FC_{day}.nc'), mode='w')
+    append_to_archive(first_24_steps, store)
+
+    # as with the former mergetime of {prefix}_FC*, only days whose daily file is still
+    # present (not yet superseded by ERA5, see handle_forecast_file) are used
+    days = [os.path.basename(f)[len(prefix) + 4:-3] for f in glob.glob(os.path.join(forecast_dir, f'{prefix}_FC_*.nc'))]
+    hindcast = open_archive(store)
+    keep = hindcast['time'].dt.strftime('%Y-%m-%d').isin(days) & (hindcast['time'] < ds_fc['time'].values[0])
+    hindcast = hindcast.isel(time=np.flatnonzero(keep.values))
+    return xr.concat([hindcast, ds_fc], dim='time')
+
+
+def fetch_forecast(config=None):
+    """
+    Download and process the IFS open-data forecast.
 
+    Runs in the calling interpreter without changing the working directory, so a driver
+    such as run_master2.py can pass the returned datasets on in memory.
 
-# Save the cleaned dataset to a new NetCDF file
-ds_unique.to_netcdf(file_path)
+    Parameters:
+    - config (dict): Settings overriding FORECAST_CONFIG.
 
-print("Duplicate timestamps removed. Cleaned Hindcast and forecast dataset saved as ./master/inputs/climate/forecast/SURF_FC.nc")
+    Returns:
+    - surf_ds (xarray.Dataset): Hourly SURF hindcast and forecast (as SURF_FC.nc).
+    - plev_ds (xarray.Dataset): Hourly PLEV hindcast and forecast (as PLEV_FC.nc).
+    """
+    config = {**FORECAST_CONFIG, **(config or {})}
+    forecast_dir = config['directory']
+    tmp_path = os.path.join(forecast_dir, "tmp")
+    cache_dir = config['cache_dir'] or os.path.join(forecast_dir, "cache")
+    lat_range, lon_range = config['lat_range'], config['lon_range']
+
+    # Check if the directory exists, and create it if it doesn't
+    os.makedirs(tmp_path, exist_ok=True)
+    # clean up
+    for file in glob.glob(os.path.join(tmp_path, "*")):
+        os.remove(file)
+
+    # data are released between 7 and 9 hours after the forecast start, depending on the
+    # step. Poll the index files of the chosen cycle and fetch each request (SURF/PLEV,
+    # steps 0-144 at 3h and 150-240 at 6h) as soon as all its steps are published.
+    # Downloads are cached outside tmp/ so a rerun of the same cycle is not downloaded again
+    print("Waiting for and downloading surface and pressure level variables forecast steps 0-240")
+    client = Client(source=config['source'])
+    asyncio.run(poll_and_retrieve(config['fctime'], config['mydate'], source=config['source'], client=client,
+                                  cache_dir=cache_dir, directory=tmp_path))
+
+    print("Decoding grib")
+    decoded = {name: decode_grib(os.path.join(tmp_path, f"{name}.grib2"), lat_range, lon_range,
+                                 engine=config['grib_engine'])
+               for name in ["SURF_fc1", "SURF_fc2", "PLEV_fc1", "PLEV_fc2"]}
+
+    print("Deaccumulation of precip and rad params")
+    surf = process_surf(decoded['SURF_fc1'], decoded['SURF_fc2'])
+    plev = process_plev(decoded['PLEV_fc1'], decoded['PLEV_fc2'])
+
+    # clean up big grib files
+    for ds in decoded.values():
+        ds.close()
+    files2delete = glob.glob(os.path.join(tmp_path, "*grib2")) + glob.glob(os.path.join(tmp_path, "*_cdo.nc"))
+    for file in files2delete:
+        os.remove(file)
+
+    # interpolate 3h/6h - 1h in memory
+    print("Interpolating forecast to 1h")
+    steps = FC1_STEPS + FC2_STEPS
+    surf_fc = interpolate_to_hourly(surf, steps, flux_vars=['tp', 'ssrd', 'strd'])
+    plev_fc = interpolate_to_hourly(plev, steps)
+
+    # handle final compatability issues here
+
+    products = {}
+    for prefix, ds_fc in [("PLEV", plev_fc), ("SURF", surf_fc)]:
+        products[prefix] = hindcast_product(prefix, ds_fc, forecast_dir)
+        if config['write_files']:
+            file_path = os.path.join(forecast_dir, f'{prefix}_FC.nc')
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            products[prefix].to_netcdf(file_path)
+            print(f"Hindcast and forecast dataset saved as {file_path}")
+
+    return products["SURF"], products["PLEV"]
 
 
 # os.remove("PLEV_cat.nc")
@@ -866,5 +649,188 @@ def trim_forecast_data2(climate_file, forecast_file, output_file,last_joint_time
 # trimmed_ds2.to_netcdf('../climate/PLEV_fc.nc' , unlimited_dims=[])
 
 
+def index_grib(grib_file):
+    """
+    Index a GRIB file once and list the ensemble members it holds.
+
+    The cfgrib index is written next to the file (<file>.idx), decoding single members
+    with filter_by_keys then reads only their messages instead of scanning the file again.
+
+    Parameters:
+    - grib_file (str): Path to the GRIB file.
+
+    Returns:
+    - members (list): Sorted ensemble member numbers (0 is the control forecast).
+    """
+    import cfgrib
+    members = set()
+    for ds in cfgrib.open_datasets(grib_file, backend_kwargs={"indexpath": grib_file + ".idx"}):
+        members.update(int(number) for number in np.atleast_1d(ds["number"].values))
+        ds.close()
+    return sorted(members)
+
+
+def ensemble_hourly(decoded):
+    """
+    Run the fetch_forecast processing chain on decoded ensemble members.
+
+    Parameters:
+    - decoded (dict): Decoded SURF_fc1, SURF_fc2, PLEV_fc1 and PLEV_fc2 with a 'member' dimension.
+
+    Returns:
+    - hourly (dict): Hourly SURF and PLEV forecasts with a 'member' dimension.
+    """
+    steps = FC1_STEPS + FC2_STEPS
+    surf = process_surf(decoded['SURF_fc1'], decoded['SURF_fc2'])
+    plev = process_plev(decoded['PLEV_fc1'], decoded['PLEV_fc2'])
+    return {"SURF": interpolate_to_hourly(surf, steps, flux_vars=['tp', 'ssrd', 'strd']),
+            "PLEV": interpolate_to_hourly(plev, steps)}
+
+
+def decode_members(grib_files, members, lat_range, lon_range):
+    """
+    Decode a group of ensemble members from indexed GRIB files (see index_grib).
+
+    Parameters:
+    - grib_files (dict): GRIB file paths by name (SURF_fc1, SURF_fc2, PLEV_fc1, PLEV_fc2).
+    - members (list): Member numbers to decode.
+    - lat_range, lon_range (tuple): Bounding box.
+
+    Returns:
+    - decoded (dict): Decoded datasets by name, with a 'member' dimension.
+    """
+    return {name: xr.concat([decode_grib(path, lat_range, lon_range, ensemble=True,
+                                         filter_by_keys={"number": int(member)}, indexpath=path + ".idx")
+                             for member in members], dim='member')
+            for name, path in grib_files.items()}
+
 
+def create_member_store(store, template, members):
+    """
+    Create an empty forecast store with one chunk per ensemble member.
+
+    Parameters:
+    - store (str): Path to the Zarr store.
+    - template (xarray.Dataset): Processed forecast of some members, gives variables and layout.
+    - members (list): All member numbers, in store order.
+    """
+    data_vars = {}
+    for name, da in template.data_vars.items():
+        da = da.transpose('member', ...)
+        shape = (len(members),) + da.shape[1:]
+        chunks = (1,) + da.shape[1:]
+        data_vars[name] = (da.dims, dask.array.full(shape, np.nan, dtype=da.dtype, chunks=chunks), da.attrs)
+    coords = {name: coord for name, coord in template.coords.items() if 'member' not in coord.dims}
+    coords['member'] = np.asarray(members)
+    xr.Dataset(data_vars, coords=coords).to_zarr(store, mode='w', compute=False)
+
+
+def write_members(store, ds, start):
+    """
+    Write processed members into their region of a store made by create_member_store.
+
+    Parameters:
+    - store (str): Path to the Zarr store.
+    - ds (xarray.Dataset): Processed forecast of consecutive members.
+    - start (int): Index of the first of these members in the store.
+    """
+    ds = ds.transpose('member', ...)
+    for variable in ds.variables.values():
+        variable.encoding = {}
+    # region writes take only variables along the region dimension
+    ds = ds.drop_vars(list(ds.coords))
+    ds.to_zarr(store, region={'member': slice(start, start + ds.sizes['member'])})
+
+
+def process_member_group(grib_files, members, start, stores, lat_range, lon_range):
+    """
+    Decode, process and store a group of consecutive ensemble members, in a worker process.
 
+    Parameters:
+    - grib_files (dict): Indexed GRIB file paths by name.
+    - members (list): Member numbers of the group.
+    - start (int): Index of the first member of the group in the stores.
+    - stores (dict): SURF and PLEV store paths.
+    - lat_range, lon_range (tuple): Bounding box.
+
+    Returns:
+    - n (int): Number of members processed.
+    """
+    hourly = ensemble_hourly(decode_members(grib_files, members, lat_range, lon_range))
+    for prefix, ds in hourly.items():
+        write_members(stores[prefix], ds, start)
+    return len(members)
+
+
+def fetch_ensemble(config=None):
+    """
+    Download and process the IFS open-data ensemble (control + 50 perturbed members).
+
+    The GRIB files are indexed once. Members are then decoded, processed with the
+    fetch_forecast chain (vectorized over the members of a group) and written in
+    groups, in a pool of worker processes. Each group goes straight to its own member
+    region of SURF_ENS.zarr / PLEV_ENS.zarr in the forecast directory, so the stores
+    are in member order and only the groups being processed are held in memory.
+    run_forecast.py --member N downscales one member.
+
+    Parameters:
+    - config (dict): Settings overriding FORECAST_CONFIG.
+
+    Returns:
+    - surf_store (str): Path to the member-dimensioned SURF forecast.
+    - plev_store (str): Path to the member-dimensioned PLEV forecast.
+    """
+    config = {**FORECAST_CONFIG, **(config or {})}
+    forecast_dir = config['directory']
+    tmp_path = os.path.join(forecast_dir, "tmp_ens")
+    cache_dir = config['cache_dir'] or os.path.join(forecast_dir, "cache")
+    lat_range, lon_range = config['lat_range'], config['lon_range']
+
+    os.makedirs(tmp_path, exist_ok=True)
+    for file in glob.glob(os.path.join(tmp_path, "*")):
+        os.remove(file)
+
+    print("Waiting for and downloading ensemble surface and pressure level variables forecast steps 0-240")
+    client = Client(source=config['source'])
+    asyncio.run(poll_and_retrieve(config['fctime'], config['mydate'], source=config['source'], client=client,
+                                  cache_dir=cache_dir, directory=tmp_path, ensemble=True))
+
+    print("Indexing grib")
+    grib_files = {name: os.path.join(tmp_path, f"{name}.grib2")
+                  for name in ["SURF_fc1", "SURF_fc2", "PLEV_fc1", "PLEV_fc2"]}
+    members = index_grib(grib_files['SURF_fc1'])
+    for name in ["SURF_fc2", "PLEV_fc1", "PLEV_fc2"]:
+        index_grib(grib_files[name])
+
+    stores = {prefix: os.path.join(forecast_dir, f"{prefix}_ENS.zarr") for prefix in ["SURF", "PLEV"]}
+    n = config['ens_members_per_task']
+    groups = [(members[i:i + n], i) for i in range(0, len(members), n)]
+
+    # the first group gives the layout of the stores
+    group, start = groups[0]
+    hourly = ensemble_hourly(decode_members(grib_files, group, lat_range, lon_range))
+    for prefix, ds in hourly.items():
+        create_member_store(stores[prefix], ds, members)
+        write_members(stores[prefix], ds, start)
+    del hourly
+    done = len(group)
+    print(f"Processed {done}/{len(members)} ensemble members")
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=config['ens_workers']) as executor:
+        futures = [executor.submit(process_member_group, grib_files, group, start, stores, lat_range, lon_range)
+                   for group, start in groups[1:]]
+        for future in concurrent.futures.as_completed(futures):
+            done += future.result()
+            print(f"Processed {done}/{len(members)} ensemble members")
+
+    for file in glob.glob(os.path.join(tmp_path, "*grib2*")):
+        os.remove(file)
+    return stores["SURF"], stores["PLEV"]
+
+
+if __name__ == "__main__":
+    # python fetch_ifs_forecast.py [--ensemble]
+    if '--ensemble' in sys.argv[1:]:
+        fetch_ensemble()
+    else:
+        fetch_forecast()
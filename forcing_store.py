@@ -0,0 +1,324 @@
+# Rolling T-30 ... T+10 forcing store.
+# A Zarr store holding one slot per day of the moving window (ring buffer): a
+# calendar day always maps to the same slot (days since epoch modulo the number
+# of slots), so advancing the window by a day overwrites the slot of the day that
+# dropped out. Each slot records its day and source (ERA5 or forecast). ERA5 days
+# are written once, forecast days are rewritten with every new cycle but never
+# replace an ERA5 day. Only the slots of changed days are written.
+
+import os
+import numpy as np
+import pandas as pd
+import xarray as xr
+import dask.array
+from regrid_weights import regrid
+
+
+N_SLOTS = 41  # T-30 to T+10
+EMPTY, ERA5, FORECAST = 0, 1, 2
+
+
+def slot_of(day, n_slots):
+    """
+    Return the ring buffer slot of a day.
+
+    Parameters:
+    - day (datetime): Day.
+    - n_slots (int): Number of slots of the store.
+
+    Returns:
+    - slot (int): Slot index.
+    """
+    return int((pd.Timestamp(day).normalize() - pd.Timestamp('1970-01-01')).days) % n_slots
+
+
+def day_block(ds_day):
+    """
+    Reshape one day of hourly data (24 timesteps) to a single (slot, hour) block.
+
+    Parameters:
+    - ds_day (xarray.Dataset): Hourly data of one day.
+
+    Returns:
+    - block (xarray.Dataset): Data with dimensions ('slot', 'hour', ...), slot of length 1.
+    """
+    block = ds_day.rename({'time': 'hour'}).assign_coords(hour=np.arange(24))
+    block = block.expand_dims('slot').transpose('slot', 'hour', ...)
+    # the packing of the source files (scale_factor, int16) does not apply to the store
+    for variable in block.variables.values():
+        variable.encoding = {}
+    return block
+
+
+def create_store(store, template, n_slots=N_SLOTS):
+    """
+    Create an empty forcing store with the variables and grid of one day of data.
+
+    Parameters:
+    - store (str): Path to the Zarr store.
+    - template (xarray.Dataset): Hourly data of one day (24 timesteps) on the target grid.
+    - n_slots (int): Number of days held in the store.
+    """
+    block = day_block(template)
+    data_vars = {}
+    for name, da in block.data_vars.items():
+        shape = (n_slots,) + da.shape[1:]
+        chunks = (1,) + da.shape[1:]
+        # unwritten chunks read back as the fill value, nothing is written for empty slots
+        data_vars[name] = (da.dims, dask.array.full(shape, np.nan, dtype=da.dtype, chunks=chunks), da.attrs)
+    data_vars['day'] = ('slot', np.full(n_slots, np.datetime64('NaT', 'ns')))
+    data_vars['source'] = ('slot', np.full(n_slots, EMPTY, dtype='int8'))
+    coords = {name: coord for name, coord in block.coords.items() if 'slot' not in coord.dims}
+    xr.Dataset(data_vars, coords=coords).to_zarr(store, mode='w-', compute=False)
+    print(f"Created forcing store {store} with {n_slots} day slots")
+
+
+def slot_status(store):
+    """
+    Read the day and source of every slot.
+
+    Parameters:
+    - store (str): Path to the Zarr store.
+
+    Returns:
+    - days (pd.DatetimeIndex): Day held in every slot (NaT if empty).
+    - sources (numpy.ndarray): Source of every slot (EMPTY, ERA5 or FORECAST).
+    """
+    with xr.open_zarr(store) as ds:
+        return pd.DatetimeIndex(ds['day'].values), ds['source'].values
+
+
+def write_day(store, ds_day, source):
+    """
+    Write one day into its slot of the forcing store.
+
+    Parameters:
+    - store (str): Path to the Zarr store.
+    - ds_day (xarray.Dataset): Hourly data of one day (24 timesteps) on the store grid.
+    - source (int): ERA5 or FORECAST.
+    """
+    day = pd.Timestamp(ds_day['time'].values[0]).normalize()
+    with xr.open_zarr(store) as ds_store:
+        n_slots = ds_store.sizes['slot']
+        layout = {name: (ds_store[name].dims[2:], ds_store[name].shape[2:], ds_store[name].dtype)
+                  for name in ds_store.data_vars if name not in ('day', 'source')}
+        levels = ds_store['level'].values if 'level' in ds_store.dims else None
+
+    if levels is not None:
+        ds_day = ds_day.reindex(level=levels)
+    # variables the source does not provide stay NaN, like in a concat of the two sources
+    for name, (dims, shape, dtype) in layout.items():
+        if name not in ds_day:
+            ds_day[name] = (('time',) + dims, np.full((ds_day.sizes['time'],) + shape, np.nan, dtype=dtype))
+    block = day_block(ds_day[list(layout)])
+    block['day'] = ('slot', [day.to_datetime64()])
+    block['source'] = ('slot', np.array([source], dtype='int8'))
+    # region writes take only variables along the region dimension
+    block = block.drop_vars(list(block.coords))
+    slot = slot_of(day, n_slots)
+    block.to_zarr(store, region={'slot': slice(slot, slot + 1)})
+
+
+def evict_days(store, first_day, last_day):
+    """
+    Mark the slots holding days outside the window as empty.
+
+    Slots are otherwise only overwritten when a day of the new window maps onto them,
+    after an outage days that left the window would still be read back.
+
+    Parameters:
+    - store (str): Path to the Zarr store.
+    - first_day, last_day (pd.Timestamp): First and last day of the window.
+
+    Returns:
+    - evicted (list): Days removed from the store.
+    """
+    days, sources = slot_status(store)
+    evicted = []
+    for slot, (day, source) in enumerate(zip(days, sources)):
+        if source == EMPTY or first_day <= day <= last_day:
+            continue
+        block = xr.Dataset({'day': ('slot', [np.datetime64('NaT', 'ns')]),
+                            'source': ('slot', np.array([EMPTY], dtype='int8'))})
+        block.to_zarr(store, region={'slot': slice(slot, slot + 1)})
+        evicted.append(day)
+    return evicted
+
+
+def complete_days(ds):
+    """
+    Split hourly data into calendar days, dropping incomplete days.
+
+    Parameters:
+    - ds (xarray.Dataset): Hourly data.
+
+    Returns:
+    - days (dict): One day of data (24 timesteps) by day (pd.Timestamp).
+    """
+    days = {}
+    for day, ds_day in ds.groupby(ds['time'].dt.floor('D')):
+        if ds_day.sizes['time'] == 24:
+            days[pd.Timestamp(day)] = ds_day
+    return days
+
+
+def advance_store(store, era5_files, forecast, today=None, n_slots=N_SLOTS, days_back=30, weights_dir=None):
+    """
+    Bring the forcing store to the window of today.
+
+    Slots of days that left the window are marked empty. ERA5 days not yet in the
+    store are written, then all complete days of the new forecast cycle (on the ERA5
+    grid) that have no ERA5 data.
+
+    Parameters:
+    - store (str): Path to the Zarr store, created from the first ERA5 day if needed.
+    - era5_files (dict): Daily ERA5 files by day, eg from run_master2.files_by_date.
+    - forecast (xarray.Dataset): Hourly forecast of the current cycle.
+    - today (datetime): Day T of the window, default today.
+    - n_slots (int): Number of days held in the store.
+    - days_back (int): Number of past days in the window.
+    - weights_dir (str): Directory of the stored regridding weights (see regrid_weights.py).
+
+    Returns:
+    - written (list): Days written to the store.
+    """
+    today = pd.Timestamp(today or pd.Timestamp.now()).normalize()
+    first_day = today - pd.Timedelta(days=days_back)
+    last_day = first_day + pd.Timedelta(days=n_slots - 1)
+    in_window = {day: file for day, file in era5_files.items() if first_day <= pd.Timestamp(day) <= last_day}
+
+    if not os.path.exists(store):
+        if not in_window:
+            raise FileNotFoundError(f"No ERA5 day in the window to create {store} from.")
+        with xr.open_dataset(in_window[min(in_window)]) as template:
+            create_store(store, template.load(), n_slots)
+
+    evicted = evict_days(store, first_day, last_day)
+    if evicted:
+        print(f"Evicted days outside the window: {[str(day.date()) for day in evicted]}")
+    days, sources = slot_status(store)
+    era5_days = set()
+    written = []
+    for day in sorted(in_window):
+        day = pd.Timestamp(day)
+        slot = slot_of(day, n_slots)
+        era5_days.add(day)
+        if days[slot] == day and sources[slot] == ERA5:
+            continue
+        with xr.open_dataset(in_window[day]) as ds_day:
+            if ds_day.sizes['time'] != 24:
+                print(f"Skipping incomplete ERA5 day {day.date()}")
+                era5_days.discard(day)
+                continue
+            write_day(store, ds_day.load(), ERA5)
+        written.append(day)
+
+    with xr.open_zarr(store) as ds_store:
+        latitude, longitude = ds_store['latitude'].values, ds_store['longitude'].values
+    forecast = regrid(forecast, latitude, longitude, weights_dir)
+    for day, ds_day in complete_days(forecast).items():
+        slot = slot_of(day, n_slots)
+        if not first_day <= day <= last_day or day in era5_days or (days[slot] == day and sources[slot] == ERA5):
+            continue
+        write_day(store, ds_day, FORECAST)
+        written.append(day)
+
+    print(f"Forcing store {store} updated, days written: {[str(day.date()) for day in written]}")
+    return written
+
+
+def open_forcing(store, start=None, end=None):
+    """
+    Open the forcing store lazily as an hourly time series.
+
+    Parameters:
+    - store (str): Path to the Zarr store.
+    - start, end (datetime): Optional first and last day to include.
+
+    Returns:
+    - ds (xarray.Dataset): Hourly data of all filled slots, sorted by time.
+    """
+    ds = xr.open_zarr(store)
+    days = pd.DatetimeIndex(ds['day'].values)
+    keep = ds['source'].values != EMPTY
+    if start is not None:
+        keep &= days >= pd.Timestamp(start).normalize()
+    if end is not None:
+        keep &= days <= pd.Timestamp(end).normalize()
+    slots = np.flatnonzero(keep)
+    slots = slots[np.argsort(days[slots])]
+
+    ds = ds.isel(slot=slots)
+    times = (days[slots].values[:, None] + ds['hour'].values[None, :].astype('timedelta64[h]')).ravel()
+    ds = ds.drop_vars(['day', 'source']).stack(time=('slot', 'hour'), create_index=False)
+    return ds.drop_vars(['slot', 'hour'], errors='ignore').assign_coords(time=times).transpose('time', ...)
+
+
+def export_forcing(store, export_path, days):
+    """
+    Keep a NetCDF export of the forcing store up to date for readers of NetCDF (TopoPyScale).
+
+    The export holds the same days as the store. It has an unlimited time dimension, so
+    while the window has not moved (eg a forecast day replaced by ERA5 later the same
+    day) only the given days are written: days already in the export are overwritten in
+    place, days following its end are appended. NetCDF cannot drop days from the start
+    of a file, so once days have left the window the export is rewritten from the store,
+    which bounds it to the window (n_slots days) instead of letting it grow every run.
+
+    Parameters:
+    - store (str): Path to the Zarr store.
+    - export_path (str): Path to the NetCDF export, eg './inputs/climate/SURF_final_merged_output.nc'.
+    - days (list): Days changed in the store, as returned by advance_store.
+    """
+    from netCDF4 import Dataset, date2num, num2date
+
+    ds = open_forcing(store)
+    days = sorted(pd.Timestamp(day) for day in days)
+    store_days, sources = slot_status(store)
+    store_days = store_days[sources != EMPTY].sort_values()
+    # the in-place update assumes an hourly time axis without gaps, like the store's
+    in_place = (os.path.exists(export_path) and len(store_days) > 0 and
+                store_days[-1] - store_days[0] == pd.Timedelta(days=len(store_days) - 1))
+    if in_place:
+        with Dataset(export_path, 'r') as nc:
+            time_variable = nc.variables['time']
+            n = len(nc.dimensions['time'])
+            in_place = nc.dimensions['time'].isunlimited() and n > 0
+            if in_place:
+                start = pd.Timestamp(num2date(time_variable[0], time_variable.units,
+                                              getattr(time_variable, 'calendar', 'standard'),
+                                              only_use_cftime_datetimes=False))
+        # the export must start with the window and every day start inside it or right after its end
+        in_place = in_place and start == store_days[0]
+        for day in days if in_place else []:
+            index = int((day - start) / pd.Timedelta(hours=1))
+            if index < 0 or index > n:
+                in_place = False
+                break
+            n = max(n, index + 24)
+        # and the result cover the store window exactly
+        in_place = in_place and n == 24 * len(store_days)
+
+    if not in_place:
+        tmp_file = export_path + '.tmp'
+        ds.to_netcdf(tmp_file, unlimited_dims=['time'])
+        os.replace(tmp_file, export_path)
+        print(f"Exported forcing store {store} to {export_path}")
+        return
+
+    with Dataset(export_path, 'a') as nc:
+        time_variable = nc.variables['time']
+        calendar = getattr(time_variable, 'calendar', 'standard')
+        for day in days:
+            ds_day = ds.sel(time=slice(day, day + pd.Timedelta(hours=23)))
+            index = int((day - start) / pd.Timedelta(hours=1))
+            k = ds_day.sizes['time']
+            time_variable[index:index + k] = date2num(pd.to_datetime(ds_day['time'].values).to_pydatetime(),
+                                                      time_variable.units, calendar)
+            for name, variable in nc.variables.items():
+                if name == 'time' or 'time' not in variable.dimensions or name not in ds_day:
+                    continue
+                region = [slice(None)] * variable.ndim
+                region[variable.dimensions.index('time')] = slice(index, index + k)
+                variable[tuple(region)] = ds_day[name].transpose(*variable.dimensions).values
+    print(f"Updated {len(days)} days of {export_path}")
@@ -0,0 +1,201 @@
+# Virtual forcing datasets.
+# Instead of copying the ERA5 merge and the interpolated forecast into a new
+# *_final_merged_output.nc every day, a small JSON view lists the files the
+# forcing is made of and the time range taken from each. open_forcing_view()
+# opens the pieces lazily and concatenates them along time. The forecast piece,
+# regridded to the ERA5 grid, is cached per forecast cycle so later calls for the
+# same cycle do not interpolate again. Readers that need NetCDF files (TopoPyScale)
+# get only the time window they simulate written out, into their own directory,
+# from window_forcing(), so simulations running at the same time do not share them.
+
+import os
+import json
+import hashlib
+import tempfile
+import pandas as pd
+import xarray as xr
+from regrid_weights import regrid, grid_hash
+from time_probe import get_last_fullday_timestamp
+
+
+def regridded_piece(ds_fc, source, latitude, longitude, pieces_dir, weights_dir=None):
+    """
+    Return the file of a forecast regridded to a target grid, regridding only on the first call.
+
+    Parameters:
+    - ds_fc (xarray.Dataset): Forecast dataset.
+    - source (str or None): Path ds_fc was read from, its mtime tells cycles apart.
+    - latitude, longitude (array): Target grid coordinates.
+    - pieces_dir (str): Directory of the cached pieces.
+    - weights_dir (str): Directory of the stored regridding weights (see regrid_weights.py).
+
+    Returns:
+    - piece (str): Path to the regridded forecast.
+    """
+    times = pd.to_datetime(ds_fc['time'].values)
+    identity = [str(times[0]), str(times[-1]), len(times), grid_hash(latitude, longitude)]
+    if isinstance(source, str):
+        identity += [os.path.abspath(source), os.stat(source).st_mtime_ns]
+    key = hashlib.sha256(json.dumps(identity).encode()).hexdigest()[:16]
+    piece = os.path.join(pieces_dir, f"fc_{times[0].strftime('%Y%m%d%H')}_{key}.nc")
+    if not os.path.exists(piece):
+        os.makedirs(pieces_dir, exist_ok=True)
+        tmp_file = piece + '.tmp'
+        regrid(ds_fc, latitude, longitude, weights_dir).to_netcdf(tmp_file)
+        os.replace(tmp_file, piece)
+        print(f"Cached regridded forecast {piece}")
+    return piece
+
+
+def write_view(view_path, pieces):
+    """
+    Write a forcing view.
+
+    Parameters:
+    - view_path (str): Path to the JSON view.
+    - pieces (list): Dicts with 'path' and optional 'start' / 'end' (inclusive timestamps as str),
+      in time order.
+    """
+    view = {'dim': 'time', 'pieces': [{'path': os.path.abspath(piece['path']),
+                                       'start': piece.get('start'), 'end': piece.get('end')}
+                                      for piece in pieces]}
+    tmp_file = view_path + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(view, f, indent=1)
+    os.replace(tmp_file, view_path)
+    print(f"Forcing view saved to {view_path}")
+
+
+def open_forcing_view(view_path, chunks=None):
+    """
+    Open a forcing view lazily as one dataset.
+
+    Parameters:
+    - view_path (str): Path to the JSON view.
+    - chunks (dict): Dask chunks of the pieces, default one day of hourly steps.
+
+    Returns:
+    - ds (xarray.Dataset): Concatenation of the pieces along time.
+    """
+    with open(view_path) as f:
+        view = json.load(f)
+    parts = []
+    for piece in view['pieces']:
+        ds = xr.open_dataset(piece['path'], chunks=chunks or {view['dim']: 24})
+        parts.append(ds.sel({view['dim']: slice(piece['start'], piece['end'])}))
+    return xr.concat(parts, dim=view['dim'])
+
+
+def prune_pieces(pieces_dir, keep):
+    """
+    Delete cached pieces no longer referenced.
+
+    Parameters:
+    - pieces_dir (str): Directory of the cached pieces.
+    - keep (list): Paths of the pieces still in use.
+    """
+    keep = {os.path.abspath(path) for path in keep}
+    for entry in os.scandir(pieces_dir):
+        if entry.name.startswith('fc_') and entry.name.endswith('.nc') and os.path.abspath(entry.path) not in keep:
+            os.remove(entry.path)
+
+
+def materialize_view(view_path, output_path, start=None, end=None):
+    """
+    Write the dataset of a view, or a time window of it, to NetCDF.
+
+    The file is written to a unique temporary file next to output_path first, so
+    writers of the same output do not clobber each other's partial files.
+
+    Parameters:
+    - view_path (str): Path to the JSON view.
+    - output_path (str): Path to the NetCDF file.
+    - start, end (datetime): Optional first and last timestep to write (inclusive).
+
+    Returns:
+    - output_path (str): Path to the NetCDF file.
+    """
+    fd, tmp_file = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(output_path) + '.',
+                                    dir=os.path.dirname(os.path.abspath(output_path)))
+    os.close(fd)
+    try:
+        with open_forcing_view(view_path) as ds:
+            ds.sel(time=slice(start, end)).to_netcdf(tmp_file)
+        os.replace(tmp_file, output_path)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    print(f"Forcing view {view_path} from {start} to {end} written to {output_path}")
+    return output_path
+
+
+def current_view(base):
+    """
+    Return the view of a forcing written either as NetCDF or as a view, if the view is the current one.
+
+    Parameters:
+    - base (str): Path without extension, eg '../master/inputs/climate/SURF_final_merged_output'.
+
+    Returns:
+    - view_path (str): base + '.json' if it exists and is newer than base + '.nc', else None.
+    """
+    view_path, nc_file = base + '.json', base + '.nc'
+    if os.path.exists(view_path) and (not os.path.exists(nc_file) or
+                                      os.path.getmtime(view_path) > os.path.getmtime(nc_file)):
+        return view_path
+    if not os.path.exists(nc_file):
+        raise FileNotFoundError(f"Neither {nc_file} nor {view_path} exists.")
+    return None
+
+
+def last_fullday_timestamp(base):
+    """
+    Return the last timestamp at hour 23 of a forcing written either as NetCDF or as a view.
+
+    Parameters:
+    - base (str): Path without extension, see current_view.
+
+    Returns:
+    - last_timestamp (datetime): The last timestamp where hour is 23, None if there is none.
+    """
+    view_path = current_view(base)
+    if view_path is None:
+        return get_last_fullday_timestamp(base + '.nc')
+    # only the time coordinates of the pieces are read
+    with open_forcing_view(view_path) as ds:
+        times = pd.DatetimeIndex(ds['time'].values)
+    full_hours = times[times.hour == 23]
+    return full_hours[-1].to_pydatetime() if len(full_hours) else None
+
+
+def window_forcing(bases, start, end, climate_dir):
+    """
+    Provide the forcing of a simulation window as NetCDF files in the simulation's climate directory.
+
+    Forcings written as views are written out from the first day of start to end only,
+    forcings written as NetCDF are symlinked.
+
+    Parameters:
+    - bases (list): Paths without extension of the forcings, see current_view.
+    - start, end (datetime): First and last timestep of the simulation.
+    - climate_dir (str): Climate directory of the simulation, created.
+
+    Returns:
+    - climate_path (str): climate_dir with a trailing separator, to use as config.climate.path,
+      None if no forcing is a view (the master forcing is then read as it is).
+    """
+    views = [current_view(base) for base in bases]
+    if not any(views):
+        return None
+    os.makedirs(climate_dir, exist_ok=True)
+    start = pd.Timestamp(start).normalize()
+    for base, view_path in zip(bases, views):
+        output_path = os.path.join(climate_dir, os.path.basename(base) + '.nc')
+        if view_path is None:
+            if os.path.lexists(output_path):
+                os.remove(output_path)
+            os.symlink(os.path.abspath(base + '.nc'), output_path)
+        else:
+            materialize_view(view_path, output_path, start, end)
+    return os.path.join(climate_dir, '')
@@ -0,0 +1,187 @@
+# Lifecycle of the superseded daily forecast files.
+# Once the ERA5 file of a day is downloaded, the first-forecast-day files of that
+# day (SURF_FC_YYYY-MM-DD.nc, PLEV_FC_YYYY-MM-DD.nc) are moved to archive_forecast/.
+# All pairs are reconciled in one scan of the forecast directory. The archive
+# follows retention rules: recent days are kept as they are, older days are
+# recompressed (zlib) and days past the retention period are deleted. A small
+# index.json in the archive records the state of every file, so retention needs
+# no file to be opened.
+
+import os
+import json
+import shutil
+import xarray as xr
+from datetime import datetime, timedelta
+
+
+ARCHIVE_DIR = 'archive_forecast'
+INDEX_FILE = 'index.json'
+
+
+def parse_daily_name(filename):
+    """
+    Parse the name of a daily ERA5 or forecast file.
+
+    Parameters:
+    - filename (str): 'SURF_YYYYMMDD.nc', 'PLEV_YYYYMMDD.nc', 'SURF_FC_YYYY-MM-DD.nc' or 'PLEV_FC_YYYY-MM-DD.nc'.
+
+    Returns:
+    - parsed (tuple): (prefix, kind, day) with kind 'era5' or 'fc', None for any other file.
+    """
+    if not filename.endswith('.nc'):
+        return None
+    parts = filename[:-3].split('_')
+    try:
+        if len(parts) == 2 and parts[0] in ('SURF', 'PLEV'):
+            return parts[0], 'era5', datetime.strptime(parts[1], '%Y%m%d')
+        if len(parts) == 3 and parts[0] in ('SURF', 'PLEV') and parts[1] == 'FC':
+            return parts[0], 'fc', datetime.strptime(parts[2], '%Y-%m-%d')
+    except ValueError:
+        pass
+    return None
+
+
+def load_index(archive_dir):
+    """
+    Load the archive index.
+
+    Parameters:
+    - archive_dir (str): Archive directory.
+
+    Returns:
+    - index (dict): Entries by file name, empty if there is no index yet.
+    """
+    index_file = os.path.join(archive_dir, INDEX_FILE)
+    if not os.path.exists(index_file):
+        return {}
+    with open(index_file) as f:
+        return json.load(f)
+
+
+def save_index(index, archive_dir):
+    """
+    Write the archive index atomically.
+
+    Parameters:
+    - index (dict): Entries by file name.
+    - archive_dir (str): Archive directory.
+    """
+    index_file = os.path.join(archive_dir, INDEX_FILE)
+    with open(index_file + '.tmp', 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(index_file + '.tmp', index_file)
+
+
+def reconcile(forecast_dir, index, archive=True):
+    """
+    Archive (or delete) every forecast file whose day has an ERA5 file, in one directory scan.
+
+    Parameters:
+    - forecast_dir (str): Forecast directory.
+    - index (dict): Archive index, updated in place.
+    - archive (bool): If True, move the forecast files to the archive. If False, delete them.
+
+    Returns:
+    - n (int): Number of forecast files archived or deleted.
+    """
+    era5_days, fc_files = set(), []
+    for entry in os.scandir(forecast_dir):
+        parsed = parse_daily_name(entry.name)
+        if parsed is None or not entry.is_file():
+            continue
+        prefix, kind, day = parsed
+        if kind == 'era5':
+            era5_days.add((prefix, day))
+        else:
+            fc_files.append((prefix, day, entry))
+
+    archive_dir = os.path.join(forecast_dir, ARCHIVE_DIR)
+    n = 0
+    for prefix, day, entry in fc_files:
+        if (prefix, day) not in era5_days:
+            continue
+        if archive:
+            os.makedirs(archive_dir, exist_ok=True)
+            shutil.move(entry.path, os.path.join(archive_dir, entry.name))
+            index[entry.name] = {'prefix': prefix, 'day': day.strftime('%Y-%m-%d'), 'state': 'raw',
+                                 'bytes': os.path.getsize(os.path.join(archive_dir, entry.name))}
+            print(f"Moved forecast file to archive: {os.path.join(archive_dir, entry.name)}")
+        else:
+            os.remove(entry.path)
+            print(f"Deleted forecast file: {entry.path}")
+        n += 1
+    return n
+
+
+def compress_file(path, complevel=4):
+    """
+    Rewrite a NetCDF file with zlib compression of all variables, in place.
+
+    Parameters:
+    - path (str): Path to the NetCDF file.
+    - complevel (int): zlib compression level.
+
+    Returns:
+    - size (int): Size of the compressed file in bytes.
+    """
+    tmp_file = path + '.tmp'
+    with xr.open_dataset(path) as ds:
+        encoding = {name: {'zlib': True, 'complevel': complevel} for name in ds.data_vars}
+        ds.to_netcdf(tmp_file, encoding=encoding)
+    os.replace(tmp_file, path)
+    return os.path.getsize(path)
+
+
+def apply_retention(archive_dir, index, keep_raw_days=14, keep_days=180, today=None):
+    """
+    Compress archived days older than keep_raw_days and delete days older than keep_days.
+
+    Parameters:
+    - archive_dir (str): Archive directory.
+    - index (dict): Archive index, updated in place.
+    - keep_raw_days (int): Days kept as written.
+    - keep_days (int): Days kept at all.
+    - today (datetime): Reference day, default today.
+    """
+    today = today or datetime.now()
+    # files archived before the index existed
+    if os.path.isdir(archive_dir):
+        for entry in os.scandir(archive_dir):
+            parsed = parse_daily_name(entry.name)
+            if parsed is not None and parsed[1] == 'fc' and entry.name not in index:
+                index[entry.name] = {'prefix': parsed[0], 'day': parsed[2].strftime('%Y-%m-%d'),
+                                     'state': 'raw', 'bytes': entry.stat().st_size}
+
+    for name, entry in sorted(index.items()):
+        path = os.path.join(archive_dir, name)
+        age = today - datetime.strptime(entry['day'], '%Y-%m-%d')
+        if not os.path.exists(path):
+            del index[name]
+        elif age > timedelta(days=keep_days):
+            os.remove(path)
+            del index[name]
+            print(f"Deleted archived forecast {name}")
+        elif age > timedelta(days=keep_raw_days) and entry['state'] == 'raw':
+            entry['bytes'] = compress_file(path)
+            entry['state'] = 'compressed'
+            print(f"Compressed archived forecast {name}")
+
+
+def manage_forecast_archive(forecast_dir, archive=True, keep_raw_days=14, keep_days=180, today=None):
+    """
+    Reconcile the forecast directory with the ERA5 files and apply the archive retention rules.
+
+    Parameters:
+    - forecast_dir (str): Forecast directory, eg './inputs/climate/forecast'.
+    - archive (bool): If True, superseded forecast files are archived. If False, they are deleted.
+    - keep_raw_days (int): Days kept as written in the archive.
+    - keep_days (int): Days kept in the archive at all.
+    - today (datetime): Reference day, default today.
+    """
+    archive_dir = os.path.join(forecast_dir, ARCHIVE_DIR)
+    index = load_index(archive_dir)
+    n = reconcile(forecast_dir, index, archive)
+    apply_retention(archive_dir, index, keep_raw_days, keep_days, today)
+    if os.path.isdir(archive_dir):
+        save_index(index, archive_dir)
+    print(f"{n} forecast files superseded by ERA5, {len(index)} files in the archive")
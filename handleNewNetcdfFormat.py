@@ -1,71 +1,143 @@
 # https://forum.ecmwf.int/t/forthcoming-update-to-the-format-of-netcdf-files-produced-by-the-conversion-of-grib-data-on-the-cds/7772
 
 
+import io
 import os
 import zipfile
+import netCDF4
 import xarray as xr
-import shutil
 import argparse
+import concurrent.futures
+
+
+def file_format(file_path):
+    """
+    Identify a file from its first bytes.
+
+    Parameters:
+    - file_path (str or bytes): Path to the file, or its content.
+
+    Returns:
+    - format (str): 'netcdf4' (HDF5), 'netcdf3', 'zip' or None.
+    """
+    if isinstance(file_path, bytes):
+        header = file_path[:8]
+    else:
+        with open(file_path, 'rb') as f:
+            header = f.read(8)
+    if header.startswith(b'\x89HDF'):
+        return 'netcdf4'
+    if header.startswith(b'CDF'):
+        return 'netcdf3'
+    if header.startswith(b'PK\x03\x04'):
+        return 'zip'
+    return None
+
+
+def open_member(name, content):
+    """
+    Load a NetCDF file held in memory.
+
+    NetCDF4 (HDF5) content is opened by the netCDF4 library from memory, which needs
+    no h5py, NetCDF3 content by scipy.
+
+    Parameters:
+    - name (str): Name of the file, used in error messages only.
+    - content (bytes): Content of the file.
+
+    Returns:
+    - ds (xarray.Dataset): Loaded dataset.
+    """
+    if file_format(content) == 'netcdf4':
+        nc = netCDF4.Dataset(name, mode='r', memory=content)
+        with xr.open_dataset(xr.backends.NetCDF4DataStore(nc)) as ds:
+            return ds.load()
+    with xr.open_dataset(io.BytesIO(content), engine='scipy') as ds:
+        return ds.load()
+
 
 def process_file(file_path, workdir):
-    original_file_path = file_path  # Keep track of the original file name
-    
-    # Step 1: Try to open as a NetCDF file
-    try:
-        with xr.open_dataset(file_path) as ds:
-            print(f"{file_path} is a valid NetCDF file. No processing needed.")
-            return
-    except Exception:
-        print(f"{file_path} is not a valid NetCDF file. Checking if it's a ZIP file.")
-    
-    # Step 2: Check if it's a ZIP file
-    if not zipfile.is_zipfile(file_path):
+    """
+    Replace a NetCDF file delivered by the CDS as a ZIP archive by the merged NetCDF it contains.
+
+    The members are read from the archive in memory, merged by variable (the new CDS
+    format splits variables into one file per stepType) and written once, through a
+    temporary file, as workdir/<name>.nc.
+
+    Parameters:
+    - file_path (str): Path to the input file (NetCDF or ZIP).
+    - workdir (str): Directory where the output is saved.
+
+    Returns:
+    - merged_file_path (str): Path to the merged file, None if nothing was done.
+    """
+    # Step 1: Check the format from the header, valid NetCDF files need no processing
+    fmt = file_format(file_path)
+    if fmt in ('netcdf4', 'netcdf3'):
+        print(f"{file_path} is a valid NetCDF file. No processing needed.")
+        return None
+    if fmt != 'zip' or not zipfile.is_zipfile(file_path):
         print(f"{file_path} is neither a valid NetCDF nor a ZIP file.")
-        return
-    
-    # Step 3: Rename the file if it's actually a ZIP
-    zip_file_path = file_path.replace('.nc', '.zip')
-    os.rename(file_path, zip_file_path)
-    print(f"Renamed {file_path} to {zip_file_path} for processing.")
-    
-    # Step 4: Unzip the file
-    unzip_dir = zip_file_path.replace('.zip', '')
-    with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-        zip_ref.extractall(unzip_dir)
-    print(f"Unzipped {zip_file_path} to {unzip_dir}.")
-    
-    # Step 5: Merge `.nc` files inside the unzipped directory
-    nc_files = [os.path.join(unzip_dir, f) for f in os.listdir(unzip_dir) if f.endswith('.nc')]
-    if not nc_files:
-        print(f"No .nc files found in {unzip_dir}.")
-        return
-    
-    merged_file_path = os.path.join(workdir, os.path.basename(zip_file_path).replace('.zip', '.nc'))
-    try:
-        # Combine all `.nc` files
-        datasets = [xr.open_dataset(nc_file) for nc_file in nc_files]
-        merged_ds = xr.concat(datasets, dim='time')  # Adjust dimension as needed
-        merged_ds.to_netcdf(merged_file_path)
-        print(f"Merged .nc files into {merged_file_path}.")
-    finally:
-        # Close datasets
-        for ds in datasets:
-            ds.close()
-    
-    # Step 6: Clean up
-    os.remove(zip_file_path)
-    shutil.rmtree(unzip_dir)
-    print(f"Deleted {zip_file_path} and {unzip_dir}.")
+        return None
+
+    # Step 2: Read the `.nc` members in memory
+    datasets = []
+    with zipfile.ZipFile(file_path, 'r') as zip_ref:
+        for name in zip_ref.namelist():
+            if not name.endswith('.nc'):
+                continue
+            datasets.append(open_member(name, zip_ref.read(name)))
+    if not datasets:
+        print(f"No .nc files found in {file_path}.")
+        return None
+
+    # Step 3: Merge the members by variable and write the result atomically
+    merged_file_path = os.path.join(workdir, os.path.splitext(os.path.basename(file_path))[0] + '.nc')
+    tmp_file_path = merged_file_path + '.tmp'
+    merged_ds = xr.merge(datasets)
+    merged_ds.to_netcdf(tmp_file_path)
+    # the download is only removed once the merged file is in place
+    os.replace(tmp_file_path, merged_file_path)
+    if os.path.abspath(merged_file_path) != os.path.abspath(file_path):
+        os.remove(file_path)
+    print(f"Merged {len(datasets)} .nc files of {file_path} into {merged_file_path}.")
+    return merged_file_path
+
+
+def process_directory(directory, workdir=None, max_workers=None):
+    """
+    Repair all ZIP-in-disguise `.nc` files of a directory in parallel.
+
+    Parameters:
+    - directory (str): Directory to scan, eg inputs/climate.
+    - workdir (str): Directory where the outputs are saved, default the directory itself.
+    - max_workers (int): Number of worker processes, default the number of CPUs.
+
+    Returns:
+    - merged (list): Paths to the repaired files.
+    """
+    workdir = workdir or directory
+    zip_files = [entry.path for entry in os.scandir(directory)
+                 if entry.name.endswith('.nc') and entry.is_file() and file_format(entry.path) == 'zip']
+    print(f"{len(zip_files)} ZIP files to repair in {directory}.")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        merged = list(executor.map(process_file, zip_files, [workdir] * len(zip_files)))
+    return [path for path in merged if path]
+
 
 if __name__ == "__main__":
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Process a misidentified NetCDF or ZIP file.")
-    parser.add_argument("file_path", help="Path to the input file (NetCDF or ZIP).")
+    parser.add_argument("file_path", help="Path to the input file (NetCDF or ZIP), or a directory to repair all files of.")
     parser.add_argument("workdir", help="Path to the working directory where output should be saved.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes for a directory.")
     args = parser.parse_args()
     
     # Call the function with the provided arguments
-    process_file(args.file_path, args.workdir)
+    if os.path.isdir(args.file_path):
+        process_directory(args.file_path, args.workdir, args.workers)
+    else:
+        process_file(args.file_path, args.workdir)
     
     # Example usage
     # file_path = "SURF_20241128.nc"  # Replace with your file path
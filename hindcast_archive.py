@@ -0,0 +1,91 @@
+# Append-only archive of the first forecast day of every IFS run (the "hindcast").
+# Each run adds one day to a time-indexed Zarr store instead of re-merging all
+# PLEV_FC_<day>.nc / SURF_FC_<day>.nc files with cdo mergetime. Timesteps already
+# in the store are overwritten in place, so a rerun of the same cycle replaces its
+# day-one data like it replaces the daily file, and reading the archive is lazy.
+
+import os
+import glob
+import numpy as np
+import xarray as xr
+
+
+def archived_times(store):
+    """
+    Return the timestamps held in an archive, reading only the time coordinate.
+
+    Parameters:
+    - store (str): Path to the Zarr store.
+
+    Returns:
+    - times (numpy.ndarray): datetime64 timestamps, empty if the store does not exist.
+    """
+    if not os.path.exists(store):
+        return np.array([], dtype='datetime64[ns]')
+    with xr.open_zarr(store) as ds:
+        return ds['time'].values
+
+
+def append_to_archive(ds, store):
+    """
+    Append the timesteps of ds that are not yet in the archive and overwrite the others.
+
+    Parameters:
+    - ds (xarray.Dataset): Dataset with a 'time' dimension, typically one forecast day.
+    - store (str): Path to the Zarr store, created on first use.
+
+    Returns:
+    - n (int): Number of timesteps written (appended or overwritten).
+    """
+    existing = archived_times(store)
+    is_new = ~np.isin(ds['time'].values, existing)
+
+    if not is_new.all():
+        # a rerun of the fetch for the same cycle, the new forecast replaces the archived one
+        positions = {time: i for i, time in enumerate(existing)}
+        old = ds.isel(time=np.flatnonzero(~is_new)).load()
+        old = old.drop_vars([name for name in old.variables if 'time' not in old[name].dims])
+        indices = np.array([positions[time] for time in old['time'].values])
+        if np.all(np.diff(indices) == 1):
+            old.to_zarr(store, region={'time': slice(indices[0], indices[-1] + 1)})
+        else:
+            for i, index in enumerate(indices):
+                old.isel(time=slice(i, i + 1)).to_zarr(store, region={'time': slice(index, index + 1)})
+        print(f"Overwrote {old.sizes['time']} timesteps already in {store}.")
+
+    if is_new.any():
+        new = ds.isel(time=np.flatnonzero(is_new)).chunk({'time': 24})
+        if len(existing):
+            new.to_zarr(store, append_dim='time')
+        else:
+            new.to_zarr(store, mode='w-')
+        print(f"Appended {int(is_new.sum())} timesteps to {store}")
+    return ds.sizes['time']
+
+
+def seed_archive(store, pattern):
+    """
+    Create the archive from existing daily files, oldest first, if it does not exist yet.
+
+    Parameters:
+    - store (str): Path to the Zarr store.
+    - pattern (str): Glob pattern of the daily files, eg '../PLEV_FC_*.nc'.
+    """
+    if os.path.exists(store):
+        return
+    for file in sorted(glob.glob(pattern)):
+        with xr.open_dataset(file) as ds:
+            append_to_archive(ds.load(), store)
+
+
+def open_archive(store):
+    """
+    Open the archive lazily, sorted by time.
+
+    Parameters:
+    - store (str): Path to the Zarr store.
+
+    Returns:
+    - ds (xarray.Dataset): Lazy view of all archived timesteps.
+    """
+    return xr.open_zarr(store).sortby('time')
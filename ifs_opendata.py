@@ -0,0 +1,271 @@
+# https://github.com/ecmwf/ecmwf-opendata
+# https://www.ecmwf.int/en/forecasts/datasets/open-data
+
+# Retrieval of the IFS open-data forecast. The four requests issued by
+# fetch_ifs_forecast.py (SURF/PLEV for the 3h and 6h segments) are independent
+# so they are downloaded concurrently sharing one Client.
+# poll_and_retrieve waits for the chosen cycle to be published (HEAD requests on
+# the per-step .index files) and starts each request as soon as its steps are out.
+# source can be "ecmwf", "azure", "aws" or the URL of any server with the same
+# layout as data.ecmwf.int/forecasts (eg a local http.server serving canned GRIB
+# files for testing).
+
+import os
+import time
+import asyncio
+import urllib.request
+from datetime import datetime, timedelta, timezone
+from ecmwf.opendata import Client
+from download_cache import cache_key, cached_download
+
+
+# surface and pressure level parameters retrieved for TopoPyScale
+SURF_PARAMS = ["2t", "sp", "2d", "ssrd", "strd", "tp", "msl"]
+PLEV_PARAMS = ["gh", "u", "v", "r", "q", "t"]
+
+# For times 00z &12z: 0 to 144 by 3, 150 to 240 by 6.
+FC1_STEPS = [i for i in range(0, 147, 3)]
+FC2_STEPS = [i for i in range(150, 241, 6)]
+
+# pressure levels (hPa) of the PLEV forecast, steps 150-240 and the ensemble are published on fewer levels
+PLEV_LEVELS = [1000, 925, 850, 700, 600, 500, 400, 300]
+FC2_LEVELS = [1000, 925, 850, 700, 500, 300]
+
+# the ensemble (control "cf" + 50 perturbed "pf" members) has fewer pressure levels
+ENS_LEVELS = [1000, 925, 850, 700, 500, 300]
+
+# base URLs of the named open-data sources, any other source is taken as a URL
+SOURCE_URLS = {
+    "ecmwf": "https://data.ecmwf.int/forecasts",
+    "azure": "https://ai4edataeuwest.blob.core.windows.net/ecmwf",
+    "aws": "https://ecmwf-forecasts.s3.eu-central-1.amazonaws.com",
+}
+
+
+def forecast_requests(fctime=0, mydate=0, ensemble=False):
+    """
+    Build the four open-data requests needed for one forecast cycle.
+
+    Parameters:
+    - fctime (int): Forecast start time (0 or 12 UTC).
+    - mydate (int or str): Forecast date, 0 = today, -1 = yesterday, or YYYYMMDD.
+    - ensemble (bool): Request all ensemble members (stream enfo) instead of the HRES forecast.
+
+    Returns:
+    - requests (list): List of (target, request) tuples, request being the keyword arguments to Client.retrieve.
+    """
+    if ensemble:
+        ens = dict(time=fctime, date=mydate, stream="enfo", type=["cf", "pf"])
+        return [
+            ("SURF_fc1.grib2", dict(ens, step=FC1_STEPS, param=SURF_PARAMS)),
+            ("PLEV_fc1.grib2", dict(ens, step=FC1_STEPS, param=PLEV_PARAMS, levelist=ENS_LEVELS)),
+            ("SURF_fc2.grib2", dict(ens, step=FC2_STEPS, param=SURF_PARAMS)),
+            ("PLEV_fc2.grib2", dict(ens, step=FC2_STEPS, param=PLEV_PARAMS, levelist=ENS_LEVELS)),
+        ]
+    return [
+        ("SURF_fc1.grib2", dict(time=fctime, date=mydate, step=FC1_STEPS, type="fc",
+                                param=SURF_PARAMS)),
+        ("PLEV_fc1.grib2", dict(time=fctime, date=mydate, step=FC1_STEPS, type="fc",
+                                param=PLEV_PARAMS, levelist=PLEV_LEVELS)),
+        ("SURF_fc2.grib2", dict(time=fctime, date=mydate, step=FC2_STEPS, type="fc",
+                                param=SURF_PARAMS)),
+        ("PLEV_fc2.grib2", dict(time=fctime, date=mydate, step=FC2_STEPS, type="fc",
+                                param=PLEV_PARAMS, levelist=FC2_LEVELS)),
+    ]
+
+
+def request_key(source, request):
+    """
+    Cache key of an open-data request, None if its date is relative (eg 0 = today).
+
+    Parameters:
+    - source (str): Open-data source name or base URL.
+    - request (dict): Keyword arguments passed to Client.retrieve.
+
+    Returns:
+    - key (str): Cache key or None.
+    """
+    if isinstance(request["date"], int):
+        return None
+    if "stream" in request:
+        source = f"{source}/{request['stream']}"
+    return cache_key(source, request["date"], request["time"], request["step"], request["param"],
+                     request.get("levelist"))
+
+
+def retrieve_one(client, target, request, source="ecmwf", cache_dir=None):
+    """
+    Retrieve a single request to target and record its size and duration.
+
+    Parameters:
+    - client (Client): Open-data client.
+    - target (str): Path of the GRIB file to write.
+    - request (dict): Keyword arguments passed to Client.retrieve.
+    - source (str): Open-data source name or base URL, part of the cache key.
+    - cache_dir (str): Optional download cache directory (see download_cache.py).
+
+    Returns:
+    - stats (dict): target, bytes, seconds, whether it was cached and forecast datetime of the retrieval.
+    """
+    start = time.perf_counter()
+    key = request_key(source, request)
+    results = []
+    cached = cached_download(cache_dir if key else None, key, target,
+                             lambda: results.append(client.retrieve(target=target, **request)))
+    elapsed = time.perf_counter() - start
+    return {
+        "target": target,
+        "bytes": os.path.getsize(target),
+        "seconds": elapsed,
+        "cached": cached,
+        "datetime": getattr(results[0], "datetime", None) if results else None,
+    }
+
+
+def cycle_date(mydate=0):
+    """
+    Resolve a relative forecast date (0 = today, -1 = yesterday, ...) to a UTC date.
+
+    Parameters:
+    - mydate (int): Days relative to today (UTC).
+
+    Returns:
+    - date (datetime.date): Date of the forecast cycle.
+    """
+    return (datetime.now(timezone.utc) + timedelta(days=mydate)).date()
+
+
+def index_url(source, date, fctime, step, ensemble=False):
+    """
+    URL of the index file published with one forecast step.
+
+    Parameters:
+    - source (str): Open-data source name or base URL.
+    - date (datetime.date): Date of the forecast cycle.
+    - fctime (int): Forecast start time (0, 6, 12 or 18 UTC).
+    - step (int): Forecast step (h).
+    - ensemble (bool): Index of the ensemble (enfo) instead of the HRES forecast.
+
+    Returns:
+    - url (str): URL of the .index file.
+    """
+    base = SOURCE_URLS.get(source, source).rstrip("/")
+    if ensemble:
+        stream, type = "enfo", "ef"
+    else:
+        stream, type = ("oper", "fc") if fctime in (0, 12) else ("scda", "fc")
+    ymd = date.strftime("%Y%m%d")
+    return f"{base}/{ymd}/{fctime:02d}z/ifs/0p25/{stream}/{ymd}{fctime:02d}0000-{step}h-{stream}-{type}.index"
+
+
+def is_published(url, timeout=30):
+    """
+    Check with a HEAD request whether a file has been published.
+
+    Parameters:
+    - url (str): URL to check.
+    - timeout (float): Request timeout (s).
+
+    Returns:
+    - published (bool): True if the server answers 200.
+    """
+    request = urllib.request.Request(url, method="HEAD")
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status == 200
+    except OSError:
+        # 404/403 until the step is released (URLError), or a transient network
+        # error (timeout, connection reset, ...), the step is probed again later
+        return False
+
+
+async def wait_for_steps(source, date, fctime, steps, poll=60, max_poll=600, timeout=6 * 3600,
+                         published=None, probes=None, ensemble=False):
+    """
+    Wait until the index files of all steps of a cycle are published.
+
+    The steps still missing are probed concurrently, with an exponential backoff
+    between rounds from poll up to max_poll seconds.
+
+    Parameters:
+    - source (str): Open-data source name or base URL.
+    - date (datetime.date): Date of the forecast cycle.
+    - fctime (int): Forecast start time (UTC).
+    - steps (list): Forecast steps (h) to wait for.
+    - poll (float): First wait between rounds (s).
+    - max_poll (float): Maximum wait between rounds (s).
+    - timeout (float): Give up after this many seconds.
+    - published (set): Optional set of URLs already seen, shared between waiters.
+    - probes (asyncio.Semaphore): Optional limit on concurrent HEAD requests.
+    - ensemble (bool): Wait for the ensemble instead of the HRES forecast.
+
+    Raises:
+    - TimeoutError: If the steps are not all published within timeout.
+    """
+    published = set() if published is None else published
+    probes = asyncio.Semaphore(8) if probes is None else probes
+    deadline = time.monotonic() + timeout
+    delay = poll
+
+    async def probe(url):
+        async with probes:
+            if url not in published and await asyncio.to_thread(is_published, url):
+                published.add(url)
+
+    pending = [index_url(source, date, fctime, step, ensemble) for step in steps]
+    while True:
+        await asyncio.gather(*(probe(url) for url in pending))
+        pending = [url for url in pending if url not in published]
+        if not pending:
+            return
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f"{len(pending)} steps of {date} {fctime:02d}z not published after {timeout} s")
+        print(f"{len(pending)} steps of {date} {fctime:02d}z not yet published, retrying in {delay:.0f} s")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, max_poll)
+
+
+async def poll_and_retrieve(fctime=0, mydate=0, source="ecmwf", client=None, max_workers=4, cache_dir=None,
+                            directory=".", ensemble=False, **wait_kwargs):
+    """
+    Retrieve the forecast requests of a cycle, each as soon as its steps are published.
+
+    Parameters:
+    - fctime (int): Forecast start time (0 or 12 UTC).
+    - mydate (int): Forecast date relative to today (UTC), 0 = today.
+    - source (str): Open-data source name or base URL (eg a local test server).
+    - client (Client): Optional existing client to share.
+    - max_workers (int): Maximum number of concurrent downloads.
+    - cache_dir (str): Optional download cache directory, cached requests are not polled for.
+    - directory (str): Directory the GRIB files are written to.
+    - ensemble (bool): Retrieve all ensemble members instead of the HRES forecast.
+    - wait_kwargs: Passed to wait_for_steps (poll, max_poll, timeout).
+
+    Returns:
+    - stats (list): One dict per request (see retrieve_one), in request order.
+    """
+    if client is None:
+        client = Client(source=source)
+    date = cycle_date(mydate)
+    requests = forecast_requests(fctime, date.strftime("%Y%m%d"), ensemble)
+    published = set()
+    probes = asyncio.Semaphore(8)
+    downloads = asyncio.Semaphore(max_workers)
+
+    async def fetch(target, request):
+        if cache_dir is None or not os.path.exists(os.path.join(cache_dir, request_key(source, request))):
+            await wait_for_steps(source, date, fctime, request["step"], published=published, probes=probes,
+                                 ensemble=ensemble, **wait_kwargs)
+            print(f"Steps for {target} published, downloading")
+        async with downloads:
+            return await asyncio.to_thread(retrieve_one, client, os.path.join(directory, target), request, source,
+                                           cache_dir)
+
+    start = time.perf_counter()
+    stats = await asyncio.gather(*(fetch(target, request) for target, request in requests))
+    total = time.perf_counter() - start
+
+    for s in stats:
+        print(f"{'Cached' if s['cached'] else 'Downloaded'} {s['target']}: {s['bytes'] / 1e6:.1f} MB in {s['seconds']:.1f} s")
+    print(f"Forecast {date} {fctime:02d}z retrieved in {total:.1f} s")
+    return list(stats)
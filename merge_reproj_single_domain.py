@@ -9,6 +9,7 @@ from rasterio.enums import Resampling
 import numpy as np
 import sys
 import upload as s3
+from stage_profiler import stage
 import glob
 
 mydir = sys.argv[1]
@@ -21,6 +22,8 @@ SNOW_MODEL_BUCKET = "snow-model-data-source"
 PARAMETERS = ["HS", "SWE"]
 aws_access_key_id = "xxxx"
 aws_secret_access_key ="xxxx"
+# files to upload, (file, s3 path, variable name), uploaded together at the end as one profiled stage
+uploads = []
 
 #year= sys.argv[1]
 startTime = datetime.now()
@@ -150,12 +153,7 @@ for time_idx, time_value in enumerate(ds1.Time.values):
     if upload_to_aws == True:
         parameter = "SWE"
         s3_path = s3.get_file_path(formatted_date, parameter)
-        success = s3.upload_file(output_filename_nc, SNOW_MODEL_BUCKET, s3_path, aws_access_key_id, aws_secret_access_key)
-
-        if success:
-            print(f"{variable_name} File uploaded successfully!")
-        else:
-            print(f"{variable_name} File upload failed.")
+        uploads.append((output_filename_nc, s3_path, variable_name))
 
 #========== HS computation ====================================================
 
@@ -269,12 +267,7 @@ for time_idx, time_value in enumerate(ds1.Time.values):
     if upload_to_aws== True:
         parameter = "HS"
         s3_path = s3.get_file_path(formatted_date, parameter)
-        success = s3.upload_file(output_filename_nc, SNOW_MODEL_BUCKET, s3_path, aws_access_key_id, aws_secret_access_key)
-
-        if success:
-            print(f"{variable_name} File uploaded successfully!")
-        else:
-            print(f"{variable_name} File upload failed.")
+        uploads.append((output_filename_nc, s3_path, variable_name))
 
 
 
@@ -392,9 +385,16 @@ for time_idx, time_value in enumerate(ds1.Time.values):
     if upload_to_aws== True:
         parameter = "ROF"
         s3_path = s3.get_file_path(formatted_date, parameter)
-        success = s3.upload_file(output_filename_nc, SNOW_MODEL_BUCKET, s3_path, aws_access_key_id, aws_secret_access_key)
+        uploads.append((output_filename_nc, s3_path, variable_name))
+
+
+# Upload all files of the run as one stage
+if uploads:
+    with stage('upload'):
+        for output_filename_nc, s3_path, variable_name in uploads:
+            success = s3.upload_file(output_filename_nc, SNOW_MODEL_BUCKET, s3_path, aws_access_key_id, aws_secret_access_key)
 
-        if success:
-            print(f"{variable_name} File uploaded successfully!")
-        else:
-            print(f"{variable_name} File upload failed.")
+            if success:
+                print(f"{variable_name} File uploaded successfully!")
+            else:
+                print(f"{variable_name} File upload failed.")
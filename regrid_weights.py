@@ -0,0 +1,167 @@
+# Bilinear regridding of the IFS forecast onto the ERA5 grid with precomputed weights.
+# The source and target grids never change, so the interpolation weights are built
+# once as a sparse matrix (target points x source points), stored on disk under
+# the hashes of both grids and applied to all times, levels and variables of a
+# dataset with a single sparse matrix product. Results match
+# ds.interp(latitude=..., longitude=...) (linear, NaN outside the source grid).
+
+import os
+import hashlib
+import numpy as np
+import scipy.sparse
+import xarray as xr
+
+
+_weights = {}
+
+
+def grid_hash(lat, lon):
+    """
+    Hash the coordinates of a regular lat/lon grid.
+
+    Parameters:
+    - lat (array): Latitudes.
+    - lon (array): Longitudes.
+
+    Returns:
+    - hash (str): Hex digest of the coordinates.
+    """
+    digest = hashlib.sha256()
+    for coord in (lat, lon):
+        digest.update(np.round(np.asarray(coord, dtype='float64'), 6).tobytes())
+        digest.update(b'|')
+    return digest.hexdigest()
+
+
+def linear_weights_1d(source, target):
+    """
+    Indices and weights of linear interpolation along one axis.
+
+    Parameters:
+    - source (array): Monotonic source coordinate (ascending or descending).
+    - target (array): Target coordinate.
+
+    Returns:
+    - lower, upper (numpy.ndarray): Indices into source bracketing every target point.
+    - weight (numpy.ndarray): Weight of upper, NaN for targets outside the source range.
+    """
+    source = np.asarray(source, dtype='float64')
+    target = np.asarray(target, dtype='float64')
+    order = np.argsort(source)
+    ascending = source[order]
+    if len(ascending) == 1:
+        inside = np.isclose(target, ascending[0])
+        index = np.zeros(len(target), dtype=int)
+        return order[index], order[index], np.where(inside, 0., np.nan)
+
+    upper = np.clip(np.searchsorted(ascending, target), 1, len(ascending) - 1)
+    lower = upper - 1
+    weight = (target - ascending[lower]) / (ascending[upper] - ascending[lower])
+    weight[(target < ascending[0]) | (target > ascending[-1])] = np.nan
+    return order[lower], order[upper], weight
+
+
+def bilinear_weights(src_lat, src_lon, dst_lat, dst_lon):
+    """
+    Build the sparse bilinear interpolation matrix from one lat/lon grid to another.
+
+    Parameters:
+    - src_lat, src_lon (array): Source grid coordinates.
+    - dst_lat, dst_lon (array): Target grid coordinates.
+
+    Returns:
+    - weights (scipy.sparse.csr_matrix): Matrix of shape (target points, source points),
+      points flattened in (lat, lon) order. Rows of targets outside the source grid are empty.
+    """
+    lat_lower, lat_upper, lat_weight = linear_weights_1d(src_lat, dst_lat)
+    lon_lower, lon_upper, lon_weight = linear_weights_1d(src_lon, dst_lon)
+    n_lon = len(src_lon)
+
+    rows, cols, values = [], [], []
+    dst_index = np.arange(len(dst_lat) * len(dst_lon)).reshape(len(dst_lat), len(dst_lon))
+    for lat_index, lat_w in ((lat_lower, 1 - lat_weight), (lat_upper, lat_weight)):
+        for lon_index, lon_w in ((lon_lower, 1 - lon_weight), (lon_upper, lon_weight)):
+            rows.append(dst_index.ravel())
+            cols.append((lat_index[:, None] * n_lon + lon_index[None, :]).ravel())
+            values.append((lat_w[:, None] * lon_w[None, :]).ravel())
+    rows, cols, values = np.concatenate(rows), np.concatenate(cols), np.concatenate(values)
+
+    # drop targets outside the source grid and zero weights (a zero weight must not pick up NaN)
+    keep = np.isfinite(values) & (values != 0)
+    weights = scipy.sparse.coo_matrix((values[keep], (rows[keep], cols[keep])),
+                                      shape=(dst_index.size, len(src_lat) * n_lon))
+    return weights.tocsr()
+
+
+def get_weights(src_lat, src_lon, dst_lat, dst_lon, weights_dir=None):
+    """
+    Return the interpolation matrix between two grids, from memory, disk or computed.
+
+    Parameters:
+    - src_lat, src_lon (array): Source grid coordinates.
+    - dst_lat, dst_lon (array): Target grid coordinates.
+    - weights_dir (str): Directory to store the weights in, None to keep them in memory only.
+
+    Returns:
+    - weights (scipy.sparse.csr_matrix): See bilinear_weights.
+    - valid (numpy.ndarray): True for target points inside the source grid.
+    """
+    key = f"{grid_hash(src_lat, src_lon)[:16]}_{grid_hash(dst_lat, dst_lon)[:16]}"
+    if key not in _weights:
+        weights_file = os.path.join(weights_dir, f"bilinear_{key}.npz") if weights_dir else None
+        if weights_file and os.path.exists(weights_file):
+            weights = scipy.sparse.load_npz(weights_file).tocsr()
+        else:
+            weights = bilinear_weights(src_lat, src_lon, dst_lat, dst_lon)
+            if weights_file:
+                os.makedirs(weights_dir, exist_ok=True)
+                scipy.sparse.save_npz(weights_file, weights)
+                print(f"Saved regridding weights to {weights_file}")
+        valid = np.isclose(np.asarray(weights.sum(axis=1)).ravel(), 1.)
+        _weights[key] = (weights, valid)
+    return _weights[key]
+
+
+def regrid(ds, dst_lat, dst_lon, weights_dir=None):
+    """
+    Bilinearly interpolate all gridded variables of a dataset onto a target grid.
+
+    All variables, times and levels are stacked into one array so the whole dataset
+    is regridded with a single sparse matrix product.
+
+    Parameters:
+    - ds (xarray.Dataset): Dataset with 'latitude' and 'longitude' dimensions.
+    - dst_lat, dst_lon (array or xarray.DataArray): Target grid coordinates.
+    - weights_dir (str): Directory to store the weights in, see get_weights.
+
+    Returns:
+    - ds_regridded (xarray.Dataset): Dataset on the target grid, points outside the source grid are NaN.
+    """
+    dst_lat = np.asarray(dst_lat)
+    dst_lon = np.asarray(dst_lon)
+    weights, valid = get_weights(ds['latitude'].values, ds['longitude'].values, dst_lat, dst_lon, weights_dir)
+    n_src = ds.sizes['latitude'] * ds.sizes['longitude']
+
+    gridded = [name for name in ds.data_vars if {'latitude', 'longitude'} <= set(ds[name].dims)]
+    blocks, shapes = [], []
+    for name in gridded:
+        da = ds[name].transpose(..., 'latitude', 'longitude')
+        shapes.append((da.dims, da.shape[:-2]))
+        blocks.append(np.asarray(da.values, dtype='float64').reshape(-1, n_src))
+    stacked = np.concatenate(blocks) if blocks else np.empty((0, n_src))
+
+    # (target points x source points) @ (source points x everything else)
+    result = np.asarray(weights @ stacked.T).T
+    result[:, ~valid] = np.nan
+
+    out = ds.drop_dims(['latitude', 'longitude']).assign_coords(latitude=dst_lat, longitude=dst_lon)
+    offset = 0
+    for name, (dims, leading) in zip(gridded, shapes):
+        n = int(np.prod(leading, dtype=int))
+        values = result[offset:offset + n].reshape(*leading, len(dst_lat), len(dst_lon))
+        if np.issubdtype(ds[name].dtype, np.floating):
+            values = values.astype(ds[name].dtype, copy=False)
+        # back to the variable's own dimension order, as ds.interp returns it
+        out[name] = xr.Variable(dims, values, ds[name].attrs).transpose(*ds[name].dims)
+        offset += n
+    return out
@@ -3,9 +3,11 @@ import sys
 import shutil
 import glob
 import fnmatch
+import xarray as xr
 from pathlib import Path
 from datetime import datetime
-from netCDF4 import Dataset, num2date
+from time_probe import get_last_timestamp, get_first_timestamp
+from staging import stage_tree, stage_file, IGNORE_PATTERNS, MUTABLE_PATTERNS
 from TopoPyScale import topoclass as tc
 
 def load_config(config_file):
@@ -20,41 +22,6 @@ def load_config(config_file):
     """
     return tc.Topoclass(config_file)
 
-def get_last_timestamp(nc_file):
-    """
-    Extract the last timestamp from a NetCDF file.
-    
-    Parameters:
-    - nc_file (str): Path to the NetCDF file.
-    
-    Returns:
-    - last_timestamp (datetime): The last timestamp in the NetCDF file.
-    """
-    with Dataset(nc_file, 'r') as nc_dataset:
-        time_variable = nc_dataset.variables['time']
-        time_values = time_variable[:]
-        timestamps = num2date(time_values, units=time_variable.units, calendar=time_variable.calendar)
-        last_timestamp = timestamps[-1]
-    return last_timestamp
-
-
-def get_first_timestamp(nc_file):
-    """
-    Extract the last timestamp from a NetCDF file.
-
-    Parameters:
-    - nc_file (str): Path to the NetCDF file.
-
-    Returns:
-    - last_timestamp (datetime): The last timestamp in the NetCDF file.
-    """
-    with Dataset(nc_file, 'r') as nc_dataset:
-        time_variable = nc_dataset.variables['time']
-        time_values = time_variable[:]
-        timestamps = num2date(time_values, units=time_variable.units, calendar=time_variable.calendar)
-        first_timestamp = timestamps[0]
-    return first_timestamp
-
 def determine_days_in_month(last_timestamp):
     """
     Determine the number of days in the current month based on the last timestamp.
@@ -70,40 +37,45 @@ def determine_days_in_month(last_timestamp):
 
 
 
-def clean_and_prepare_output_dir(mainwdir, newdir):
+def clean_and_prepare_output_dir(mainwdir, newdir, link=True):
     """
-    Clean the main output directory and copy its contents to a new directory,
+    Clean the main output directory and stage its contents in a new directory,
     excluding files matching the pattern 'FSM_pt_*.txt'.
     
     Parameters:
     - mainwdir (str): Main working directory.
     - newdir (str): New directory for the simulation outputs.
+    - link (bool): If True, reflink the master outputs where the filesystem supports it instead of copying them (see staging.py).
     """
     source_dir = os.path.join(mainwdir, "outputs")
     destination_dir = os.path.join(newdir, "outputs")
     
-    # Function to ignore files matching the pattern 'FSM_pt_*.txt'
     # Function to ignore files matching the patterns 'FSM_pt_*.txt', '*HS.nc', and '*SWE.nc'
     def ignore_files(dir, files):
-        ignore_patterns = ['FSM_pt_*.txt', '*HS.nc', '*SWE.nc']
-        return [f for f in files if any(fnmatch.fnmatch(f, pattern) for pattern in ignore_patterns)]
+        return [f for f in files if any(fnmatch.fnmatch(f, pattern) for pattern in IGNORE_PATTERNS)]
     
     # Remove the new directory if it exists
     if os.path.exists(newdir):
         shutil.rmtree(newdir)
     
-    # Copy the output directory to the new location, ignoring 'FSM_pt_*.txt' files
-    if os.path.exists(source_dir):
-        shutil.copytree(source_dir, destination_dir, ignore=ignore_files)
-    else:
+    # Stage the output directory in the new location, ignoring 'FSM_pt_*.txt' files
+    if not os.path.exists(source_dir):
         raise FileNotFoundError(f"Source directory '{source_dir}' does not exist.")
+    if link:
+        # copy-on-write clones where the filesystem supports them, copies otherwise
+        stage_tree(source_dir, destination_dir, IGNORE_PATTERNS, MUTABLE_PATTERNS)
+    else:
+        shutil.copytree(source_dir, destination_dir, ignore=ignore_files)
     
-    # Copy the FSM file if it exists (but do not exclude any specific FSM files)
+    # Stage the FSM binary if it exists (it is never written to)
     src = os.path.join(mainwdir, "FSM")
     dst = os.path.join(newdir, "FSM")
     if os.path.exists(src):
-        shutil.copyfile(src, dst)
-        shutil.copymode(src, dst)  # Copy the file mode
+        if link:
+            stage_file(src, dst)
+        else:
+            shutil.copyfile(src, dst)
+            shutil.copymode(src, dst)  # Copy the file mode
     else:
         raise FileNotFoundError(f"FSM file '{src}' does not exist.")
 
@@ -128,6 +100,25 @@ def update_config_paths_fc(mp, newdir, first_timestamp, last_timestamp):
     mp.config.project.start = mp.config.project.start.replace(year=first_timestamp.year, month=first_timestamp.month, day=first_timestamp.day)
     mp.config.project.end = mp.config.project.end.replace(year=last_timestamp.year, month=last_timestamp.month, day=last_timestamp.day-1)
 
+def export_member(forecast_dir, member):
+    """
+    Write one member of the ensemble forecast (fetch_ifs_forecast.py --ensemble) as forecast files.
+
+    Parameters:
+    - forecast_dir (str): Forecast directory holding SURF_ENS.zarr and PLEV_ENS.zarr.
+    - member (int): Ensemble member number (0 is the control forecast).
+
+    Returns:
+    - member_dir (str): Directory with SURF_fc.nc and PLEV_fc.nc of the member.
+    """
+    member_dir = os.path.join(forecast_dir, f"ens_m{member:02d}/")
+    os.makedirs(member_dir, exist_ok=True)
+    for prefix in ["SURF", "PLEV"]:
+        with xr.open_zarr(os.path.join(forecast_dir, f"{prefix}_ENS.zarr")) as ds:
+            ds.sel(member=member).drop_vars('member').to_netcdf(os.path.join(member_dir, f"{prefix}_fc.nc"))
+    print(f"Ensemble member {member} written to {member_dir}")
+    return member_dir
+
 def perform_simulation(mp):
     """
     Perform the simulation steps using the updated configuration.
@@ -143,7 +134,7 @@ def perform_simulation(mp):
     mp.downscale_climate()
     mp.to_fsm()
 
-def main(mydir):
+def main(mydir, member=None):
     os.chdir(mydir)
     start_time = datetime.now()
 
@@ -155,6 +146,9 @@ def main(mydir):
 
     # Get the last timestamp and determine the number of days in the forecast file
     nc_file = f'../master/inputs/climate/forecast/SURF_fc.nc'
+    if member is not None:
+        member_dir = export_member('../master/inputs/climate/forecast', member)
+        nc_file = os.path.join(member_dir, 'SURF_fc.nc')
     last_timestamp = get_last_timestamp(nc_file)
     first_timestamp  = get_first_timestamp(nc_file)
 
@@ -165,11 +159,13 @@ def main(mydir):
 
 
     # Prepare the output directory
-    newdir = os.path.join(mainwdir, f"sim_fc/")
+    newdir = os.path.join(mainwdir, f"sim_fc/" if member is None else f"sim_fc_m{member:02d}/")
     clean_and_prepare_output_dir(mainwdir, newdir)
 
     # Update configuration paths
     update_config_paths_fc(mp, newdir, first_timestamp, last_timestamp)
+    if member is not None:
+        mp.config.climate.path = os.path.abspath(member_dir) + '/'
 
     # Perform the simulation
     perform_simulation(mp)
@@ -177,5 +173,7 @@ def main(mydir):
     print(f"Script completed in {datetime.now() - start_time}")
 
 if __name__ == "__main__":
+    # python run_forecast.py <dir> [--member N]
     mydir = sys.argv[1]
-    main(mydir)
+    member = int(sys.argv[sys.argv.index('--member') + 1]) if '--member' in sys.argv[2:] else None
+    main(mydir, member)
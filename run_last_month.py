@@ -6,7 +6,8 @@ import numpy as np
 import pandas as pd
 from pathlib import Path
 from datetime import datetime
-from netCDF4 import Dataset, num2date
+from time_probe import get_last_timestamp
+from staging import stage_tree, stage_file, IGNORE_PATTERNS, MUTABLE_PATTERNS
 from TopoPyScale import topoclass as tc
 
 def load_config(config_file):
@@ -22,23 +23,6 @@ def load_config(config_file):
     mp = tc.Topoclass(config_file)
     return mp
 
-def get_last_timestamp(nc_file):
-    """
-    Extract the last timestamp from a NetCDF file.
-    
-    Parameters:
-    - nc_file (str): Path to the NetCDF file.
-    
-    Returns:
-    - last_timestamp (datetime): The last timestamp in the NetCDF file.
-    """
-    with Dataset(nc_file, 'r') as nc_dataset:
-        time_variable = nc_dataset.variables['time']
-        time_values = time_variable[:]
-        timestamps = num2date(time_values, units=time_variable.units, calendar=time_variable.calendar)
-        last_timestamp = timestamps[-1]
-    return last_timestamp
-
 def determine_days_in_month(last_timestamp):
     """
     Determine the number of days in the current month based on the last timestamp.
@@ -51,40 +35,45 @@ def determine_days_in_month(last_timestamp):
     """
     return last_timestamp.day if last_timestamp.hour == 23 else last_timestamp.day - 1
 
-def clean_and_prepare_output_dir(mainwdir, newdir):
+def clean_and_prepare_output_dir(mainwdir, newdir, link=True):
     """
-    Clean the main output directory and copy its contents to a new directory,
+    Clean the main output directory and stage its contents in a new directory,
     excluding files matching the pattern 'FSM_pt_*.txt'.
     
     Parameters:
     - mainwdir (str): Main working directory.
     - newdir (str): New directory for the simulation outputs.
+    - link (bool): If True, reflink the master outputs where the filesystem supports it instead of copying them (see staging.py).
     """
     source_dir = os.path.join(mainwdir, "outputs")
     destination_dir = os.path.join(newdir, "outputs")
     
-    # Function to ignore files matching the pattern 'FSM_pt_*.txt'
     # Function to ignore files matching the patterns 'FSM_pt_*.txt', '*HS.nc', and '*SWE.nc'
     def ignore_files(dir, files):
-        ignore_patterns = ['FSM_pt_*.txt', '*HS.nc', '*SWE.nc']
-        return [f for f in files if any(fnmatch.fnmatch(f, pattern) for pattern in ignore_patterns)]
+        return [f for f in files if any(fnmatch.fnmatch(f, pattern) for pattern in IGNORE_PATTERNS)]
     
     # Remove the new directory if it exists
     if os.path.exists(newdir):
         shutil.rmtree(newdir)
     
-    # Copy the output directory to the new location, ignoring 'FSM_pt_*.txt' files
-    if os.path.exists(source_dir):
-        shutil.copytree(source_dir, destination_dir, ignore=ignore_files)
-    else:
+    # Stage the output directory in the new location, ignoring 'FSM_pt_*.txt' files
+    if not os.path.exists(source_dir):
         raise FileNotFoundError(f"Source directory '{source_dir}' does not exist.")
+    if link:
+        # copy-on-write clones where the filesystem supports them, copies otherwise
+        stage_tree(source_dir, destination_dir, IGNORE_PATTERNS, MUTABLE_PATTERNS)
+    else:
+        shutil.copytree(source_dir, destination_dir, ignore=ignore_files)
     
-    # Copy the FSM file if it exists (but do not exclude any specific FSM files)
+    # Stage the FSM binary if it exists (it is never written to)
     src = os.path.join(mainwdir, "FSM")
     dst = os.path.join(newdir, "FSM")
     if os.path.exists(src):
-        shutil.copyfile(src, dst)
-        shutil.copymode(src, dst)  # Copy the file mode
+        if link:
+            stage_file(src, dst)
+        else:
+            shutil.copyfile(src, dst)
+            shutil.copymode(src, dst)  # Copy the file mode
     else:
         raise FileNotFoundError(f"FSM file '{src}' does not exist.")
 
@@ -7,6 +7,10 @@ from TopoPyScale import topoclass as tc
 from munch import DefaultMunch
 import xarray as xr
 import numpy as np
+from coverage_manifest import load_manifest, save_manifest, missing_timesteps, scan_coverage
+from time_probe import get_last_timestamp
+from era5_daily import era5_daily_path, get_era5_cached
+from stage_profiler import stage
 
 
 def load_config(config_file):
@@ -45,20 +49,21 @@ def parse_filename(file_path):
     end_date = start_date + pd.offsets.MonthEnd(0) + pd.DateOffset(hours=23)
     return start_date, end_date
 
-def check_timesteps(file_path, error_files):
+def check_timesteps(file_path, error_files, manifest=None):
     """
     Check if all model timesteps are present in a file.
     
     Parameters:
     - file_path (str): Path to the file to check.
     - error_files (list): List to append files with missing timesteps.
+    - manifest (dict): Coverage manifest (coverage_manifest.py), unchanged files are not opened. None to always scan.
     """
     try:
-        ds = xr.open_dataset(file_path)
-        actual_time_steps = pd.to_datetime(ds.time.values)
         start_date, end_date = parse_filename(file_path)
-        expected_time_steps = pd.date_range(start=start_date, end=end_date, freq='1H')
-        missing_time_steps = expected_time_steps[~expected_time_steps.isin(actual_time_steps)]
+        if manifest is None:
+            missing_time_steps = scan_coverage(file_path, start_date, end_date)
+        else:
+            missing_time_steps = missing_timesteps(file_path, start_date, end_date, manifest)
         if missing_time_steps.empty:
             print(f"All model timesteps are present in {file_path}.")
         else:
@@ -82,6 +87,121 @@ def delete_files(file_paths):
         except Exception as e:
             print(f"Error deleting file or file doesn't exist {file_path}: {str(e)}")
 
+def splice_timesteps(file_path, ds_new):
+    """
+    Insert new timesteps into a monthly climate file.
+
+    Timesteps after the end of the file are appended in place through netCDF4 when the
+    time dimension is unlimited. Anything else (gaps inside the month, fixed time
+    dimension) rewrites the file to a temporary file that replaces it.
+
+    Parameters:
+    - file_path (str): Path to the monthly SURF/PLEV file.
+    - ds_new (xarray.Dataset): Timesteps to insert, same variables and grid as the file.
+    """
+    from netCDF4 import Dataset, date2num
+
+    new_times = pd.to_datetime(ds_new.time.values)
+    with Dataset(file_path, 'r') as nc:
+        unlimited = nc.dimensions['time'].isunlimited()
+    last_time = get_last_timestamp(file_path)
+
+    if unlimited and new_times[0] > pd.Timestamp(last_time):
+        with Dataset(file_path, 'a') as nc:
+            time_variable = nc.variables['time']
+            n, k = len(nc.dimensions['time']), len(new_times)
+            time_variable[n:n + k] = date2num(new_times.to_pydatetime(), time_variable.units,
+                                              getattr(time_variable, 'calendar', 'standard'))
+            for name, variable in nc.variables.items():
+                if name == 'time' or 'time' not in variable.dimensions:
+                    continue
+                index = [slice(None)] * variable.ndim
+                index[variable.dimensions.index('time')] = slice(n, n + k)
+                variable[tuple(index)] = ds_new[name].transpose(*variable.dimensions).values
+        print(f"Appended {len(new_times)} timesteps to {file_path}")
+        return
+
+    tmp_file = file_path + '.tmp'
+    with xr.open_dataset(file_path) as ds:
+        ds_all = xr.concat([ds, ds_new], dim='time').sortby('time')
+        ds_all = ds_all.isel(time=~ds_all.get_index('time').duplicated())
+        ds_all.to_netcdf(tmp_file)
+    os.replace(tmp_file, file_path)
+    print(f"Inserted {len(new_times)} timesteps into {file_path}")
+
+
+def repair_files(mp, file_paths, manifest, max_days=10):
+    """
+    Fill missing days of monthly climate files from daily ERA5 downloads.
+
+    Only the days with missing hours (up to the last day ERA5 is available) are
+    spliced into the monthly file. Days whose daily file is in the forecast directory
+    are read from it, the others are downloaded with get_era5_snowmapper into a
+    scratch directory and only those are post-processed. Hours after the last
+    available day are not gaps and are left for later runs.
+
+    Parameters:
+    - mp (Topoclass): Topoclass object with the loaded configuration.
+    - file_paths (list): Monthly files with missing timesteps.
+    - manifest (dict): Coverage manifest, see coverage_manifest.py.
+    - max_days (int): Files missing more days than this are not repaired, the whole month is downloaded instead.
+
+    Returns:
+    - failed (list): Files that could not be repaired.
+    """
+    lastday = pd.Timestamp(mp.get_lastday())
+    forecast_dir = os.path.join(mp.config.climate.path, 'forecast')
+    cache_dir = os.path.join(forecast_dir, 'cache')
+    failed = []
+    for file_path in file_paths:
+        surf_plev = os.path.basename(file_path).split('_')[0].lower()
+        start_date, end_date = parse_filename(file_path)
+        try:
+            missing = missing_timesteps(file_path, start_date, end_date, manifest)
+        except (FileNotFoundError, KeyError, OSError) as e:
+            print(f"Cannot repair {file_path}: {str(e)}")
+            failed.append(file_path)
+            continue
+
+        missing = missing[missing <= lastday + pd.DateOffset(hours=23)]
+        days = missing.normalize().unique()
+        if len(days) > max_days:
+            print(f"{file_path} misses {len(days)} days, downloading the whole month instead")
+            failed.append(file_path)
+            continue
+        if len(days) == 0:
+            continue
+
+        scratch_dir = os.path.join(forecast_dir, 'repair', os.path.basename(file_path).split('.')[0])
+        try:
+            daily_files = [era5_daily_path(mp, surf_plev, day) for day in days]
+            downloads = [day for day, daily_file in zip(days, daily_files) if not os.path.exists(daily_file)]
+            if downloads:
+                print(f"Repairing {file_path}, downloading days: {[str(day.date()) for day in downloads]}")
+                os.makedirs(scratch_dir, exist_ok=True)
+                scratch_files = {day: get_era5_cached(mp, surf_plev, day, cache_dir, target_dir=scratch_dir)
+                                 for day in downloads}
+                if surf_plev == 'surf':
+                    mp.process_SURF_file(scratch_dir)
+                mp.remap_netcdf(scratch_dir)
+                daily_files = [scratch_files.get(day, daily_file) for day, daily_file in zip(days, daily_files)]
+
+            with xr.open_mfdataset(daily_files, combine='by_coords') as ds_days:
+                with xr.open_dataset(file_path) as ds:
+                    variables = list(ds.data_vars)
+                ds_new = ds_days[variables].sel(time=missing).load()
+            splice_timesteps(file_path, ds_new)
+
+            remaining = missing_timesteps(file_path, start_date, end_date, manifest)
+            if (remaining <= lastday + pd.DateOffset(hours=23)).any():
+                raise ValueError(f"still missing {remaining}")
+        except Exception as e:
+            print(f"Repair of {file_path} failed: {str(e)}")
+            failed.append(file_path)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+    return failed
+
 def generate_file_paths(start_year, end_year, end_month, file_types):
     """
     Generate file paths for a given range of months and file types.
@@ -183,20 +303,31 @@ def main():
     file_types = ['./inputs/climate/SURF', './inputs/climate/PLEV']
     file_paths = generate_file_paths(start_year, current_year, current_month, file_types)
 
-    error_files = []
-    for file_path in file_paths:
-        check_timesteps(file_path, error_files)
+    # coverage of unchanged monthly files is read from the manifest instead of the files
+    manifest_file = './inputs/climate/coverage.json'
+    manifest = load_manifest(manifest_file)
     
+    # Initialize Topoclass and perform operations
+    mp = tc.Topoclass(config_file)
+
+    with stage('repair'):
+        error_files = []
+        for file_path in file_paths:
+            check_timesteps(file_path, error_files, manifest)
+
+        # fill missing days in place, only files that cannot be repaired are downloaded again in full
+        if error_files and '--no-repair' not in sys.argv[2:]:
+            error_files = repair_files(mp, error_files, manifest)
+        save_manifest(manifest, manifest_file)
+
     if error_files:
         print("Files with errors now deleted:", error_files)
         delete_files(error_files)
-    
-    # Initialize Topoclass and perform operations
-    mp = tc.Topoclass(config_file)
 
     # download latest climate data
-    mp.get_era5()
-    mp.remap_netcdf()
+    with stage('fetch'):
+        mp.get_era5()
+        mp.remap_netcdf()
     
 #    # Trim forecast data to make sure no overlap with latest download month
 #    latest_nc_file_surf = f'./inputs/climate/SURF_{current_year:04d}{current_month:02d}.nc'
@@ -9,6 +9,15 @@ import xarray as xr
 import numpy as np
 import concurrent.futures
 import glob
+import random
+import time
+from era5_daily import get_era5_cached, post_process_era5_day
+from coverage_manifest import missing_timesteps, scan_coverage
+from regrid_weights import regrid
+from forcing_store import advance_store, export_forcing
+from forcing_view import regridded_piece, write_view, prune_pieces
+from stage_profiler import profiled
+from forecast_archive import manage_forecast_archive
 
 
 
@@ -48,20 +57,21 @@ def parse_filename(file_path):
     end_date = start_date + pd.offsets.MonthEnd(0) + pd.DateOffset(hours=23)
     return start_date, end_date
 
-def check_timesteps(file_path, error_files):
+def check_timesteps(file_path, error_files, manifest=None):
     """
     Check if all model timesteps are present in a file.
     
     Parameters:
     - file_path (str): Path to the file to check.
     - error_files (list): List to append files with missing timesteps.
+    - manifest (dict): Coverage manifest (coverage_manifest.py), unchanged files are not opened. None to always scan.
     """
     try:
-        ds = xr.open_dataset(file_path)
-        actual_time_steps = pd.to_datetime(ds.time.values)
         start_date, end_date = parse_filename(file_path)
-        expected_time_steps = pd.date_range(start=start_date, end=end_date, freq='1H')
-        missing_time_steps = expected_time_steps[~expected_time_steps.isin(actual_time_steps)]
+        if manifest is None:
+            missing_time_steps = scan_coverage(file_path, start_date, end_date)
+        else:
+            missing_time_steps = missing_timesteps(file_path, start_date, end_date, manifest)
         if missing_time_steps.empty:
             print(f"All model timesteps are present in {file_path}.")
         else:
@@ -214,97 +224,114 @@ def merge_datasets(pattern1, pattern2, output_path):
     #return ds_merged
 
 
-def merge_datasets_filter(pattern1, pattern2, output_path):
+def files_by_date(pattern):
     """
-    Load datasets from specified patterns, interpolate, merge, and save to a new NetCDF file.
+    Index daily files by the date in their name, without opening them.
+
+    Parameters:
+        pattern (str): File pattern, eg './inputs/climate/forecast/SURF_2*.nc' (SURF_YYYYMMDD.nc)
+            or './inputs/climate/forecast/SURF_FC_*.nc' (SURF_FC_YYYY-MM-DD.nc).
+
+    Returns:
+        dict: File path by date (datetime), files without a parsable date are skipped.
+    """
+    index = {}
+    for file in glob.glob(pattern):
+        filename = os.path.basename(file)
+        date_str = filename.split('_')[-1].split('.')[0]  # Extract "YYYYMMDD" or "YYYY-MM-DD"
+        for date_format in ("%Y%m%d", "%Y-%m-%d"):
+            try:
+                index[datetime.strptime(date_str, date_format)] = file
+                break
+            except ValueError:
+                pass
+        else:
+            print(f"Could not parse date from filename: {filename}")
+    return index
+
+
+@profiled('merge')
+def merge_datasets_filter(pattern1, pattern2, output_path, weights_dir=None, window_days=9):
+    """
+    Merge the recent daily ERA5 files with the daily forecast files of the remaining days and save to a new NetCDF file.
+
+    Files are selected by the date in their name before anything is opened: ERA5 days
+    within the window, and forecast days within the window that have no ERA5 file (ERA5
+    is prioritised). The ERA5 files are opened lazily as one dataset chunked by day and
+    the output is written chunk by chunk, so memory does not grow with the number of
+    daily files in the forecast directory.
     
     Parameters:
         pattern1 (str): File pattern for the first group of datasets.
         pattern2 (str): File pattern for the second group of datasets.
         output_path (str): Path to save the merged dataset.
-        
-    Returns:
-        xarray.Dataset: The merged dataset.
+        weights_dir (str): Directory of the stored regridding weights (see regrid_weights.py).
+        window_days (int): Number of past days to merge.
     """
     # Get today's date and calculate the cutoff date (9 days ago)
-    cutoff_date = datetime.now() - timedelta(days=9)
+    cutoff_date = datetime.now() - timedelta(days=window_days)
 
     # Find files that match the patterns
-    grid1_files = glob.glob(pattern1)
-    grid2_files = glob.glob(pattern2)
+    grid1_index = files_by_date(pattern1)
+    grid2_index = files_by_date(pattern2)
     
     # Check if files were found
-    if not grid1_files:
+    if not grid1_index:
         raise FileNotFoundError(f"No files found for pattern: {pattern1}")
-    if not grid2_files:
+    if not grid2_index:
         raise FileNotFoundError(f"No files found for pattern: {pattern2}")
     
-    # Filter grid1_files by date (extract the date from the filename)
-    filtered_grid1_files = []
-    for file in grid1_files:
-        # Extract date from the filename assuming format "SURF_YYYYMMDD.nc"
-        filename = os.path.basename(file)
-        date_str = filename.split('_')[1].split('.')[0]  # Extract "YYYYMMDD"
-        
-        try:
-            file_date = datetime.strptime(date_str, "%Y%m%d")
-            # Only keep files that are after the cutoff date
-            if file_date >= cutoff_date:
-                filtered_grid1_files.append(file)
-        except ValueError:
-            print(f"Could not parse date from filename: {filename}")
+    # Only keep files that are after the cutoff date, forecast days only where there is no ERA5
+    filtered_grid1_files = [grid1_index[day] for day in sorted(grid1_index) if day >= cutoff_date]
+    filtered_grid2_files = [grid2_index[day] for day in sorted(grid2_index) if day >= cutoff_date and day not in grid1_index]
 
     # Check if any files remain after filtering
     if not filtered_grid1_files:
-        raise FileNotFoundError("No grid1 files found within the last 9 days.")
+        raise FileNotFoundError(f"No grid1 files found within the last {window_days} days.")
     
-    # Load the files from both grids (use lazy loading for efficiency if datasets are large)
-    ds_grid1_list = [xr.open_dataset(file) for file in filtered_grid1_files]
-    ds_grid2_list = [xr.open_dataset(file) for file in grid2_files]
+    # Open the grid 1 files lazily as one dataset, all files share the same grid so coordinates are not aligned
+    ds_grid1 = xr.open_mfdataset(filtered_grid1_files, combine='by_coords', chunks={'time': 24},
+                                 data_vars='minimal', coords='minimal', compat='override', join='override')
+
+    # Interpolate the remaining Grid 2 files to the common grid (Grid 1), the weights are computed once for all files
+    ds_grid2_interp_list = []
+    for file in filtered_grid2_files:
+        with xr.open_dataset(file) as ds:
+            ds_grid2_interp_list.append(regrid(ds, ds_grid1.latitude, ds_grid1.longitude, weights_dir))
     
-    # Choose the grid from the first file in Grid 1 as the common grid
-    common_grid = ds_grid1_list[0]  # Assuming all grid 1 files share the same grid
+    # Now merge both datasets into a single one, era5 gets prioritised if overlap exists
+    ds_merged = ds_grid1
+    if ds_grid2_interp_list:
+        ds_grid2_interp = xr.concat(ds_grid2_interp_list, dim='time')
+        ds_merged = ds_grid1.combine_first(ds_grid2_interp)
     
-    # Interpolate all Grid 2 files to the common grid (Grid 1)
-    ds_grid2_interp_list = [
-        ds.interp(latitude=common_grid.latitude, longitude=common_grid.longitude)
-        for ds in ds_grid2_list
-    ]
-    
-    # Merge all Grid 1 files into a single dataset
-    ds_grid1 = xr.merge(ds_grid1_list)
-    
-    # Merge all Grid 2 (interpolated) files into a single dataset
-    ds_grid2_interp = xr.merge(ds_grid2_interp_list)
-    
-    # Now merge both datasets into a single one
-    ds_merged = xr.merge([ds_grid1, ds_grid2_interp]) # override”: skip comparing and pick variable from first dataset ie era5 gets prioritised if overlap exists
-    
-    # Save the merged dataset to a new NetCDF file
+    # Save the merged dataset to a new NetCDF file, dask writes it one chunk at a time
     ds_merged.to_netcdf(output_path)
+    ds_grid1.close()
     
     print(f"All files merged and saved to {output_path}")
-    
-    #return ds_merged
 
 
 
 
-def merge_forecast_with_merged(ds_merged_path, ds_surf_fc_path, output_path):
+@profiled('merge')
+def merge_forecast_with_merged(ds_merged_path, ds_surf_fc_path, output_path, weights_dir=None):
     """
     Merge the ERA5 gapfill and forecast dataset with the previously merged dataset.
     
     Parameters:
-        ds_merged_path (str): Path to the merged dataset file.
-        ds_surf_fc_path (str): Path to the surf forecast dataset file.
+        ds_merged_path (str or xarray.Dataset): Path to the merged dataset file, or the dataset.
+        ds_surf_fc_path (str or xarray.Dataset): Path to the surf forecast dataset file, or the
+            dataset eg as returned by fetch_ifs_forecast.fetch_forecast.
         output_path (str): Path to save the final merged dataset.
+        weights_dir (str): Directory of the stored regridding weights (see regrid_weights.py).
     """
     # Load the datasets
-    ds_merged = xr.open_dataset(ds_merged_path)
-    ds_surf_fc = xr.open_dataset(ds_surf_fc_path)
+    ds_merged = xr.open_dataset(ds_merged_path) if isinstance(ds_merged_path, str) else ds_merged_path
+    ds_surf_fc = xr.open_dataset(ds_surf_fc_path) if isinstance(ds_surf_fc_path, str) else ds_surf_fc_path
 
     # Interpolate ds_surf_fc to match the grid of ds_merged
-    ds_surf_fc_interp = ds_surf_fc.interp(latitude=ds_merged.latitude, longitude=ds_merged.longitude)
+    ds_surf_fc_interp = regrid(ds_surf_fc, ds_merged.latitude, ds_merged.longitude, weights_dir)
 
     # Check for overlapping time
     overlap_start = max(ds_merged.time.min(), ds_surf_fc_interp.time.min())
@@ -328,18 +355,86 @@ def merge_forecast_with_merged(ds_merged_path, ds_surf_fc_path, output_path):
     print(f"Final merged dataset saved to {output_path}")
 
 
-def convert_time_units_to_ncview_compatible(dataset_path, output_path):
+@profiled('merge')
+def write_forcing_view(prefix, forecast, view_path, forecast_dir='./inputs/climate/forecast', weights_dir=None,
+                       window_days=9):
+    """
+    Write the final forcing as a view of the daily files (forcing_view.py) instead of merging them into NetCDF.
+
+    The view lists the same data as merge_datasets_filter followed by
+    merge_forecast_with_merged: the daily ERA5 files of the window, the daily forecast
+    files of the days without ERA5 and the current forecast, which takes precedence
+    from its first timestep. Forecast data is regridded to the ERA5 grid once per file
+    and cycle, the daily ERA5 files are referenced as they are. The stale NetCDF output
+    next to the view is removed, simulations write out their window with forcing_view.window_forcing.
+
+    Parameters:
+        prefix (str): 'SURF' or 'PLEV'.
+        forecast (str or xarray.Dataset): Current forecast, path or dataset as returned by
+            fetch_ifs_forecast.fetch_forecast.
+        view_path (str): Path to the JSON view, eg './inputs/climate/SURF_final_merged_output.json'.
+        forecast_dir (str): Directory of the daily ERA5 and forecast files.
+        weights_dir (str): Directory of the stored regridding weights (see regrid_weights.py).
+        window_days (int): Number of past days in the view.
+    """
+    cutoff_date = datetime.now() - timedelta(days=window_days)
+    era5_index = files_by_date(os.path.join(forecast_dir, f'{prefix}_2*.nc'))
+    fc_index = files_by_date(os.path.join(forecast_dir, f'{prefix}_FC_*.nc'))
+    era5_days = [day for day in sorted(era5_index) if day >= cutoff_date]
+    if not era5_days:
+        raise FileNotFoundError(f"No {prefix} ERA5 files found within the last {window_days} days.")
+    with xr.open_dataset(era5_index[era5_days[-1]]) as ds:
+        latitude, longitude = ds.latitude.values, ds.longitude.values
+
+    pieces_dir = os.path.splitext(view_path)[0] + '_pieces'
+    ds_fc = xr.open_dataset(forecast) if isinstance(forecast, str) else forecast
+    fc_start = pd.Timestamp(ds_fc.time.values[0])
+    fc_piece = regridded_piece(ds_fc, forecast if isinstance(forecast, str) else None,
+                               latitude, longitude, pieces_dir, weights_dir)
+
+    pieces = []
+    days = sorted(set(era5_days) | {day for day in fc_index if day >= cutoff_date and day not in era5_index})
+    for day in days:
+        # the forecast replaces everything from its first timestep on
+        if pd.Timestamp(day) >= fc_start:
+            break
+        if day in era5_index:
+            path = era5_index[day]
+        else:
+            with xr.open_dataset(fc_index[day]) as ds_day:
+                path = regridded_piece(ds_day, fc_index[day], latitude, longitude, pieces_dir, weights_dir)
+        end = fc_start - pd.Timedelta(hours=1) if pd.Timestamp(day) + pd.Timedelta(days=1) > fc_start else None
+        pieces.append({'path': path, 'end': None if end is None else str(end)})
+    pieces.append({'path': fc_piece})
+
+    write_view(view_path, pieces)
+    prune_pieces(pieces_dir, keep=[piece['path'] for piece in pieces])
+    stale = os.path.splitext(view_path)[0] + '.nc'
+    if os.path.exists(stale):
+        os.remove(stale)
+        print(f"Removed {stale}, the forcing is the view {view_path}")
+
+
+def convert_time_units_to_ncview_compatible(dataset_path, output_path=None):
     """
     Convert the time units of the dataset to 'hours since' the start of the dataset.
+
+    Without output_path (or with output_path equal to dataset_path) only the time
+    variable and its attributes are rewritten in place, through netCDF4, instead of
+    writing a copy of the whole dataset.
     
     Parameters:
         dataset_path (str): Path to the input NetCDF dataset.
-        output_path (str): Path to save the modified dataset.
+        output_path (str): Path to save the modified dataset, None to modify dataset_path in place.
         # Example usage
     dataset_path = '/home/joel/sim/snowmapper_2025/master/inputs/climate/SURF_final_merged_output.nc'
     output_path = '/home/joel/sim/snowmapper_2025/master/inputs/climate/SURF_fixed_time_output.nc'
     convert_time_units_to_ncview_compatible(dataset_path, output_path)
     """
+    if output_path is None or os.path.abspath(output_path) == os.path.abspath(dataset_path):
+        convert_time_units_in_place(dataset_path)
+        return
+
     try:
         # Load the dataset
         ds = xr.open_dataset(dataset_path)
@@ -374,6 +469,38 @@ def convert_time_units_to_ncview_compatible(dataset_path, output_path):
 
 
 
+def convert_time_units_in_place(dataset_path):
+    """
+    Rewrite the time variable of a NetCDF file as 'hours since' its first timestep, in place.
+
+    Only the time values and attributes are written, the cost does not depend on the size of the data variables.
+
+    Parameters:
+        dataset_path (str): Path to the NetCDF dataset.
+    """
+    from netCDF4 import Dataset, num2date, date2num
+
+    try:
+        with Dataset(dataset_path, 'a') as nc:
+            if 'time' not in nc.variables:
+                raise ValueError("'time' variable not found in the dataset.")
+            time_variable = nc.variables['time']
+            calendar = getattr(time_variable, 'calendar', 'standard')
+            times = num2date(time_variable[:], units=time_variable.units, calendar=calendar,
+                             only_use_cftime_datetimes=False)
+
+            # Convert time to hours since the first time point
+            units = f"hours since {times[0].strftime('%Y-%m-%d %H:%M:%S')}"
+            time_variable[:] = date2num(times, units=units, calendar='proleptic_gregorian')
+            time_variable.setncatts({'units': units, 'calendar': 'proleptic_gregorian',
+                                     'standard_name': 'time', 'long_name': 'time'})
+
+        print(f"Corrected time of {dataset_path} in place")
+
+    except Exception as e:
+        print(f"Error: {e}")
+
+
 def check_duplicate_and_missing_times(dataset_path):
     """
     Check for duplicate and missing timestamps in the dataset.
@@ -411,28 +538,57 @@ def check_duplicate_and_missing_times(dataset_path):
         print("No duplicate times in the time series.")
 
 
-def save_daily_files(dataset_path, output_directory):
+def save_days(dataset_path, output_directory, prefix, day_indices):
     """
-    Save each day of the dataset to a separate NetCDF file.
+    Write some days of a dataset to daily NetCDF files, opening the dataset once.
 
     Parameters:
         dataset_path (str): Path to the input NetCDF dataset.
         output_directory (str): Directory to save the daily NetCDF files.
+        prefix (str): The prefix of the daily files ('SURF' or 'PLEV').
+        day_indices (dict): Positions of the timesteps of each day in the 'time' dimension, by day (YYYYMMDD).
+
+    Returns:
+        list: Paths of the files written.
     """
-    # Load the dataset
-    ds = xr.open_dataset(dataset_path)
+    output_files = []
+    with xr.open_dataset(dataset_path) as ds:
+        for day, indices in day_indices.items():
+            # Select the data for the specific day and save it to a new NetCDF file named by the date
+            output_file = f'{output_directory}/{prefix}_{day}.nc'
+            ds.isel(time=indices).to_netcdf(output_file)
+            output_files.append(output_file)
+    return output_files
 
-    # Loop over each unique day in the 'time' dimension
-    for day in ds.time.dt.strftime('%Y%m%d').values:
-        # Select the data for the specific day
-        ds_day = ds.sel(time=day)
 
-        # Define the output file name based on the date
-        output_file = f'{output_directory}/SURF_{day}.nc'
+def save_daily_files(dataset_path, output_directory, prefix="SURF", max_workers=4):
+    """
+    Save each day of the dataset to a separate NetCDF file.
 
-        # Save the daily data to a new NetCDF file
-        ds_day.to_netcdf(output_file)
-        print(f"Saved {output_file}")
+    The timesteps are grouped by calendar day once and every day file is written once.
+    The days are split into contiguous batches written by a pool of processes, each
+    opening the dataset once: netCDF reads and writes within one process are
+    serialised by a global lock, so threads would not write concurrently.
+
+    Parameters:
+        dataset_path (str): Path to the input NetCDF dataset.
+        output_directory (str): Directory to save the daily NetCDF files.
+        prefix (str): The prefix of the daily files ('SURF' or 'PLEV').
+        max_workers (int): Number of worker processes.
+    """
+    # Positions of the timesteps of each unique day in the 'time' dimension
+    with xr.open_dataset(dataset_path) as ds:
+        days = ds.time.dt.strftime('%Y%m%d').values
+    day_indices = pd.Series(np.arange(len(days))).groupby(days).indices
+
+    ordered = sorted(day_indices)
+    n = -(-len(ordered) // max_workers)
+    batches = [{day: day_indices[day] for day in ordered[i:i + n]} for i in range(0, len(ordered), n)]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(save_days, dataset_path, output_directory, prefix, batch) for batch in batches]
+        for future in futures:
+            for output_file in future.result():
+                print(f"Saved {output_file}")
 
 
 
@@ -475,6 +631,80 @@ def handle_forecast_file(era5_file_path, prefix="PLEV", archive=True):
     except ValueError as e:
         print(f"Error processing the filename {era5_filename}: {e}")
 
+def with_retry(func, retries=3, base_delay=30):
+    """
+    Call func, retrying with exponential backoff and random jitter when it raises.
+
+    Parameters:
+        func (callable): Called without arguments.
+        retries (int): Number of retries after the first attempt.
+        base_delay (float): Delay before the first retry in seconds, doubled for every further retry.
+
+    Returns:
+        The return value of func.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == retries:
+                raise
+            # jitter spreads the retries of parallel workers hitting the same outage
+            delay = base_delay * 2**attempt * random.uniform(0.5, 1.5)
+            print(f"Attempt {attempt + 1} failed ({e}), retrying in {delay:.0f} s")
+            time.sleep(delay)
+
+
+@profiled('fetch')
+def backfill_era5(mp, lastday, cache_dir, forecast_dir='./inputs/climate/forecast', days_back=30,
+                  max_workers=4, retries=3, retry_delay=30, fetch=None, post_process=None):
+    """
+    Download every ERA5 day missing from the rolling window with a bounded pool of workers.
+
+    Missing days are found from the daily SURF/PLEV files of the forecast directory. Each
+    download is retried with backoff and jitter, and each file is post-processed as soon
+    as it lands, while the other downloads go on.
+
+    Parameters:
+        mp (Topoclass): Topoclass object with the loaded configuration.
+        lastday (datetime): Last day available from ERA5.
+        cache_dir (str): Download cache directory (see download_cache.py).
+        forecast_dir (str): Directory of the daily files.
+        days_back (int): Number of days of the window ending at lastday.
+        max_workers (int): Maximum number of concurrent downloads.
+        retries (int): Number of retries of a failed download.
+        retry_delay (float): Delay before the first retry in seconds, see with_retry.
+        fetch (callable): fetch(surf_plev, day) -> path, default get_era5_cached with mp (a stub in tests).
+        post_process (callable): post_process(path), default post_process_era5_day with mp.
+    """
+    fetch = fetch or (lambda surf_plev, day: get_era5_cached(mp, surf_plev, day, cache_dir))
+    post_process = post_process or (lambda path: post_process_era5_day(mp, path))
+
+    lastday = datetime(lastday.year, lastday.month, lastday.day)
+    window = [lastday - timedelta(days=n) for n in range(days_back - 1, -1, -1)]
+    present = {prefix: files_by_date(os.path.join(forecast_dir, f'{prefix}_2*.nc')) for prefix in ('SURF', 'PLEV')}
+    todo = [(surf_plev, day) for day in window for surf_plev in ('surf', 'plev')
+            if day not in present[surf_plev.upper()]]
+    print(f"Backfilling {len(todo)} ERA5 files for {len({day for _, day in todo})} days")
+
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(with_retry, lambda surf_plev=surf_plev, day=day: fetch(surf_plev, day), retries,
+                                   retry_delay): (surf_plev, day)
+                   for surf_plev, day in todo}
+        for future in concurrent.futures.as_completed(futures):
+            surf_plev, day = futures[future]
+            try:
+                post_process(future.result())
+                print(f"Backfilled {surf_plev.upper()} {day.strftime('%Y-%m-%d')}")
+            except Exception as e:
+                print(f"Backfill of {surf_plev.upper()} {day.strftime('%Y-%m-%d')} failed: {e}")
+                failed.append((surf_plev, day))
+
+    if failed:
+        print(f"{len(failed)} ERA5 files could not be downloaded, they are retried on the next run")
+
+
 # Example usage:
 # handle_forecast_file("/path/to/downloaded/PLEV_20240926.nc", prefix="PLEV", archive=True)
 # handle_forecast_file("/path/to/downloaded/SURF_20240926.nc", prefix="SURF", archive=False)
@@ -491,6 +721,17 @@ def handle_forecast_file(era5_file_path, prefix="PLEV", archive=True):
 def main():
     start_time = datetime.now()
     mydir = sys.argv[1]
+    # --fetch-forecast: run the IFS forecast ingest in this interpreter instead of
+    # fetch_ifs_forecast.py beforehand and pass its datasets on in memory
+    fetch_fc = '--fetch-forecast' in sys.argv[2:]
+    # --forcing-store: keep the T-30 ... T+10 window in a rolling store (forcing_store.py)
+    # instead of rebuilding the merged outputs from all daily files
+    use_store = '--forcing-store' in sys.argv[2:]
+    # --virtual-view: write *_final_merged_output.json views of the daily files (forcing_view.py)
+    # instead of merging them into NetCDF
+    virtual = '--virtual-view' in sys.argv[2:]
+    # --backfill: download all ERA5 days missing from the window, not only the last available day
+    backfill = '--backfill' in sys.argv[2:]
     os.chdir(mydir)
 
     config_file = './config.yml'
@@ -509,29 +750,72 @@ def main():
 
     # # Create a ThreadPoolExecutor to run functions concurrently
     with concurrent.futures.ThreadPoolExecutor() as executor:
-        # Submit both functions to run in parallel
-        future_surf = executor.submit(mp.get_era5_snowmapper, 'surf', lastday)
-        future_plev = executor.submit(mp.get_era5_snowmapper, 'plev', lastday)
-            
-        # Wait for both functions to complete
-        concurrent.futures.wait([future_surf, future_plev])
-        
-        # Continue the rest of your script after both functions are done
-        print("Both functions finished, continuing with the rest of the script.")
-        downloadedPLEVfile = target = mp.config.climate.path  + "/forecast/PLEV_%04d%02d%02d.nc" % (lastday.year, lastday.month, lastday.day)
-        downloadedSURFfile = target = mp.config.climate.path  + "/forecast/SURF_%04d%02d%02d.nc" % (lastday.year, lastday.month, lastday.day)
+        # reruns for the same day are served from the download cache
+        cache_dir = './inputs/climate/forecast/cache'
+        if fetch_fc:
+            # the forecast download runs alongside the ERA5 downloads
+            from fetch_ifs_forecast import fetch_forecast
+            future_fc = executor.submit(fetch_forecast, {'directory': './inputs/climate/forecast/',
+                                                         'write_files': False})
+
+        if backfill:
+            # every missing day of the window, each post-processed as soon as it is downloaded
+            backfill_era5(mp, lastday, cache_dir)
+        else:
+            # Submit both functions to run in parallel
+            future_surf = executor.submit(get_era5_cached, mp, 'surf', lastday, cache_dir)
+            future_plev = executor.submit(get_era5_cached, mp, 'plev', lastday, cache_dir)
+
+            # Wait for both functions to complete
+            concurrent.futures.wait([future_surf, future_plev])
+
+            # Continue the rest of your script after both functions are done
+            print("Both functions finished, continuing with the rest of the script.")
 
-    mp.process_SURF_file('./inputs/climate/forecast')
-    mp.remap_netcdf('./inputs/climate/forecast'  )
+    if not backfill:
+        mp.process_SURF_file('./inputs/climate/forecast')
+        mp.remap_netcdf('./inputs/climate/forecast'  )
 
 
 
-    # check for existing forecast file and delete if era5 exists
-    handle_forecast_file(downloadedPLEVfile, prefix="PLEV", archive=True)
-    handle_forecast_file(downloadedSURFfile, prefix="SURF", archive=True)
+    # archive every forecast file superseded by an ERA5 file (one directory scan),
+    # then compress or drop old archived days
+    manage_forecast_archive(mp.config.climate.path + "/forecast", archive=True)
     
 
     
+    # forecast -> ERA5 grid interpolation weights, computed on the first run
+    weights_dir = './inputs/climate/forecast/regrid_weights'
+
+    if use_store:
+        if fetch_fc:
+            surf_fc, plev_fc = future_fc.result()
+        else:
+            surf_fc = './inputs/climate/forecast/SURF_FC.nc'
+            plev_fc = './inputs/climate/forecast/PLEV_FC.nc'
+        for prefix, fc in (('SURF', surf_fc), ('PLEV', plev_fc)):
+            ds_fc = xr.open_dataset(fc) if isinstance(fc, str) else fc
+            store = f'./inputs/climate/forcing_{prefix}.zarr'
+            # only the new ERA5 day(s) and the days of the new forecast cycle are written
+            written = advance_store(store, files_by_date(f'./inputs/climate/forecast/{prefix}_2*.nc'), ds_fc,
+                                    weights_dir=weights_dir)
+            # TopoPyScale reads NetCDF, the export holds the store window (rewritten once the window moves)
+            export_forcing(store, f'./inputs/climate/{prefix}_final_merged_output.nc', written)
+        print(f"Script completed in {datetime.now() - start_time}")
+        return
+
+    if virtual:
+        if fetch_fc:
+            surf_fc, plev_fc = future_fc.result()
+        else:
+            surf_fc = './inputs/climate/forecast/SURF_FC.nc'
+            plev_fc = './inputs/climate/forecast/PLEV_FC.nc'
+        for prefix, fc in (('SURF', surf_fc), ('PLEV', plev_fc)):
+            write_forcing_view(prefix, fc, f'./inputs/climate/{prefix}_final_merged_output.json',
+                               weights_dir=weights_dir)
+        print(f"Script completed in {datetime.now() - start_time}")
+        return
+
     # Example usage
     pattern1 = './inputs/climate/forecast/SURF_2*.nc'
     pattern2 = './inputs/climate/forecast/SURF_FC_*.nc'
@@ -540,7 +824,7 @@ def main():
 
 
     # Call the function to merge the datasets
-    ds = merge_datasets_filter(pattern1, pattern2, output_file)
+    ds = merge_datasets_filter(pattern1, pattern2, output_file, weights_dir)
 
     # Example usage
     pattern1 = './inputs/climate/forecast/PLEV_2*.nc'
@@ -548,24 +832,31 @@ def main():
     output_file = './inputs/climate/forecast/PLEV_merged_output.nc'
 
     # Call the function to merge the datasets
-    merge_datasets_filter(pattern1, pattern2, output_file)
+    merge_datasets_filter(pattern1, pattern2, output_file, weights_dir)
+
 
+    # forecast datasets from this run, or as written by fetch_ifs_forecast.py
+    if fetch_fc:
+        surf_fc, plev_fc = future_fc.result()
+    else:
+        surf_fc = './inputs/climate/forecast/SURF_FC.nc'
+        plev_fc = './inputs/climate/forecast/PLEV_FC.nc'
 
     # Example usage
     ds_merged_path = './inputs/climate/forecast/SURF_merged_output.nc'
-    ds_surf_fc_path = './inputs/climate/forecast/SURF_FC.nc'
+    ds_surf_fc_path = surf_fc
     output_file = './inputs/climate/SURF_final_merged_output.nc'
 
     # Call the function to merge the datasets
-    merge_forecast_with_merged(ds_merged_path, ds_surf_fc_path, output_file)
+    merge_forecast_with_merged(ds_merged_path, ds_surf_fc_path, output_file, weights_dir)
 
     # Example usage
     ds_merged_path = './inputs/climate/forecast/PLEV_merged_output.nc'
-    ds_surf_fc_path = './inputs/climate/forecast/PLEV_FC.nc'
+    ds_surf_fc_path = plev_fc
     output_file = './inputs/climate/PLEV_final_merged_output.nc'
 
     # Call the function to merge the datasets
-    merge_forecast_with_merged(ds_merged_path, ds_surf_fc_path, output_file)
+    merge_forecast_with_merged(ds_merged_path, ds_surf_fc_path, output_file, weights_dir)
 
 
 
@@ -0,0 +1,210 @@
+# Stage-level profiling of the daily pipeline.
+# Wrap a stage in `with stage("merge"):` or decorate a function with
+# @profiled("fetch"), or run a whole script as a stage from the shell:
+#
+#   python stage_profiler.py downscale run_current_month.py ./newdomain/D4
+#
+# Every profiled stage appends one JSON line to the profile log with wall time,
+# CPU time (own and of child processes, eg FSM), peak RSS and bytes read and
+# written. getrusage only gives the peak RSS of the whole process, so on Linux the
+# peak is reset at the start of every stage (/proc/self/clear_refs) and read back
+# from VmHWM; elsewhere the stage peak is null and only the process peak is logged.
+# Commands other than Python scripts (eg the copy of the result tables) are run
+# as a child process:
+#
+#   python stage_profiler.py upload cp ./newdomain/tables/a.txt /data
+#
+# Lines of one pipeline run share the run id, set PIPELINE_RUN_ID in the
+# calling shell to group them (default: the date). The log is stage_profile.jsonl
+# in the directory the pipeline is started from, or PIPELINE_PROFILE_LOG.
+
+import os
+import sys
+import json
+import time
+import runpy
+import subprocess
+import resource
+import functools
+import contextlib
+from datetime import datetime
+
+
+# resolved on import, the scripts chdir into their simulation directory
+PROFILE_LOG = os.path.abspath(os.environ.get('PIPELINE_PROFILE_LOG', 'stage_profile.jsonl'))
+
+
+def io_counters():
+    """
+    Read the bytes read and written by this process and its finished children.
+
+    Returns:
+    - read_bytes, write_bytes (int): Bytes read from / written to storage, from /proc/self/io
+      where available, otherwise from the block counts of getrusage.
+    """
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    children_read, children_write = children.ru_inblock * 512, children.ru_oublock * 512
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['read_bytes']) + children_read, int(counters['write_bytes']) + children_write
+    except (OSError, KeyError, ValueError):
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        return own.ru_inblock * 512 + children_read, own.ru_oublock * 512 + children_write
+
+
+# running peak RSS (kB) of every open stage, outermost first
+_open_peaks = []
+# peak RSS (kB) of the process so far, resetting VmHWM also resets ru_maxrss
+_process_peak = [0]
+
+
+def reset_peak_rss():
+    """
+    Reset the peak RSS (VmHWM) of this process to its current RSS, Linux only.
+
+    Returns:
+    - reset (bool): True if the peak was reset.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_kb():
+    """
+    Read the peak RSS of this process since the last reset_peak_rss.
+
+    Returns:
+    - peak (int): VmHWM in kB, None where /proc/self/status is not available.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def snapshot():
+    """
+    Take the counters a stage is measured with.
+
+    Returns:
+    - counters (dict): Wall clock, CPU times, peak RSS (kB, since the last reset_peak_rss) and I/O bytes.
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    read_bytes, write_bytes = io_counters()
+    return {
+        'wall': time.perf_counter(),
+        'cpu': own.ru_utime + own.ru_stime,
+        'children_cpu': children.ru_utime + children.ru_stime,
+        'process_peak_rss_kb': own.ru_maxrss,
+        'children_peak_rss_kb': children.ru_maxrss,
+        'read_bytes': read_bytes,
+        'write_bytes': write_bytes,
+    }
+
+
+def append_record(record, log_file=None):
+    """
+    Append one JSON line to the profile log.
+
+    Parameters:
+    - record (dict): Stage record.
+    - log_file (str): Profile log, default PROFILE_LOG.
+    """
+    with open(log_file or PROFILE_LOG, 'a') as f:
+        f.write(json.dumps(record) + '\n')
+
+
+@contextlib.contextmanager
+def stage(name, log_file=None):
+    """
+    Profile the enclosed block as one pipeline stage.
+
+    Parameters:
+    - name (str): Stage name, eg 'fetch', 'merge', 'downscale', 'fsm', 'map', 'reproject', 'zonal_stats', 'upload'.
+    - log_file (str): Profile log, default PROFILE_LOG.
+    """
+    started = datetime.now()
+    # the peak so far belongs to the enclosing stages, then measure this stage alone
+    current = peak_rss_kb()
+    _process_peak[0] = max(_process_peak[0], current or 0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    for i, peak in enumerate(_open_peaks):
+        if peak is not None:
+            _open_peaks[i] = max(peak, current or 0)
+    tracked = reset_peak_rss() and current is not None
+    _open_peaks.append(0 if tracked else None)
+    before = snapshot()
+    status = 'ok'
+    try:
+        yield
+    except BaseException as e:
+        status = 'ok' if isinstance(e, SystemExit) and not e.code else 'error'
+        raise
+    finally:
+        after = snapshot()
+        stage_peak = _open_peaks.pop()
+        if stage_peak is not None:
+            stage_peak = max(stage_peak, peak_rss_kb() or 0)
+            if _open_peaks and _open_peaks[-1] is not None:
+                _open_peaks[-1] = max(_open_peaks[-1], stage_peak)
+        _process_peak[0] = max(_process_peak[0], stage_peak or 0, after['process_peak_rss_kb'])
+        record = {
+            'run_id': os.environ.get('PIPELINE_RUN_ID', started.strftime('%Y%m%d')),
+            'stage': name,
+            'start': started.isoformat(timespec='seconds'),
+            'status': status,
+            'wall_s': round(after['wall'] - before['wall'], 3),
+            'cpu_s': round(after['cpu'] - before['cpu'], 3),
+            'children_cpu_s': round(after['children_cpu'] - before['children_cpu'], 3),
+            'peak_rss_mb': None if stage_peak is None else round(stage_peak / 1024, 1),
+            # high-water marks over the life of the process and of its finished children
+            'process_peak_rss_mb': round(_process_peak[0] / 1024, 1),
+            'children_peak_rss_mb': round(after['children_peak_rss_kb'] / 1024, 1),
+            'read_bytes': after['read_bytes'] - before['read_bytes'],
+            'write_bytes': after['write_bytes'] - before['write_bytes'],
+        }
+        append_record(record, log_file)
+        print(f"Stage {name} {status} in {record['wall_s']} s (cpu {record['cpu_s']} s, "
+              f"peak RSS {record['peak_rss_mb']} MB, process peak {record['process_peak_rss_mb']} MB)")
+
+
+def profiled(name, log_file=None):
+    """
+    Decorator profiling every call of a function as a stage.
+
+    Parameters:
+    - name (str): Stage name.
+    - log_file (str): Profile log, default PROFILE_LOG.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name, log_file):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+if __name__ == "__main__":
+    # python stage_profiler.py <stage> <script.py> [script arguments]
+    # python stage_profiler.py <stage> <command> [command arguments]
+    stage_name, script = sys.argv[1], sys.argv[2]
+    if not script.endswith('.py'):
+        with stage(stage_name):
+            returncode = subprocess.run(sys.argv[2:]).returncode
+            if returncode:
+                sys.exit(returncode)
+        sys.exit(0)
+    sys.argv = sys.argv[2:]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    with stage(stage_name):
+        runpy.run_path(script, run_name='__main__')
@@ -0,0 +1,131 @@
+# Staging of simulation directories from the master outputs.
+# Instead of copying the master outputs (landform, DEM products, horizons,
+# ds_param, ...) into every simulation directory they are reflinked (copy-on-write
+# clone, eg btrfs or XFS): the clone takes no space and writing to it does not
+# change the master. Where the filesystem has no reflinks the files are copied.
+# Hard links are opt-in (hardlink=True) for files known to be only read: a hard
+# link shares the data with the master, so an in-place rewrite by TopoPyScale
+# would corrupt the master copy, and nothing here can check that it never happens.
+# Files the simulation rewrites (downscaled time series, solar geometry, tmp
+# files, FSM outputs) are never hard-linked.
+
+import os
+import shutil
+import fnmatch
+try:
+    import fcntl
+except ImportError:  # not on Windows
+    fcntl = None
+
+
+FICLONE = 0x40049409  # linux/fs.h, _IOW(0x94, 9, int)
+
+# paths relative to the outputs directory
+MUTABLE_PATTERNS = ['downscaled/*', 'tmp/*', 'ds_solar.nc', 'FSM_pt_*', '*.txt']
+IGNORE_PATTERNS = ['FSM_pt_*.txt', '*HS.nc', '*SWE.nc']
+
+
+def reflink(src, dst):
+    """
+    Clone a file with the FICLONE ioctl, the clone shares the data blocks until either file is written.
+
+    Parameters:
+    - src (str): Source file.
+    - dst (str): Destination file, must not exist.
+
+    Raises:
+    - OSError: If the filesystem does not support reflinks or src and dst are on different filesystems.
+    """
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(src, 'rb') as f_src, open(dst, 'xb') as f_dst:
+        try:
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+        except OSError:
+            f_dst.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def matches(relpath, patterns):
+    """
+    Check a relative path against glob patterns (matched on the path and on the file name).
+
+    Parameters:
+    - relpath (str): Path relative to the staged directory.
+    - patterns (list): Glob patterns.
+
+    Returns:
+    - match (bool): True if any pattern matches.
+    """
+    relpath = relpath.replace(os.sep, '/')
+    name = os.path.basename(relpath)
+    return any(fnmatch.fnmatch(relpath, pattern) or fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def stage_file(src, dst, mutable=False, methods=None, hardlink=False):
+    """
+    Stage one file by reflink, hard link (opt-in, immutable files only) or copy, the first that works.
+
+    Parameters:
+    - src (str): Source file.
+    - dst (str): Destination file, must not exist.
+    - mutable (bool): True if the file will be written in the destination, it is then never hard-linked.
+    - methods (dict): Methods that worked so far, shared between calls so a method the
+      filesystem does not support is not tried for every file.
+    - hardlink (bool): Hard-link immutable files where reflinks are not supported.
+
+    Returns:
+    - method (str): 'reflink', 'link' or 'copy'.
+    """
+    methods = {} if methods is None else methods
+    if methods.get('reflink', True):
+        try:
+            reflink(src, dst)
+            methods['reflink'] = True
+            return 'reflink'
+        except OSError:
+            methods['reflink'] = False
+    if hardlink and not mutable and methods.get('link', True):
+        try:
+            os.link(src, dst)
+            methods['link'] = True
+            return 'link'
+        except OSError:
+            methods['link'] = False
+    shutil.copy2(src, dst)
+    return 'copy'
+
+
+def stage_tree(src_dir, dst_dir, ignore_patterns=IGNORE_PATTERNS, mutable_patterns=MUTABLE_PATTERNS,
+               hardlink=False):
+    """
+    Stage a directory tree by reflinks, falling back to copies (or hard links, see hardlink).
+
+    Parameters:
+    - src_dir (str): Source directory, eg the master outputs.
+    - dst_dir (str): Destination directory, created.
+    - ignore_patterns (list): Glob patterns of files not staged.
+    - mutable_patterns (list): Glob patterns of files the simulation writes to.
+    - hardlink (bool): Hard-link the files not matching mutable_patterns where reflinks are
+      not supported. Only safe if nothing rewrites them in place.
+
+    Returns:
+    - counts (dict): Number of files staged by each method.
+    """
+    counts = {'reflink': 0, 'link': 0, 'copy': 0}
+    methods = {}
+    for root, dirs, files in os.walk(src_dir):
+        relroot = os.path.relpath(root, src_dir)
+        os.makedirs(os.path.join(dst_dir, relroot), exist_ok=True)
+        for name in files:
+            relpath = os.path.normpath(os.path.join(relroot, name))
+            if matches(relpath, ignore_patterns):
+                continue
+            method = stage_file(os.path.join(root, name), os.path.join(dst_dir, relpath),
+                                matches(relpath, mutable_patterns), methods, hardlink)
+            counts[method] += 1
+    print(f"Staged {src_dir} to {dst_dir}: {counts['reflink']} reflinked, {counts['link']} hard-linked, "
+          f"{counts['copy']} copied")
+    return counts
@@ -0,0 +1,60 @@
+import os
+import sys
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("TopoPyScale")
+pytest.importorskip("munch")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stage_profiler  # noqa: E402
+from run_master2 import backfill_era5  # noqa: E402
+
+
+def test_backfill_retries_skips_present_days_and_isolates_failures(tmp_path, monkeypatch):
+    monkeypatch.setattr(stage_profiler, 'PROFILE_LOG', str(tmp_path / 'stage_profile.jsonl'))
+    forecast_dir = tmp_path / 'forecast'
+    forecast_dir.mkdir()
+    lastday = datetime(2026, 10, 16)
+    window = [lastday - timedelta(days=n) for n in range(5)]
+    # the two oldest days are already there
+    for day in window[3:]:
+        for prefix in ('SURF', 'PLEV'):
+            (forecast_dir / f"{prefix}_{day:%Y%m%d}.nc").write_bytes(b'')
+
+    transient, broken = window[0], window[1]
+    lock = threading.Lock()
+    attempts = Counter()
+    processed = []
+
+    def fetch(surf_plev, day):
+        with lock:
+            attempts[surf_plev, day] += 1
+            n = attempts[surf_plev, day]
+        if day == transient and n < 3:
+            raise ConnectionError("CDS busy")
+        if day == broken and surf_plev == 'plev':
+            raise RuntimeError("request rejected")
+        path = forecast_dir / f"{surf_plev.upper()}_{day:%Y%m%d}.nc"
+        path.write_bytes(b'')
+        return str(path)
+
+    def post_process(path):
+        with lock:
+            processed.append(os.path.basename(path))
+
+    backfill_era5(None, lastday, None, forecast_dir=str(forecast_dir), days_back=5, max_workers=3, retries=2,
+                  retry_delay=0.01, fetch=fetch, post_process=post_process)
+
+    # present days are not fetched again
+    assert {day for _, day in attempts} == set(window[:3])
+    # a transient error is retried until the download succeeds
+    assert attempts['surf', transient] == attempts['plev', transient] == 3
+    # a day failing every attempt gives up after the retries, without stopping the others
+    assert attempts['plev', broken] == 3
+    assert attempts['surf', broken] == 1
+    assert sorted(processed) == sorted(f"{prefix}_{day:%Y%m%d}.nc" for day in window[:3] for prefix in ('SURF', 'PLEV')
+                                       if (prefix, day) != ('PLEV', broken))
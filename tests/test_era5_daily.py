@@ -0,0 +1,51 @@
+import os
+import sys
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+xr = pytest.importorskip("xarray")
+pytest.importorskip("netCDF4")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from era5_daily import get_era5_cached  # noqa: E402
+
+
+class FakeTopoclass:
+    """Stands in for TopoPyScale's Topoclass, 'downloads' the first n_hours of a day."""
+
+    def __init__(self, climate_path, n_hours):
+        self.config = SimpleNamespace(climate=SimpleNamespace(path=climate_path, era5={}))
+        self.n_hours = n_hours
+        self.downloads = 0
+
+    def get_era5_snowmapper(self, surf_plev, day):
+        self.downloads += 1
+        times = pd.date_range(day, periods=self.n_hours, freq='h')
+        ds = xr.Dataset({'t2m': ('time', np.zeros(self.n_hours))}, coords={'time': times})
+        ds.to_netcdf(os.path.join(self.config.climate.path, 'forecast', f"SURF_{day:%Y%m%d}.nc"))
+
+
+def test_incomplete_era5t_day_is_not_cached(tmp_path):
+    (tmp_path / 'forecast').mkdir()
+    cache_dir = str(tmp_path / 'cache')
+    day = datetime(2026, 10, 16)
+
+    mp = FakeTopoclass(str(tmp_path), n_hours=20)
+    path = get_era5_cached(mp, 'surf', day, cache_dir)
+    os.remove(path)
+    get_era5_cached(mp, 'surf', day, cache_dir)
+    assert mp.downloads == 2
+
+    # once complete the day is cached
+    mp.n_hours = 24
+    os.remove(path)
+    get_era5_cached(mp, 'surf', day, cache_dir)
+    os.remove(path)
+    get_era5_cached(mp, 'surf', day, cache_dir)
+    assert mp.downloads == 3
+    with xr.open_dataset(path) as ds:
+        assert ds.sizes['time'] == 24
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+xr = pytest.importorskip("xarray")
+pytest.importorskip("ecmwf.opendata")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fetch_ifs_forecast import harmonise_levels, process_plev  # noqa: E402
+from ifs_opendata import PLEV_LEVELS, FC2_LEVELS  # noqa: E402
+
+
+def decoded_plev(levels, times):
+    """PLEV segment laid out as decode_grib returns it, values linear in log-pressure."""
+    plev = np.sort(np.asarray(levels, dtype=float))[::-1] * 100.
+    lat, lon = np.array([46.5, 46.0]), np.array([9.0, 9.5, 10.0])
+    profile = np.log(plev / 100.)[None, :, None, None]
+    shape = (len(times), len(plev), len(lat), len(lon))
+    data = {name: (('time', 'plev', 'lat', 'lon'), np.broadcast_to(profile * (i + 1), shape).copy())
+            for i, name in enumerate(['gh', 'u', 'v', 'r', 'q', 't'])}
+    return xr.Dataset(data, coords={'time': times, 'plev': plev, 'lat': lat, 'lon': lon})
+
+
+def as_hpa(ds):
+    ds = ds.rename({'lon': 'longitude', 'lat': 'latitude', 'plev': 'level'})
+    return ds.assign_coords(level=ds['level'] / 100.)
+
+
+def test_harmonise_levels_fc2_to_plev_levels():
+    times = pd.date_range('2026-10-16 06:00', periods=3, freq='6h')
+    ds = as_hpa(decoded_plev(FC2_LEVELS, times))
+    out = harmonise_levels(ds, PLEV_LEVELS)
+    np.testing.assert_allclose(out['level'].values, sorted(PLEV_LEVELS))
+    # values are linear in log-pressure, so the interpolated levels are exact
+    expected = np.log(np.sort(PLEV_LEVELS).astype(float))
+    np.testing.assert_allclose(out['t'].isel(time=0, latitude=0, longitude=0).values, 6 * expected)
+
+
+def test_harmonise_levels_same_levels_is_identity():
+    times = pd.date_range('2026-10-16', periods=2, freq='3h')
+    ds = as_hpa(decoded_plev(PLEV_LEVELS, times))
+    out = harmonise_levels(ds, PLEV_LEVELS)
+    xr.testing.assert_allclose(out['u'], ds['u'].sortby('level').transpose(*out['u'].dims))
+
+
+def test_process_plev_joins_fc1_and_fc2():
+    fc1 = decoded_plev(PLEV_LEVELS, pd.date_range('2026-10-16', periods=4, freq='3h'))
+    fc2 = decoded_plev(FC2_LEVELS, pd.date_range('2026-10-22 06:00', periods=3, freq='6h'))
+    plev = process_plev(fc1, fc2)
+    assert plev.sizes['time'] == 7
+    np.testing.assert_allclose(plev['level'].values, sorted(PLEV_LEVELS))
+    assert 'gh' not in plev and 'z' in plev
+    assert not plev['z'].isnull().any()
@@ -0,0 +1,62 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+xr = pytest.importorskip("xarray")
+pytest.importorskip("zarr")
+pytest.importorskip("netCDF4")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from forcing_store import advance_store, export_forcing, open_forcing  # noqa: E402
+
+LAT, LON = np.array([46.5, 46.25, 46.0]), np.array([9.0, 9.25, 9.5])
+
+
+def hourly(start, n_days, offset):
+    """Hourly t2m on the ERA5 grid, valued by hour since 2026-01-01 plus offset (0 ERA5, 0.5 forecast)."""
+    times = pd.date_range(start, periods=24 * n_days, freq='h')
+    hours = ((times - pd.Timestamp('2026-01-01')) / pd.Timedelta(hours=1)).values + offset
+    data = np.broadcast_to(hours[:, None, None], (len(times), len(LAT), len(LON))).astype('float32')
+    return xr.Dataset({'t2m': (('time', 'latitude', 'longitude'), data)},
+                      coords={'time': times, 'latitude': LAT, 'longitude': LON})
+
+
+def test_export_follows_the_store_window(tmp_path):
+    store, export = str(tmp_path / 'forcing_SURF.zarr'), str(tmp_path / 'SURF_final_merged_output.nc')
+    n_slots, days_back = 6, 2
+    first_run = pd.Timestamp('2026-10-01')
+    era5_files = {}
+    for day in pd.date_range(first_run - pd.Timedelta(days=5), periods=4):
+        era5_files[day] = str(tmp_path / f"SURF_{day:%Y%m%d}.nc")
+        hourly(day, 1, 0.).to_netcdf(era5_files[day])
+    for run in range(3 * n_slots):
+        today = first_run + pd.Timedelta(days=run)
+        # ERA5 up to yesterday, the forecast from today on
+        yesterday = today - pd.Timedelta(days=1)
+        era5_files[yesterday] = str(tmp_path / f"SURF_{yesterday:%Y%m%d}.nc")
+        hourly(yesterday, 1, 0.).to_netcdf(era5_files[yesterday])
+        forecast = hourly(today, 5, 0.5)
+
+        written = advance_store(store, era5_files, forecast, today=today, n_slots=n_slots, days_back=days_back)
+        export_forcing(store, export, written)
+
+        with open_forcing(store) as ds_store, xr.open_dataset(export) as ds_export:
+            assert ds_store.sizes['time'] <= 24 * n_slots
+            np.testing.assert_array_equal(ds_export['time'].values, ds_store['time'].values)
+            np.testing.assert_allclose(ds_export['t2m'].values, ds_store['t2m'].values)
+        assert pd.Timestamp(ds_export['time'].values[0]) == today - pd.Timedelta(days=days_back)
+
+    # ERA5 of today arriving later the same day: the window has not moved, the export is updated in place
+    era5_files[today] = str(tmp_path / f"SURF_{today:%Y%m%d}.nc")
+    hourly(today, 1, 0.).to_netcdf(era5_files[today])
+    inode = os.stat(export).st_ino
+    written = advance_store(store, era5_files, forecast, today=today, n_slots=n_slots, days_back=days_back)
+    assert written[0] == today
+    export_forcing(store, export, written)
+    assert os.stat(export).st_ino == inode
+    with open_forcing(store) as ds_store, xr.open_dataset(export) as ds_export:
+        np.testing.assert_array_equal(ds_export['time'].values, ds_store['time'].values)
+        np.testing.assert_allclose(ds_export['t2m'].values, ds_store['t2m'].values)
@@ -0,0 +1,52 @@
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+xr = pytest.importorskip("xarray")
+pytest.importorskip("netCDF4")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from forcing_view import last_fullday_timestamp, window_forcing, write_view  # noqa: E402
+
+
+def daily_file(path, start, n_hours):
+    times = pd.date_range(start, periods=n_hours, freq='h')
+    ds = xr.Dataset({'t2m': (('time', 'latitude', 'longitude'), np.zeros((n_hours, 2, 2)))},
+                    coords={'time': times, 'latitude': [46.5, 46.0], 'longitude': [9.0, 9.5]})
+    ds.to_netcdf(path)
+    return str(path)
+
+
+def test_window_forcing_writes_only_the_simulated_days(tmp_path):
+    master = tmp_path / 'master'
+    master.mkdir()
+    pieces = [{'path': daily_file(tmp_path / f'SURF_202610{day:02d}.nc', f'2026-10-{day:02d}', 24)}
+              for day in range(10, 15)]
+    # the forecast, its last day incomplete
+    pieces.append({'path': daily_file(tmp_path / 'fc.nc', '2026-10-15', 40)})
+    base = str(master / 'SURF_final_merged_output')
+    write_view(base + '.json', pieces)
+
+    last = last_fullday_timestamp(base)
+    assert last == datetime(2026, 10, 15, 23)
+
+    climate_dir = str(tmp_path / 'sim' / 'inputs' / 'climate')
+    climate_path = window_forcing([base], datetime(2026, 10, 13, 7, 30), last, climate_dir)
+    assert climate_path == os.path.join(climate_dir, '')
+    assert os.listdir(climate_dir) == ['SURF_final_merged_output.nc']
+    assert not os.path.exists(base + '.nc')
+    with xr.open_dataset(os.path.join(climate_dir, 'SURF_final_merged_output.nc')) as ds:
+        times = pd.DatetimeIndex(ds['time'].values)
+    assert times[0] == pd.Timestamp('2026-10-13') and times[-1] == pd.Timestamp(last)
+    assert len(times) == 3 * 24
+
+
+def test_window_forcing_leaves_netcdf_forcing_alone(tmp_path):
+    base = str(tmp_path / 'SURF_final_merged_output')
+    daily_file(base + '.nc', '2026-10-10', 48)
+    assert last_fullday_timestamp(base) == datetime(2026, 10, 11, 23)
+    assert window_forcing([base], datetime(2026, 10, 10), datetime(2026, 10, 11, 23), str(tmp_path / 'sim')) is None
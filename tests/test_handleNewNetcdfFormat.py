@@ -0,0 +1,44 @@
+import os
+import sys
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+xr = pytest.importorskip("xarray")
+pytest.importorskip("netCDF4")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from handleNewNetcdfFormat import file_format, process_file  # noqa: E402
+
+
+def cds_member(path, name, value):
+    """One stepType file of the new CDS format, written as NetCDF4."""
+    times = pd.date_range('2024-11-28', periods=24, freq='h')
+    ds = xr.Dataset({name: (('valid_time', 'latitude', 'longitude'), np.full((24, 2, 3), value, dtype='float32'))},
+                    coords={'valid_time': times, 'latitude': [46.5, 46.0], 'longitude': [9.0, 9.5, 10.0]})
+    ds.to_netcdf(path, format='NETCDF4', engine='netcdf4')
+
+
+def test_process_file_merges_netcdf4_members_of_a_zip(tmp_path):
+    cds_member(tmp_path / 'data_stream-oper_stepType-instant.nc', 't2m', 280.)
+    cds_member(tmp_path / 'data_stream-oper_stepType-accum.nc', 'tp', 0.001)
+    download = tmp_path / 'SURF_20241128.nc'
+    with zipfile.ZipFile(download, 'w') as zip_file:
+        for member in ('data_stream-oper_stepType-instant.nc', 'data_stream-oper_stepType-accum.nc'):
+            zip_file.write(tmp_path / member, member)
+    assert file_format(str(download)) == 'zip'
+
+    workdir = tmp_path / 'out'
+    workdir.mkdir()
+    merged = process_file(str(download), str(workdir))
+    assert merged == str(workdir / 'SURF_20241128.nc')
+    assert not download.exists()
+    assert file_format(merged) in ('netcdf4', 'netcdf3')
+    with xr.open_dataset(merged) as ds:
+        assert set(ds.data_vars) == {'t2m', 'tp'}
+        assert ds.sizes['valid_time'] == 24
+        np.testing.assert_allclose(ds['t2m'].values, 280.)
+        np.testing.assert_allclose(ds['tp'].values, 0.001)
+    assert os.listdir(workdir) == ['SURF_20241128.nc']
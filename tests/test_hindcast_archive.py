@@ -0,0 +1,32 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+xr = pytest.importorskip("xarray")
+pytest.importorskip("zarr")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from hindcast_archive import append_to_archive, open_archive  # noqa: E402
+
+
+def forecast_day(day, value):
+    times = pd.date_range(day, periods=24, freq='h')
+    data = np.full((24, 2, 3), value, dtype='float32')
+    return xr.Dataset({'t2m': (('time', 'latitude', 'longitude'), data)},
+                      coords={'time': times, 'latitude': [46.5, 46.0], 'longitude': [9.0, 9.5, 10.0]})
+
+
+def test_rerun_of_a_cycle_overwrites_its_day(tmp_path):
+    store = str(tmp_path / 'hindcast_SURF.zarr')
+    assert append_to_archive(forecast_day('2026-10-16', 1.), store) == 24
+    assert append_to_archive(forecast_day('2026-10-17', 2.), store) == 24
+    # same-day rerun of the fetch with a new forecast
+    assert append_to_archive(forecast_day('2026-10-17', 3.), store) == 24
+
+    with open_archive(store) as ds:
+        assert ds.sizes['time'] == 48
+        np.testing.assert_array_equal(ds['t2m'].sel(time='2026-10-16').values, 1.)
+        np.testing.assert_array_equal(ds['t2m'].sel(time='2026-10-17').values, 3.)
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("ecmwf.opendata")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ifs_opendata import (FC1_STEPS, FC2_STEPS, FC2_LEVELS, PLEV_LEVELS, PLEV_PARAMS,  # noqa: E402
+                          SURF_PARAMS, cycle_date, poll_and_retrieve, wait_for_steps)
+
+FIELD = 32  # bytes of every canned GRIB message
+STEP_PATTERN = re.compile(r"-(\d+)h-\w+-\w+\.(index|grib2)$")
+
+
+def canned_fields(step):
+    """Index entries of one step: all surface parameters and all parameters on PLEV_LEVELS."""
+    fields = [{"param": param, "levtype": "sfc"} for param in SURF_PARAMS]
+    fields += [{"param": param, "levtype": "pl", "levelist": str(level)}
+               for param in PLEV_PARAMS for level in PLEV_LEVELS]
+    for i, field in enumerate(fields):
+        field.update(type="fc", step=str(step), _offset=i * FIELD, _length=FIELD)
+    return fields
+
+
+class OpenDataHandler(BaseHTTPRequestHandler):
+    """Serves canned .index and .grib2 files for any cycle with the data.ecmwf.int layout."""
+
+    def log_message(self, *args):
+        pass
+
+    def body(self):
+        match = STEP_PATTERN.search(self.path)
+        if match is None:
+            return None
+        fields = canned_fields(int(match.group(1)))
+        if match.group(2) == "index":
+            return b"".join(json.dumps(field).encode() + b"\n" for field in fields)
+        return b"".join(f"{f['step']}:{f['param']}:{f.get('levelist', '')}".ljust(FIELD).encode() for f in fields)
+
+    def published(self):
+        server = self.server
+        with server.lock:
+            server.probes[self.path] += 1
+            published = server.probes[self.path] > server.unpublished.get(STEP_PATTERN.search(self.path).group(1), 0)
+            if published:
+                server.published_at.setdefault(self.path, time.monotonic())
+            return published
+
+    def respond(self, send_body):
+        body = self.body()
+        if body is None or (self.path.endswith(".index") and not self.published()):
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def do_GET(self):
+        server = self.server
+        if not self.path.endswith(".grib2"):
+            with server.lock:
+                server.index_reads.append((time.monotonic(), self.path))
+            self.respond(True)
+            return
+        with server.lock:
+            server.downloads.append((time.monotonic(), self.path))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        time.sleep(0.01)
+        self.respond(True)
+        with server.lock:
+            server.in_flight -= 1
+
+
+@pytest.fixture
+def opendata_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OpenDataHandler)
+    server.lock = threading.Lock()
+    server.probes = Counter()  # requests per .index path
+    server.unpublished = {}  # step (str) -> number of probes answered 404 before it is published
+    server.published_at = {}  # time .index paths were first answered 200
+    server.index_reads = []  # (time, path) of every .index GET, the start of a retrieval
+    server.downloads = []  # (time, path) of every .grib2 GET
+    server.in_flight = server.max_in_flight = 0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_poll_and_retrieve_concurrent_with_cache(opendata_server, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    first, second = tmp_path / "first", tmp_path / "second"
+    first.mkdir()
+    second.mkdir()
+
+    stats = asyncio.run(poll_and_retrieve(source=opendata_server.url, directory=str(first), cache_dir=cache_dir,
+                                          poll=0.01))
+    expected = {
+        "SURF_fc1.grib2": len(FC1_STEPS) * len(SURF_PARAMS) * FIELD,
+        "PLEV_fc1.grib2": len(FC1_STEPS) * len(PLEV_PARAMS) * len(PLEV_LEVELS) * FIELD,
+        "SURF_fc2.grib2": len(FC2_STEPS) * len(SURF_PARAMS) * FIELD,
+        "PLEV_fc2.grib2": len(FC2_STEPS) * len(PLEV_PARAMS) * len(FC2_LEVELS) * FIELD,
+    }
+    assert [os.path.basename(s["target"]) for s in stats] == list(expected)
+    for s in stats:
+        name = os.path.basename(s["target"])
+        assert s["bytes"] == expected[name] == os.path.getsize(first / name)
+        assert not s["cached"]
+        assert s["seconds"] > 0
+    # only the requested levels are kept from the index
+    with open(first / "PLEV_fc2.grib2", "rb") as f:
+        assert f.read(FIELD).decode().strip() == "150:gh:1000"
+    assert opendata_server.max_in_flight > 1
+
+    n_downloads = len(opendata_server.downloads)
+    stats = asyncio.run(poll_and_retrieve(source=opendata_server.url, directory=str(second), cache_dir=cache_dir,
+                                          poll=0.01))
+    assert all(s["cached"] for s in stats)
+    assert [s["bytes"] for s in stats] == list(expected.values())
+    assert len(opendata_server.downloads) == n_downloads
+    for name in expected:
+        assert (first / name).read_bytes() == (second / name).read_bytes()
+
+
+def test_requests_start_as_soon_as_their_steps_are_published(opendata_server, tmp_path):
+    # the fc2 steps appear only after 3 probes, the fc1 steps right away
+    opendata_server.unpublished = {str(step): 3 for step in FC2_STEPS}
+    stats = asyncio.run(poll_and_retrieve(source=opendata_server.url, directory=str(tmp_path), poll=0.05,
+                                          max_poll=0.1, timeout=10))
+    assert [os.path.basename(s["target"]) for s in stats] == ["SURF_fc1.grib2", "PLEV_fc1.grib2",
+                                                              "SURF_fc2.grib2", "PLEV_fc2.grib2"]
+
+    def steps_of(path):
+        return int(STEP_PATTERN.search(path).group(1))
+
+    fc2_published = [t for path, t in opendata_server.published_at.items() if steps_of(path) in FC2_STEPS]
+    assert len(fc2_published) == len(FC2_STEPS)
+    fc1_reads = [t for t, path in opendata_server.index_reads if steps_of(path) in FC1_STEPS]
+    fc2_reads = [t for t, path in opendata_server.index_reads if steps_of(path) in FC2_STEPS]
+    # the fc1 retrievals did not wait for fc2, the fc2 ones not started before all its steps were out
+    assert min(fc1_reads) < min(fc2_published)
+    assert min(fc2_reads) > max(fc2_published)
+    assert opendata_server.downloads
+    assert all(opendata_server.probes[path] > 3 for path in opendata_server.published_at
+               if steps_of(path) in FC2_STEPS)
+
+
+def test_wait_for_steps_times_out(opendata_server):
+    opendata_server.unpublished = {"3": 10**6}
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        asyncio.run(wait_for_steps(opendata_server.url, cycle_date(0), 0, [0, 3], poll=0.01, max_poll=0.04,
+                                   timeout=0.2))
+    assert time.monotonic() - start < 2
+    probes = {int(STEP_PATTERN.search(path).group(1)): n for path, n in opendata_server.probes.items()}
+    # a published step is not probed again, the missing one with a growing delay
+    assert probes[0] == 1
+    assert 2 < probes[3] < 20
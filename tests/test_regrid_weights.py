@@ -0,0 +1,39 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+xr = pytest.importorskip("xarray")
+pytest.importorskip("scipy")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from regrid_weights import regrid  # noqa: E402
+
+
+def forecast_plev():
+    """PLEV forecast on a descending-latitude 0.25 degree grid, after a surface variable so the
+    dataset dimensions are ordered (time, latitude, longitude, level)."""
+    rng = np.random.default_rng(0)
+    times = pd.date_range('2026-10-16', periods=3, freq='h')
+    levels = [1000., 850., 500.]
+    lat, lon = np.arange(47., 45.9, -0.25), np.arange(9., 10.6, 0.25)
+    return xr.Dataset(
+        {'sp': (('time', 'latitude', 'longitude'), rng.normal(size=(len(times), len(lat), len(lon)))),
+         't': (('time', 'level', 'latitude', 'longitude'),
+               rng.normal(size=(len(times), len(levels), len(lat), len(lon))).astype('float32'), {'units': 'K'})},
+        coords={'time': times, 'level': levels, 'latitude': lat, 'longitude': lon})
+
+
+def test_regrid_matches_interp():
+    ds = forecast_plev()
+    # ERA5-like target grid, partly outside the source grid
+    dst_lat, dst_lon = np.arange(47.2, 45.9, -0.3), np.arange(8.9, 10.5, 0.3)
+    out = regrid(ds, dst_lat, dst_lon)
+    expected = ds.interp(latitude=dst_lat, longitude=dst_lon)
+    for name in ds.data_vars:
+        assert out[name].dims == expected[name].dims == ds[name].dims
+        assert out[name].dtype == ds[name].dtype
+        assert out[name].attrs == ds[name].attrs
+        xr.testing.assert_allclose(out[name], expected[name].astype(ds[name].dtype), rtol=1e-5)
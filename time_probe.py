@@ -0,0 +1,114 @@
+# Header-only probe of the time axis of NetCDF files.
+# Reads the attributes and the first / last elements of the time variable only,
+# instead of opening the dataset and decoding every timestamp. Results are
+# memoized per (path, mtime, size), so probing the same monthly SURF/PLEV file
+# again in a run is a dictionary lookup, and a rewritten file is probed afresh.
+
+import os
+from datetime import timedelta
+from netCDF4 import Dataset, num2date
+
+
+_probes = {}
+
+
+def probe_time(nc_file, time_var='time'):
+    """
+    Read the extent of the time axis of a NetCDF file.
+
+    Parameters:
+    - nc_file (str): Path to the NetCDF file.
+    - time_var (str): Name of the time variable.
+
+    Returns:
+    - probe (dict): 'first' and 'last' timestamps (datetime), 'length' (number of
+      timesteps), 'step' (timedelta between the last two timesteps, None for a
+      single timestep), 'units' and 'calendar' of the time variable.
+    """
+    stat = os.stat(nc_file)
+    key = (os.path.abspath(nc_file), time_var, stat.st_mtime_ns, stat.st_size)
+    if key not in _probes:
+        with Dataset(nc_file, 'r') as nc_dataset:
+            time_variable = nc_dataset.variables[time_var]
+            length = time_variable.shape[0]
+            units = time_variable.units
+            calendar = getattr(time_variable, 'calendar', 'standard')
+            # only the elements needed: first, second to last and last
+            values = [time_variable[0], time_variable[max(length - 2, 0)], time_variable[length - 1]]
+        first, before_last, last = num2date(values, units=units, calendar=calendar,
+                                            only_use_cftime_datetimes=False)
+        _probes[key] = {
+            'first': first,
+            'last': last,
+            'length': length,
+            'step': last - before_last if length > 1 else None,
+            'units': units,
+            'calendar': calendar,
+        }
+    return _probes[key]
+
+
+def get_first_timestamp(nc_file):
+    """
+    Extract the first timestamp from a NetCDF file.
+
+    Parameters:
+    - nc_file (str): Path to the NetCDF file.
+
+    Returns:
+    - first_timestamp (datetime): The first timestamp in the NetCDF file.
+    """
+    return probe_time(nc_file)['first']
+
+
+def get_last_timestamp(nc_file):
+    """
+    Extract the last timestamp from a NetCDF file.
+
+    Parameters:
+    - nc_file (str): Path to the NetCDF file.
+
+    Returns:
+    - last_timestamp (datetime): The last timestamp in the NetCDF file.
+    """
+    return probe_time(nc_file)['last']
+
+
+def get_last_fullday_timestamp(nc_file):
+    """
+    Extract the last timestamp at hour 23 (end of the last complete day) of an hourly NetCDF file.
+
+    Parameters:
+    - nc_file (str): Path to the NetCDF file, with a regular hourly time axis.
+
+    Returns:
+    - last_timestamp (datetime): The last timestamp where hour is 23, None if there is none.
+    """
+    probe = probe_time(nc_file)
+    last_timestamp = probe['last'] - timedelta(hours=(probe['last'].hour + 1) % 24)
+    if last_timestamp < probe['first']:
+        print("No timestamp found where hour is 23.")
+        return None
+    print(f"The last timestamp where hour is 23 (fullday): {last_timestamp}")
+    return last_timestamp
+
+
+def covers_hourly(nc_file, start_date, end_date):
+    """
+    Check from the header alone whether a file holds every hour from start_date to end_date.
+
+    A file whose time axis starts and ends at the expected hours with the expected
+    number of timesteps is complete (time axes are written sorted and without duplicates).
+
+    Parameters:
+    - nc_file (str): Path to the NetCDF file.
+    - start_date (datetime): First expected timestep.
+    - end_date (datetime): Last expected timestep.
+
+    Returns:
+    - complete (bool): True if all hourly timesteps are present.
+    """
+    probe = probe_time(nc_file)
+    expected_length = int((end_date - start_date) / timedelta(hours=1)) + 1
+    return (probe['length'] == expected_length and
+            probe['first'] == start_date and probe['last'] == end_date)